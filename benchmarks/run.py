@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime
+from time import perf_counter_ns
+
+# main reads DRY_RUN when imported, the stubs fill the orders so there is nothing to dry run
+os.environ.setdefault('DRY_RUN', 'False')
+os.environ.setdefault('METRICS_PORT', '0')
+
+from benchmarks.stubs import StubQuoteContext, StubTradeContext
+from trade import api
+from trade.connection import ConnectionManager
+from trade.scheduler import RequestScheduler, TTLCache
+from trade.strategy import GridTradingStrategy
+
+SYMBOL = 'HK.07226'
+IE_SYMBOL = 'HK.07552'
+STRATEGY_PARAMS = dict(grid_upper_limit_price=5.6, grid_lower_limit_price=3.6, grid_count=10,
+                       grid_lower_limit_position=10000, ie_max_position=10000, lot_size=100, ie_lot_size=100)
+# two prices two grids apart, alternating between them rebalances on every iteration
+PIPELINE_PRICES = [4.05, 4.45]
+PIPELINE_ITERATIONS = 2000
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """
+    Register a benchmark, a function returning the result dict
+    """
+    BENCHMARKS[func.__name__[len("bench_"):]] = func
+    return func
+
+
+def measure(func, repeat=5):
+    """
+    Time a function with timeit, every repeat runs long enough for the timer resolution
+
+    :return: median and min nanoseconds per call, calls per second and the number of calls per repeat
+    :rtype: dict
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_call = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    median = statistics.median(per_call)
+    return {"ns_per_call": median * 1e9, "min_ns": min(per_call) * 1e9, "calls_per_s": 1 / median,
+            "number": number}
+
+
+def use_stub_connection(positions=None):
+    """
+    Point trade.api to instant stand-ins of OpenD without rate limit and snapshot cache
+
+    :return: quote context, trade context
+    :rtype: (StubQuoteContext, StubTradeContext)
+    """
+    quote_ctx = StubQuoteContext({SYMBOL: PIPELINE_PRICES[0], IE_SYMBOL: 5.0})
+    trd_ctx = StubTradeContext(positions or {})
+    api.connection = ConnectionManager(quote_factory=lambda: quote_ctx, trade_factory=lambda: trd_ctx)
+    api.scheduler = RequestScheduler(limits={})
+    api.snapshot_cache = TTLCache(0)
+    return quote_ctx, trd_ctx
+
+
+@benchmark
+def bench_cal_order_quantity():
+    strategy = GridTradingStrategy(**STRATEGY_PARAMS)
+    return measure(lambda: strategy.cal_order_quantity(4.55, 5000, 4000))
+
+
+@benchmark
+def bench_strategy_init_10000_grids():
+    params = dict(STRATEGY_PARAMS, grid_upper_limit_price=60, grid_lower_limit_price=10, grid_count=10000,
+                  grid_lower_limit_position=1000000, ie_max_position=1000000)
+    return measure(lambda: GridTradingStrategy(**params), repeat=3)
+
+
+@benchmark
+def bench_get_position():
+    positions = {f"HK.{i:05d}": i * 100 for i in range(20)}
+    positions[SYMBOL] = 5000
+    use_stub_connection(positions)
+    return measure(lambda: api.get_position(SYMBOL))
+
+
+@benchmark
+def bench_get_latest_price():
+    use_stub_connection()
+    return measure(lambda: api.get_latest_price(SYMBOL))
+
+
+@benchmark
+def bench_get_latest_price_cached():
+    use_stub_connection()
+    api.snapshot_cache = TTLCache(3600)
+    return measure(lambda: api.get_latest_price(SYMBOL))
+
+
+@benchmark
+def bench_tick_pipeline():
+    """
+    One iteration of the poll loop against the stubs: snapshot, strategy, sell and buy orders, fill push, deal push
+    """
+    import main
+    from trade.execution import OrderExecutor
+    from trade.push import TradeOrderPushHandler, TradeDealPushHandler
+
+    quote_ctx, _ = use_stub_connection()
+    main.broker_state = state = main.BrokerState()
+    api.subscribe_trade(TradeOrderPushHandler(state.update_orders), TradeDealPushHandler(state.update_deals))
+    executor = OrderExecutor(state, main.place_market_order, api.cancel_order)
+    strategy = GridTradingStrategy(**STRATEGY_PARAMS)
+    symbols = [SYMBOL, IE_SYMBOL]
+
+    latencies = []
+    start = perf_counter_ns()
+    for i in range(PIPELINE_ITERATIONS):
+        quote_ctx.prices[SYMBOL] = PIPELINE_PRICES[i % 2]
+        iteration_start = perf_counter_ns()
+        prices = api.get_latest_prices(symbols)
+        pending = main.rebalance(executor, strategy, SYMBOL, IE_SYMBOL, prices[SYMBOL], prices[IE_SYMBOL])
+        if pending is not None:
+            pending.result()
+        latencies.append(perf_counter_ns() - iteration_start)
+    elapsed = perf_counter_ns() - start
+
+    latencies.sort()
+    return {"ns_per_call": statistics.median(latencies), "min_ns": latencies[0],
+            "p99_ns": latencies[int(len(latencies) * 0.99)], "calls_per_s": PIPELINE_ITERATIONS / elapsed * 1e9,
+            "number": PIPELINE_ITERATIONS}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names):
+    """
+    Run the benchmarks
+
+    :param names: benchmark names
+    :type names: list[str]
+    :return: report with the environment and the result of every benchmark
+    :rtype: dict
+    """
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name]()
+        print("{:<32} {:>14.0f} ns/call {:>14.0f} calls/s".format(name, results[name]['ns_per_call'],
+                                                                  results[name]['calls_per_s']))
+    return {"time": datetime.now().isoformat(timespec='seconds'), "commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "results": results}
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare the time per call with a baseline report
+
+    :param threshold: relative slow down considered a regression, e.g. 0.2 for 20%
+    :type threshold: float
+    :return: names of the regressed benchmarks
+    :rtype: list[str]
+    """
+    regressions = []
+    print("\nCompared with {} ({})".format(baseline.get('commit'), baseline.get('time')))
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        change = result['ns_per_call'] / base['ns_per_call'] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print("{:<32} {:>14.0f} -> {:>14.0f} ns/call {:>+8.1%}{}".format(
+            name, base['ns_per_call'], result['ns_per_call'], change, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the strategy, the OpenD wrappers and the tick pipeline '
+                                                 'against stand-ins of OpenD')
+    parser.add_argument('-k', '--filter', type=str, default='', help='only run the benchmarks containing this text')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the report to this json file')
+    parser.add_argument('-c', '--compare', type=str, default=None, help='baseline json report to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='relative slow down reported as a regression')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    names = [name for name in BENCHMARKS if args['filter'] in name]
+    report = run(names)
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args['compare']:
+        with open(args['compare']) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args['threshold']):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,98 @@
+import itertools
+
+import pandas as pd
+from futu import RET_OK
+
+from trade.fake_opend import ORDER_COLUMNS
+from trade.push import TradeOrderPushHandler, TradeDealPushHandler
+
+
+class StubQuoteContext:
+    """
+    Stand-in of OpenQuoteContext answering instantly with data frames shaped like OpenD's
+    """
+
+    def __init__(self, prices):
+        """
+
+        :param prices: symbol -> last price
+        :type prices: dict[str, float]
+        """
+        self.prices = prices
+
+    def get_market_snapshot(self, code_list):
+        code_list = [code_list] if isinstance(code_list, str) else list(code_list)
+        return RET_OK, pd.DataFrame({'code': code_list, 'update_time': '2021-01-04 09:30:00',
+                                     'last_price': [self.prices[code] for code in code_list]})
+
+    def get_global_state(self):
+        return RET_OK, {'market_hk': 'MORNING'}
+
+    def get_stock_basicinfo(self, market, stock_type='STOCK', code_list=None):
+        code_list = list(code_list or [])
+        return RET_OK, pd.DataFrame({'code': code_list, 'lot_size': [100] * len(code_list)})
+
+    def set_handler(self, handler):
+        return RET_OK
+
+    def subscribe(self, code_list, subtype_list, **kwargs):
+        return RET_OK, None
+
+    def close(self):
+        pass
+
+
+class StubTradeContext:
+    """
+    Stand-in of OpenHKTradeContext filling every order all immediately and pushing it from the calling thread
+    """
+
+    def __init__(self, positions):
+        """
+
+        :param positions: symbol -> position
+        :type positions: dict[str, int]
+        """
+        self.positions = dict(positions)
+        self.order_handler = None
+        self.deal_handler = None
+        self._ids = itertools.count(1)
+
+    def unlock_trade(self, password=None, **kwargs):
+        return RET_OK, None
+
+    def get_acc_list(self):
+        return RET_OK, pd.DataFrame({'acc_id': [0]})
+
+    def set_handler(self, handler):
+        if isinstance(handler, TradeOrderPushHandler):
+            self.order_handler = handler
+        elif isinstance(handler, TradeDealPushHandler):
+            self.deal_handler = handler
+        return RET_OK
+
+    def position_list_query(self, **kwargs):
+        return RET_OK, pd.DataFrame({'code': list(self.positions), 'qty': list(self.positions.values())})
+
+    def order_list_query(self, **kwargs):
+        return RET_OK, pd.DataFrame(columns=ORDER_COLUMNS)
+
+    def place_order(self, price, qty, code, trd_side, order_type=None, **kwargs):
+        order_id = str(next(self._ids))
+        buy = str(trd_side) == 'BUY'
+        self.positions[code] = self.positions.get(code, 0) + (qty if buy else -qty)
+        if self.order_handler is not None:
+            self.order_handler.callback(pd.DataFrame([{
+                'order_id': order_id, 'code': code, 'trd_side': str(trd_side), 'order_type': str(order_type),
+                'order_status': 'FILLED_ALL', 'qty': qty, 'price': price, 'dealt_qty': qty, 'dealt_avg_price': price,
+                'create_time': '', 'updated_time': ''}], columns=ORDER_COLUMNS))
+        if self.deal_handler is not None:
+            self.deal_handler.callback(pd.DataFrame({'deal_id': [order_id], 'order_id': [order_id], 'code': [code],
+                                                     'trd_side': [str(trd_side)], 'qty': [qty], 'price': [price]}))
+        return RET_OK, pd.DataFrame({'order_id': [order_id]})
+
+    def modify_order(self, modify_order_op, order_id, qty, price, **kwargs):
+        return RET_OK, pd.DataFrame({'order_id': [order_id]})
+
+    def close(self):
+        pass
@@ -1,15 +1,32 @@
 from pathlib import Path
 import os
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 import argparse
+import atexit
+import multiprocessing
 import re
 import traceback
-from time import sleep
+from collections import namedtuple
+from queue import Queue, Empty, SimpleQueue
+from time import monotonic, perf_counter_ns
 
 import yaml
+from trade import metrics
+from trade.accounting import Accounting
+from trade.adaptive import AdaptiveGrid
 from trade.api import *
+from trade.broker_state import BrokerState, FILLED_ALL
+from trade.checkpoint import StateStore, config_fingerprint
+from trade.config_watcher import ConfigWatcher
+from trade.execution import OrderExecutor, FAILED_STATUSES
+from trade.journal import Journal, SIGNAL, ORDER
+from trade.orderbook import OrderBookCache, LimitExecution
+from trade.profiling import Profiler
+from trade.push import QuotePushHandler, OrderBookPushHandler, TradeOrderPushHandler, TradeDealPushHandler
+from trade.quote_bus import QuoteBus, QuoteReader
 from trade.strategy import GridTradingStrategy
+from trade.trading_calendar import DEFAULT_CALENDAR_FILE, TradingCalendar, SessionGate
 
 logger = logging.getLogger("futu-grid-trading")
 LOG_FILE = "/var/log/futu-grid-trading/futu-grid-trading.log"
@@ -19,85 +36,132 @@ FORMATTER = logging.Formatter(
     '%(asctime)s.%(msecs)03d %(name)s %(levelname)s %(filename)s:%(lineno)d %(funcName)s(): %(message)s',
     '%d %b %Y %H:%M:%S')
 
-PRICE_ADJUST_LIMIT = 0.02
+POLL_INTERVAL = 10
+RECONCILE_INTERVAL = 300
+# seconds for the limit execution to fill an order
+LIMIT_TIMEOUT = 30
+# seconds on top of the max duration of a limit execution before its leg times out, e.g. for the order requests
+LIMIT_SLACK = 5
+# max seconds between two checks of the adaptive grids in bus mode
+ADAPT_INTERVAL = 10
+# min and max seconds a grid worker sleeps between two reads of the quote bus, doubled while no tick arrives
+WORKER_MIN_IDLE = 0.001
+WORKER_MAX_IDLE = 0.1
+# seconds to wait for the grid workers to stop before terminating them
+WORKER_STOP_TIMEOUT = 5
+# max seconds between two checks of the grid workers being alive in bus mode
+WORKER_CHECK_INTERVAL = 5
+# max number of times the grid workers are restarted after a worker died
+MAX_WORKER_RESTARTS = 5
 
 DRY_RUN = os.environ["DRY_RUN"].lower() == 'true'
+# 0 disables the metrics endpoint
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9400))
+METRICS_LOG_INTERVAL = 300
+
+CAL_ORDER_QUANTITY_STAGE = metrics.stage("cal_order_quantity")
+
+broker_state = BrokerState(market_now)
+# trade journal, created by main()
+journal = None
+# warm start state, created by main()
+state_store = None
+# P&L of the fills, created by main()
+accounting = None
+# adaptive grid of every pair, None if the pair is not adaptive, created by main()
+adaptive_grids = []
+
+# a symbol / inverse equity pair traded by a grid trading strategy
+Pair = namedtuple('Pair', ['symbol', 'ie_symbol', 'strategy'])
+# the grid worker processes with the queue of strategy updates of each, stopped together by setting the stop event
+GridWorkers = namedtuple('GridWorkers', ['processes', 'updates', 'stop'])
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-c', '--config', type=str, required=True, help='config file')
+    parser.add_argument('-m', '--mode', type=str, default='push', choices=['push', 'poll', 'bus'],
+                        help='push: trade on quote push when price crosses a grid, poll: poll snapshot periodically, '
+                             'bus: like push with the grids watched by worker processes')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes of the bus mode, default to the number of cores')
+    parser.add_argument('-e', '--execution', type=str, default='market', choices=['market', 'limit'],
+                        help='market: one market order per leg, limit: limit orders priced off the order book push')
     args = vars(parser.parse_args())
     return args
 
 
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue the log records as they are, the message is formatted by the listener thread instead of the logging thread
+
+    The arguments of the log calls must not be modified after logging, e.g. log a copy of a dict.
+    """
+
+    def prepare(self, record):
+        return record
+
+
 def configure_logger():
+    """
+    Log to the rotating log file through a queue, so that the trading threads never wait for the disk
+
+    :return: the listener writing the log file in a background thread
+    :rtype: QueueListener
+    """
     Path(LOG_FILE).parent.mkdir(exist_ok=True, parents=True)
     logger.setLevel(getattr(logging, LOG_LEVEL))
     file_handler = TimedRotatingFileHandler(LOG_FILE, "midnight", 1, 365)
     file_handler.setFormatter(FORMATTER)
     file_handler.suffix = "%Y-%m-%d.log"
     file_handler.extMatch = re.compile(r"^\d{4}-\d{2}-\d{2}.log$")
-    logger.addHandler(file_handler)
 
+    log_queue = SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # write the queued records at exit
+    atexit.register(listener.stop)
+    return listener
 
-def wait_order_filled_all(order_id, timeout=30):
-    """
-    Wait for the order to be filled all
 
-    :param order_id:
-    :type order_id: str
-    :param timeout:
-    :type timeout: float
-    :return:
-    :rtype: bool
+def place_market_order(symbol, quantity, trade_side):
     """
-    sleep(1)
-    if check_order_filled_all(order_id):
-        return True
+    Place a market order, the orders of OrderExecutor
 
-    sleep(timeout)
-    if check_order_filled_all(order_id):
-        return True
-    else:
-        raise TimeoutError(f"Order '{order_id}' is not filled all after {timeout} seconds")
+    :param symbol: a single stock stick, e.g. 'HK.07266'
+    :type symbol: str
+    :param quantity: order quantity
+    :type quantity: int
+    :param trade_side: ['BUY', 'SELL']
+    :type trade_side: str
+    :return: order id, None if dry run is on
+    :rtype: str or None
+    """
+    return send_order(symbol, quantity, trade_side)
 
 
-def place_order(symbol, quantity, price, trade_side):
+def place_limit_order(symbol, quantity, price, trade_side):
     """
-    Place order with different trade side
+    Place a limit order, the child orders of LimitExecution
 
     :param symbol: a single stock stick, e.g. 'HK.07266'
     :type symbol: str
     :param quantity: order quantity
     :type quantity: int
-    :param price: current market price
+    :param price: limit price
     :type price: float
     :param trade_side: ['BUY', 'SELL']
     :type trade_side: str
-    :return:
-    :rtype:
+    :return: order id, None if dry run is on
+    :rtype: str or None
     """
-    logger.info(f"Placing {trade_side} order, symbol={symbol}, quantity={quantity}, price={price}, "
-                f"adjust_limit={PRICE_ADJUST_LIMIT}")
-
-    if DRY_RUN:
-        logger.debug("Dry run is on, do not process")
-    else:
-        if trade_side == "BUY":
-            order_id = place_buy_normal_order(symbol, quantity, price, PRICE_ADJUST_LIMIT)
-        elif trade_side == "SELL":
-            order_id = place_sell_normal_order(symbol, quantity, price, -PRICE_ADJUST_LIMIT)
-        else:
-            raise ValueError(f"Expect trade_side to be ['BUY', 'SELL'] but got '{trade_side}'")
-
-        logger.info(f"Order placed, id={order_id}")
-        wait_order_filled_all(order_id)
+    return send_order(symbol, quantity, trade_side, price)
 
 
-def place_market_order(symbol, quantity, trade_side):
+def send_order(symbol, quantity, trade_side, price=None):
     """
-    Place order with different trade side
+    Place a market order, or a limit order at the price, and track it until it is finished
 
     :param symbol: a single stock stick, e.g. 'HK.07266'
     :type symbol: str
@@ -105,76 +169,850 @@ def place_market_order(symbol, quantity, trade_side):
     :type quantity: int
     :param trade_side: ['BUY', 'SELL']
     :type trade_side: str
-    :return:
-    :rtype:
+    :param price: limit price, None for a market order
+    :type price: float or None
+    :return: order id, None if dry run is on
+    :rtype: str or None
     """
     assert quantity > 0
-    logger.info(f"Placing {trade_side} order, symbol={symbol}, quantity={quantity}")
+    if price is None:
+        logger.info("Placing %s order, symbol=%s, quantity=%s", trade_side, symbol, quantity)
+    else:
+        logger.info("Placing %s limit order, symbol=%s, quantity=%s, price=%s", trade_side, symbol, quantity, price)
 
     if DRY_RUN:
         logger.debug("Dry run is on, order not being placed")
+        return None
+
+    if trade_side == "BUY":
+        order_id = place_buy_market_order(symbol, quantity) if price is None else \
+            place_buy_normal_order(symbol, quantity, price)
+    elif trade_side == "SELL":
+        order_id = place_sell_market_order(symbol, quantity) if price is None else \
+            place_sell_normal_order(symbol, quantity, price)
     else:
-        if trade_side == "BUY":
-            place_buy_market_order(symbol, quantity)
-        elif trade_side == "SELL":
-            place_sell_market_order(symbol, quantity)
-        else:
-            raise ValueError(f"Expect trade_side to be ['BUY', 'SELL'] but got '{trade_side}'")
+        raise ValueError(f"Expect trade_side to be ['BUY', 'SELL'] but got '{trade_side}'")
 
-        logger.info(f"Order placed")
+    logger.info("Order placed, id=%s", order_id)
+    track_order(order_id, symbol, quantity, trade_side, 0.0 if price is None else price)
+    return order_id
 
 
-def main(args):
-    with open(args['config']) as f:
-        config = yaml.safe_load(f)
+def track_order(order_id, symbol, quantity, trade_side, price=0.0):
+    """
+    Keep a placed order in the warm start state until it is finished and record it in the journal
 
-    symbol = str(config['symbol'])
-    # inverse equity
-    ie_symbol = str(config['ie_symbol'])
+    :param price: limit price, 0 for a market order
+    :type price: float
+    """
+    if state_store is not None:
+        state_store.add_pending_order(order_id, symbol, trade_side, quantity)
+        # the push may arrive before the order id is returned
+        if is_finished(broker_state.get_order_status(order_id)):
+            state_store.remove_pending_orders([order_id])
+    if journal is not None:
+        journal.record(ORDER, symbol, quantity, price, 1 if trade_side == "BUY" else -1, order_id)
 
-    lot_size = get_lot_size(symbol)
-    ie_lot_size = get_lot_size(ie_symbol)
 
-    configure_logger()
-    strategy = GridTradingStrategy(**config['grid_trading_strategy'], lot_size=lot_size, ie_lot_size=ie_lot_size)
-    logger.info("Futu-grid-trading started")
+def sync_broker_state(log_drift=True):
+    """
+    Reconcile the broker state with the position and order queries
+
+    :param log_drift: log the positions drifted from the query
+    :type log_drift: bool
+    :return: the time of the reconciliation
+    :rtype: float
+    """
+    # the deals made after the query is sent are applied on top of it
+    query_time = market_now()
+    drift = broker_state.load_positions(query_positions(), query_time)
+    if log_drift:
+        for code, (cached, queried) in drift.items():
+            logger.warning(f"Position of {code} drifted, cached={cached}, queried={queried}")
+    if journal is not None:
+        journal.record_positions(broker_state.get_positions())
+    broker_state.update_orders(query_orders())
+    if state_store is not None:
+        state_store.set_positions(broker_state.get_positions())
+        # the push of orders finished while disconnected may be missed
+        state_store.remove_pending_orders([order_id for order_id in state_store.pending_orders
+                                           if is_finished(broker_state.get_order_status(order_id))])
+    return monotonic()
+
+
+def is_finished(order_status):
+    """
+    :param order_status: order status, None if the order is unknown
+    :type order_status: str or None
+    :return: if the order will not be filled any more
+    :rtype: bool
+    """
+    return order_status == FILLED_ALL or order_status in FAILED_STATUSES
+
+
+def on_order(order):
+    """
+    Forget the finished orders in the warm start state
+
+    :param order: order dict of the broker state
+    :type order: dict
+    """
+    if state_store is not None and is_finished(order['order_status']):
+        state_store.remove_pending_orders([order['order_id']])
+
+
+def start_limit_execution(symbols):
+    """
+    Subscribe the order books of the symbols and create the limit execution working the orders against them
+
+    :param symbols: the symbols of all pairs
+    :type symbols: list[str]
+    :return: the place_order of OrderExecutor, called with (symbol, quantity, trade_side) and returning None once the
+        order is filled all or its timeout is over
+    :rtype: LimitExecution
+    """
+    books = OrderBookCache()
+    handler = OrderBookPushHandler(books.update)
+    subscribe_order_book(symbols, handler)
+    # the push only comes on a change, seed the books not pushed yet
+    for symbol in symbols:
+        data = get_order_book(symbol)
+        if books.get(symbol) is None:
+            handler.handle_order_book(data)
+    return LimitExecution(books, broker_state, place_limit_order, cancel_order, get_lot_size, timeout=LIMIT_TIMEOUT,
+                          throttle=scheduler.limiter('place_order'), clock=market_time)
+
+
+def resume_pending_orders(executor, pairs):
+    """
+    Wait for the orders placed before a restart instead of placing them again, the broker state must be synced first
+
+    :param executor: order executor placing the orders in the background
+    :type executor: OrderExecutor
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :return: future of the resumed orders of every pair, None if a pair has none
+    :rtype: list[concurrent.futures.Future or None]
+    """
+    pending = [None] * len(pairs)
+    if state_store is None:
+        return pending
+
+    orders = state_store.pending_orders
+    # orders unknown to the broker are from a previous day and not live any more
+    finished = [order_id for order_id in orders if broker_state.get_order_status(order_id) is None
+                or is_finished(broker_state.get_order_status(order_id))]
+    state_store.remove_pending_orders(finished)
+    for i, pair in enumerate(pairs):
+        order_ids = [order_id for order_id, order in orders.items()
+                     if order_id not in finished and order['code'] in (pair.symbol, pair.ie_symbol)]
+        if order_ids:
+            logger.info("Resuming pending orders of %s, ids=%s", pair.symbol, order_ids)
+            pending[i] = executor.resume(order_ids)
+    return pending
+
+
+def rebalance(executor, strategy, symbol, ie_symbol, price, ie_price):
+    """
+    Place the orders to move the positions to the grid of the given price
+
+    :param executor: order executor placing the orders in the background
+    :type executor: OrderExecutor
+    :param strategy: grid trading strategy
+    :type strategy: GridTradingStrategy
+    :param symbol: a single stock stick, e.g. 'HK.07266'
+    :type symbol: str
+    :param ie_symbol: the inverse equity stock stick, e.g. 'HK.07552'
+    :type ie_symbol: str
+    :param price: current market price of symbol
+    :type price: float
+    :param ie_price: current market price of ie_symbol
+    :type ie_price: float
+    :return: future resolved when all orders are filled all, None if there is no order
+    :rtype: concurrent.futures.Future or None
+    """
+    position = broker_state.get_position(symbol)
+    # ie = inverse equity
+    ie_position = broker_state.get_position(ie_symbol)
+
+    logger.debug("price=%s, position=%s, ie_price=%s, ie_position=%s", price, position, ie_price, ie_position)
+
+    start = perf_counter_ns()
+    order_quantity, ie_order_quantity = strategy.cal_order_quantity(price, position, ie_position)
+    CAL_ORDER_QUANTITY_STAGE.record(perf_counter_ns() - start)
+
+    logger.debug("order_quantity=%s, ie_order_quantity=%s", order_quantity, ie_order_quantity)
 
+    if accounting is not None:
+        accounting.mark({symbol: price, ie_symbol: ie_price})
+
+    if order_quantity == 0 and ie_order_quantity == 0:
+        return None
+
+    if journal is not None:
+        grid_index = strategy.cal_grid_index_by_price(price)
+        journal.record(SIGNAL, symbol, order_quantity, price, (order_quantity > 0) - (order_quantity < 0),
+                       grid_index=grid_index)
+        journal.record(SIGNAL, ie_symbol, ie_order_quantity, ie_price,
+                       (ie_order_quantity > 0) - (ie_order_quantity < 0), grid_index=grid_index)
+
+    # the sell orders of both equities are placed together, then the buy orders once the cash is released
+    return executor.execute([(symbol, order_quantity), (ie_symbol, ie_order_quantity)])
+
+
+def finish_rebalance(future, symbol):
+    """
+    Check the result of a finished rebalance, a failed one is logged and the broker state is synced again, so that the
+    pair is rebalanced from the queried positions instead of stopping all pairs
+
+    :param future: future of the rebalance
+    :type future: concurrent.futures.Future
+    :param symbol: stock stick of the pair
+    :type symbol: str
+    :return: if all orders are filled all
+    :rtype: bool
+    """
     try:
-        while 1:
-            if is_market_open():
-                _, price = get_latest_price(symbol)
-                position = get_position(symbol)
-                # ie = inverse equity
-                _, ie_price = get_latest_price(ie_symbol)
-                ie_position = get_position(ie_symbol)
+        future.result()
+        return True
+    except Exception as e:
+        logger.error(f"Rebalance of {symbol} failed, syncing the broker state: {e!r}")
+        sync_broker_state()
+        return False
+
+
+def run_poll(executor, pairs, gate, pending=None, watcher=None):
+    """
+    Poll the market snapshot of all pairs periodically and rebalance on every poll, sleep until the next session while
+    the market is closed
+
+    :param executor: order executor placing the orders in the background
+    :type executor: OrderExecutor
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :param gate: session gate telling if the market is open
+    :type gate: SessionGate
+    :param pending: future of the resumed orders of every pair
+    :type pending: list[concurrent.futures.Future or None]
+    :param watcher: watcher of the config file to reload the strategies from, None to never reload
+    :type watcher: ConfigWatcher
+    """
+    symbols = pair_symbols(pairs)
+    pending = list(pending or [None] * len(pairs))
+    prices = {}
+    reconciled = monotonic()
+    while 1:
+        if monotonic() - reconciled >= RECONCILE_INTERVAL and gate.is_open():
+            reconciled = sync_broker_state()
+
+        if watcher is not None:
+            # swapped between the polls, the pending orders keep going with the strategy that placed them
+            pairs, _ = reload_pairs(pairs, watcher, prices)
+
+        for i, future in enumerate(pending):
+            if future is not None and future.done():
+                finish_rebalance(future, pairs[i].symbol)
+                pending[i] = None
+
+        if all(future is not None for future in pending):
+            logger.debug("Orders are pending")
+        elif gate.is_open():
+            # one snapshot request for the codes of all pairs
+            prices = get_latest_prices(symbols)
+            pairs, _ = adapt_pairs(pairs, prices)
+            for i, pair in enumerate(pairs):
+                if pending[i] is None:
+                    pending[i] = rebalance(executor, pair.strategy, pair.symbol, pair.ie_symbol,
+                                           prices[pair.symbol], prices[pair.ie_symbol])
+        else:
+            logger.debug("Market is not open")
 
-                logger.debug(f"price={price}, position={position}, "
-                             f"ie_price={ie_price}, ie_position={ie_position}, ")
+        market_sleep(gate.seconds_until_open() or POLL_INTERVAL)
 
-                order_quantity, ie_order_quantity = strategy.cal_order_quantity(price, position, ie_position)
 
-                logger.debug(f"order_quantity={order_quantity}, ie_order_quantity={ie_order_quantity}")
+def run_push(executor, pairs, gate, pending=None, watcher=None):
+    """
+    Subscribe the quote push of all pairs and rebalance a pair only when its price crosses a grid
+
+    :param executor: order executor placing the orders in the background
+    :type executor: OrderExecutor
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :param gate: session gate telling if the market is open
+    :type gate: SessionGate
+    :param pending: future of the resumed orders of every pair
+    :type pending: list[concurrent.futures.Future or None]
+    :param watcher: watcher of the config file to reload the strategies from, None to never reload
+    :type watcher: ConfigWatcher
+    """
+    symbols = pair_symbols(pairs)
+    quotes = Queue()
+
+    def on_quote(code, price):
+        cache_quote(code, price)
+        quotes.put((code, price))
+
+    subscribe_quote(symbols, QuotePushHandler(on_quote))
+
+    # seed the prices so that the positions are checked once at startup
+    prices = get_latest_prices(symbols)
+    grid_indexes = [None] * len(pairs)
+    pending = list(pending or [None] * len(pairs))
+    for future in pending:
+        if future is not None:
+            # wake up the loop when the resumed orders are done
+            future.add_done_callback(lambda _: quotes.put((None, None)))
+    reconciled = monotonic()
+
+    while 1:
+        for i, pair in enumerate(pairs):
+            if pending[i] is not None and pending[i].done():
+                if not finish_rebalance(pending[i], pair.symbol):
+                    # check the positions again on this iteration
+                    grid_indexes[i] = None
+                pending[i] = None
+
+            new_grid_index = pair.strategy.cal_grid_index_by_price(prices[pair.symbol])
+            # the prices keep updating while the orders are pending, the latest price is checked once they are done
+            if pending[i] is not None or new_grid_index == grid_indexes[i]:
+                continue
+
+            if not gate.is_open():
+                logger.debug("Market is not open")
+                continue
+
+            logger.debug("Grid index of %s changed from %s to %s", pair.symbol, grid_indexes[i], new_grid_index)
+            pending[i] = rebalance(executor, pair.strategy, pair.symbol, pair.ie_symbol,
+                                   prices[pair.symbol], prices[pair.ie_symbol])
+            if pending[i] is not None:
+                # wake up the loop when the orders are done
+                pending[i].add_done_callback(lambda _: quotes.put((None, None)))
+            grid_indexes[i] = new_grid_index
+
+        if gate.is_open():
+            timeout = max(RECONCILE_INTERVAL - (monotonic() - reconciled), 0)
+        else:
+            # wake up at the next session, e.g. to rebalance a grid crossed while the market is closed
+            timeout = gate.seconds_until_open()
+        if watcher is not None:
+            timeout = min(timeout, watcher.interval)
+        quoted = False
+        try:
+            code, price = quotes.get(timeout=timeout)
+            # only the latest price matters, drop the quotes queued while rebalancing
+            while 1:
+                if code is not None:
+                    prices[code] = price
+                    quoted = True
+                code, price = quotes.get_nowait()
+        except Empty:
+            pass
+
+        changed = []
+        if quoted:
+            pairs, changed = adapt_pairs(pairs, prices)
+        if watcher is not None:
+            pairs, reloaded = reload_pairs(pairs, watcher, prices)
+            changed += reloaded
+        for i in changed:
+            # check the positions of the new grids on the next iteration
+            grid_indexes[i] = None
+
+        if monotonic() - reconciled >= RECONCILE_INTERVAL and gate.is_open():
+            reconciled = sync_broker_state()
+
+
+def grid_worker(bus_name, codes, pairs, signals, updates, stop):
+    """
+    Watch the grids of some pairs on the quote bus in a worker process, and signal the parent process with
+    (symbol, price, ie_price) whenever the price of a pair crosses a grid
+
+    The strategies changed by the parent process, e.g. a recentered adaptive grid, arrive on the updates queue as
+    (index in pairs, pair), and the grid of an updated pair is signaled again on its next tick.
+
+    :param bus_name: name of the quote bus
+    :type bus_name: str
+    :param codes: codes of the quote bus
+    :type codes: list[str]
+    :param pairs: the pairs watched by this worker
+    :type pairs: list[Pair]
+    :param signals: queue to the parent process
+    :type signals: multiprocessing.Queue
+    :param updates: queue of the updated pairs from the parent process
+    :type updates: multiprocessing.Queue
+    :param stop: event set by the parent process to stop the worker
+    :type stop: multiprocessing.Event
+    """
+    bus = QuoteBus(codes, name=bus_name)
+    reader = QuoteReader(bus, from_start=True)
+    prices = {}
+    pairs = list(pairs)
+    grid_indexes = [None] * len(pairs)
+    idle = WORKER_MIN_IDLE
+    try:
+        while not stop.is_set():
+            try:
+                while 1:
+                    i, pair = updates.get_nowait()
+                    pairs[i], grid_indexes[i] = pair, None
+            except Empty:
+                pass
+            ticks = reader.read()
+            if not len(ticks):
+                # back off while no tick arrives, e.g. out of the trading sessions
+                stop.wait(idle)
+                idle = min(idle * 2, WORKER_MAX_IDLE)
+                continue
+            idle = WORKER_MIN_IDLE
+            prices.update(reader.latest_prices(ticks))
+            for i, pair in enumerate(pairs):
+                if pair.symbol not in prices or pair.ie_symbol not in prices:
+                    continue
+                grid_index = pair.strategy.cal_grid_index_by_price(prices[pair.symbol])
+                if grid_index != grid_indexes[i]:
+                    grid_indexes[i] = grid_index
+                    signals.put((pair.symbol, prices[pair.symbol], prices[pair.ie_symbol]))
+    finally:
+        bus.close()
+
+
+def start_grid_workers(bus, pairs, signals, workers):
+    """
+    Start the worker processes watching the grids, the pair i is watched by the worker i % workers
+
+    :return: the worker processes, their update queues and their stop event
+    :rtype: GridWorkers
+    """
+    workers = min(workers or os.cpu_count(), len(pairs))
+    grid_workers = GridWorkers([None] * workers, [None] * workers, multiprocessing.get_context('spawn').Event())
+    for k in range(workers):
+        start_grid_worker(grid_workers, k, bus, pairs, signals)
+    return grid_workers
+
+
+def start_grid_worker(grid_workers, k, bus, pairs, signals):
+    """
+    Start the worker k of the grid workers, or restart it if it died
+
+    :param k: index of the worker
+    :type k: int
+    """
+    # spawn instead of fork, the parent runs the futu threads
+    context = multiprocessing.get_context('spawn')
+    workers = len(grid_workers.processes)
+    if grid_workers.updates[k] is not None:
+        # nobody reads the updates of a dead worker, do not wait to flush them at exit
+        grid_workers.updates[k].cancel_join_thread()
+    updates = context.Queue()
+    process = context.Process(target=grid_worker,
+                              args=(bus.name, bus.codes, pairs[k::workers], signals, updates, grid_workers.stop),
+                              name=f"grid-worker-{k}", daemon=True)
+    process.start()
+    grid_workers.processes[k], grid_workers.updates[k] = process, updates
+
+
+def update_grid_workers(grid_workers, pairs, changed):
+    """
+    Send the changed strategies to the workers watching them, instead of restarting the workers
+
+    :param pairs: the pairs to trade from now on
+    :type pairs: list[Pair]
+    :param changed: indexes of the changed pairs
+    :type changed: list[int]
+    """
+    workers = len(grid_workers.processes)
+    for i in changed:
+        grid_workers.updates[i % workers].put((i // workers, pairs[i]))
 
-                # place sell order for equity
-                if order_quantity < 0:
-                    place_market_order(symbol, abs(order_quantity), "SELL")
 
-                # place sell order for inverse equity
-                if ie_order_quantity < 0:
-                    place_market_order(ie_symbol, abs(ie_order_quantity), "SELL")
+def stop_grid_workers(grid_workers):
+    """
+    Stop the worker processes and wait for them to exit
 
-                # place buy order for equity
-                if order_quantity > 0:
-                    place_market_order(symbol, abs(order_quantity), "BUY")
+    The workers are not terminated unless they fail to exit in time, since a worker terminated while putting a signal
+    may corrupt the queue shared with the other workers.
 
-                # place buy order for inverse equity
-                if ie_order_quantity > 0:
-                    place_market_order(ie_symbol, abs(ie_order_quantity), "BUY")
+    :param grid_workers: the worker processes, None if not started
+    :type grid_workers: GridWorkers or None
+    """
+    if grid_workers is None:
+        return
+    grid_workers.stop.set()
+    for process in grid_workers.processes:
+        process.join(WORKER_STOP_TIMEOUT)
+        if process.is_alive():
+            logger.warning(f"Grid worker {process.name} did not stop in {WORKER_STOP_TIMEOUT} seconds, terminating it")
+            process.terminate()
+            process.join()
+
+
+def run_bus(executor, pairs, gate, pending=None, watcher=None, workers=None):
+    """
+    Publish the quote push of all pairs on a shared memory quote bus, watch the grids in worker processes and rebalance
+    a pair when its worker signals a grid crossing
+
+    OpenD only sees this process, which subscribes the quotes and places the orders, while the strategies are
+    evaluated on all cores.
+
+    :param executor: order executor placing the orders in the background
+    :type executor: OrderExecutor
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :param gate: session gate telling if the market is open
+    :type gate: SessionGate
+    :param pending: future of the resumed orders of every pair
+    :type pending: list[concurrent.futures.Future or None]
+    :param watcher: watcher of the config file to reload the strategies from, None to never reload
+    :type watcher: ConfigWatcher
+    :param workers: number of worker processes, default to the number of cores
+    :type workers: int
+    """
+    symbols = pair_symbols(pairs)
+    bus = QuoteBus(symbols)
+    # free the shared memory even if the loop is not unwound, e.g. when a replay ends
+    atexit.register(bus.close)
+    signals = multiprocessing.get_context('spawn').Queue()
+    grid_workers = None
+    restarts = 0
+    try:
+        def on_quote(code, price):
+            cache_quote(code, price)
+            bus.publish(code, price, int(market_now() * 1e9))
+
+        # seed the prices so that the positions are checked once at startup, before the push thread publishes too
+        prices = get_latest_prices(symbols)
+        for code, price in prices.items():
+            bus.publish(code, price, int(market_now() * 1e9))
+        subscribe_quote(symbols, QuotePushHandler(on_quote))
+        grid_workers = start_grid_workers(bus, pairs, signals, workers)
+        # the adaptive grids follow every tick, the workers only signal the grid crossings
+        reader = QuoteReader(bus) if any(adaptive_grids) else None
+
+        indexes = {pair.symbol: i for i, pair in enumerate(pairs)}
+        pending = list(pending or [None] * len(pairs))
+        for future in pending:
+            if future is not None:
+                future.add_done_callback(lambda _: signals.put(None))
+        # the pairs whose latest signal is not rebalanced yet
+        dirty = [True] * len(pairs)
+        reconciled = monotonic()
 
+        while 1:
+            for i, pair in enumerate(pairs):
+                if pending[i] is not None and pending[i].done():
+                    finish_rebalance(pending[i], pair.symbol)
+                    pending[i] = None
+                    # the signals keep coming while the orders are pending, the latest one is checked once they are done
+                    dirty[i] = True
+
+                if pending[i] is not None or not dirty[i]:
+                    continue
+
+                if not gate.is_open():
+                    logger.debug("Market is not open")
+                    continue
+
+                pending[i] = rebalance(executor, pair.strategy, pair.symbol, pair.ie_symbol,
+                                       prices[pair.symbol], prices[pair.ie_symbol])
+                if pending[i] is not None:
+                    # wake up the loop when the orders are done
+                    pending[i].add_done_callback(lambda _: signals.put(None))
+                dirty[i] = False
+
+            if gate.is_open():
+                timeout = max(RECONCILE_INTERVAL - (monotonic() - reconciled), 0)
             else:
-                logger.debug("Market is not open")
+                timeout = gate.seconds_until_open()
+            if watcher is not None:
+                timeout = min(timeout, watcher.interval)
+            if reader is not None:
+                timeout = min(timeout, ADAPT_INTERVAL)
+            timeout = min(timeout, WORKER_CHECK_INTERVAL)
+            try:
+                signal = signals.get(timeout=timeout)
+                while 1:
+                    if signal is not None:
+                        symbol, price, ie_price = signal
+                        prices[symbol], prices[pairs[indexes[symbol]].ie_symbol] = price, ie_price
+                        dirty[indexes[symbol]] = True
+                    signal = signals.get_nowait()
+            except Empty:
+                pass
+
+            changed = []
+            if reader is not None:
+                ticks = reader.read()
+                if len(ticks):
+                    prices.update(reader.latest_prices(ticks))
+                    pairs, changed = adapt_pairs(pairs, prices)
+            if watcher is not None:
+                pairs, reloaded = reload_pairs(pairs, watcher, prices)
+                changed += reloaded
+            if changed:
+                # the workers watch the grids of the old strategies
+                update_grid_workers(grid_workers, pairs, changed)
+            dead = [k for k, process in enumerate(grid_workers.processes) if not process.is_alive()]
+            if dead:
+                restarts += 1
+                names = [(grid_workers.processes[k].name, grid_workers.processes[k].exitcode) for k in dead]
+                if restarts > MAX_WORKER_RESTARTS:
+                    raise RuntimeError(f"Grid workers died {restarts} times, last {names}")
+                logger.error(f"Grid workers {names} died, restarting them")
+                for k in dead:
+                    start_grid_worker(grid_workers, k, bus, pairs, signals)
+                # the signals of the dead workers may be lost, check their pairs again
+                changed += [i for i in range(len(pairs)) if i % len(grid_workers.processes) in dead]
+            for i in changed:
+                dirty[i] = True
+
+            if monotonic() - reconciled >= RECONCILE_INTERVAL and gate.is_open():
+                reconciled = sync_broker_state()
+    finally:
+        stop_grid_workers(grid_workers)
+        bus.close()
+
+
+def pair_symbols(pairs):
+    """
+    :return: the symbols of all pairs
+    :rtype: list[str]
+    """
+    return [symbol for pair in pairs for symbol in (pair.symbol, pair.ie_symbol)]
 
-            sleep(10)
+
+def load_pairs(config, lot_sizes=None):
+    """
+    Create the strategies of a config, either a single pair or a portfolio of pairs
+
+    :param config: config with `symbol`, `ie_symbol` and `grid_trading_strategy`, or a `pairs` list of them
+    :type config: dict
+    :param lot_sizes: symbol -> lot size known already, e.g. of the running strategies
+    :type lot_sizes: dict[str, int]
+    :return: the traded pairs
+    :rtype: list[Pair]
+    """
+    pair_configs = config['pairs'] if 'pairs' in config else [config]
+    assert pair_configs, "Expect at least one pair"
+
+    symbols = [str(c[key]) for c in pair_configs for key in ('symbol', 'ie_symbol')]
+    assert len(set(symbols)) == len(symbols), \
+        "Expect every symbol to be traded by one pair only but got {}".format(symbols)
+
+    # lot sizes cached by the warm start state, one request for the lot sizes of the others
+    lot_sizes = dict(lot_sizes or {})
+    if state_store is not None:
+        lot_sizes.update(state_store.get_lot_sizes([symbol for symbol in symbols if symbol not in lot_sizes]))
+    missing = [symbol for symbol in symbols if symbol not in lot_sizes]
+    if missing:
+        fetched = get_lot_sizes(missing)
+        if state_store is not None:
+            state_store.set_lot_sizes(fetched)
+        lot_sizes.update(fetched)
+    pairs = []
+    for c in pair_configs:
+        symbol = str(c['symbol'])
+        # inverse equity
+        ie_symbol = str(c['ie_symbol'])
+        strategy = GridTradingStrategy(**c['grid_trading_strategy'], lot_size=lot_sizes[symbol],
+                                       ie_lot_size=lot_sizes[ie_symbol])
+        pairs.append(Pair(symbol, ie_symbol, strategy))
+    return pairs
+
+
+def load_adaptive_grids(config, pairs, saved=None):
+    """
+    Create the adaptive grids of the pairs with an `adaptive` section in the config
+
+    :param config: config of the pairs, see load_pairs
+    :type config: dict
+    :param pairs: the pairs of the config
+    :type pairs: list[Pair]
+    :param saved: the grids recentered before a restart, symbol -> result of AdaptiveGrid.to_dict
+    :type saved: dict[str, dict]
+    :return: the pairs with the resumed grids, adaptive grid of every pair or None if the pair is not adaptive
+    :rtype: (list[Pair], list[AdaptiveGrid or None])
+    """
+    pair_configs = config['pairs'] if 'pairs' in config else [config]
+    saved = saved or {}
+    pairs = list(pairs)
+    adaptives = []
+    for i, (c, pair) in enumerate(zip(pair_configs, pairs)):
+        params = c.get('adaptive')
+        if params is None or params is False:
+            adaptives.append(None)
+            continue
+        adaptive = AdaptiveGrid(c['grid_trading_strategy'], pair.strategy.lot_size, pair.strategy.ie_lot_size,
+                                {} if params is True else params)
+        strategy = adaptive.load(saved.get(pair.symbol))
+        if strategy is not None:
+            logger.info("Recentered grid of %s resumed, grids=%s", pair.symbol, strategy.grids)
+            pairs[i] = pair._replace(strategy=strategy)
+        adaptives.append(adaptive)
+    return pairs, adaptives
+
+
+def adapt_pairs(pairs, prices):
+    """
+    Feed the latest prices to the adaptive grids and swap in the recentered strategies
+
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :param prices: the latest prices, symbol -> price
+    :type prices: dict[str, float]
+    :return: the pairs to trade from now on, indexes of the pairs whose grid is recentered
+    :rtype: (list[Pair], list[int])
+    """
+    if not any(adaptive_grids):
+        return pairs, []
+    t = market_now()
+    new_pairs = list(pairs)
+    changed = []
+    for i, (pair, adaptive) in enumerate(zip(pairs, adaptive_grids)):
+        if adaptive is None or pair.symbol not in prices or pair.ie_symbol not in prices:
+            continue
+        strategy = adaptive.update(prices[pair.symbol], prices[pair.ie_symbol], t)
+        if strategy is None:
+            continue
+        new_pairs[i] = pair._replace(strategy=strategy)
+        changed.append(i)
+        if state_store is not None:
+            state_store.set_adaptive_grid(pair.symbol, adaptive.to_dict())
+    if changed and accounting is not None:
+        accounting.set_pairs(new_pairs)
+    return new_pairs, changed
+
+
+def reload_pairs(pairs, watcher, prices):
+    """
+    Build the strategies of a changed config beside the running ones and report the rebalance they lead to
+
+    The running strategies are kept if the config is not changed or not valid. The symbols of the pairs can not be
+    changed without a restart. The adaptive grids start over from the new config.
+
+    :param pairs: the traded pairs
+    :type pairs: list[Pair]
+    :param watcher: watcher of the config file
+    :type watcher: ConfigWatcher
+    :param prices: the latest prices, symbol -> price
+    :type prices: dict[str, float]
+    :return: the pairs to trade from now on, indexes of the pairs whose strategy changed
+    :rtype: (list[Pair], list[int])
+    """
+    config = watcher.poll()
+    if config is None:
+        return pairs, []
+
+    lot_sizes = {}
+    for pair in pairs:
+        lot_sizes[pair.symbol] = pair.strategy.lot_size
+        lot_sizes[pair.ie_symbol] = pair.strategy.ie_lot_size
+    try:
+        new_pairs = load_pairs(config, lot_sizes)
+        _, new_adaptive_grids = load_adaptive_grids(config, new_pairs)
+        symbols, new_symbols = pair_symbols(pairs), pair_symbols(new_pairs)
+        if new_symbols != symbols:
+            raise ValueError("Expect the symbols {} but got {}, restart to change the symbols".format(symbols,
+                                                                                                    new_symbols))
+    except (AssertionError, KeyError, TypeError, ValueError) as e:
+        logger.error("Config not reloaded, keeping the running strategies: %r", e)
+        return pairs, []
+
+    if state_store is not None:
+        state_store.check_config(config_fingerprint(config))
+    global adaptive_grids
+    adaptive_grids = new_adaptive_grids
+
+    changed = []
+    for i, (pair, new_pair) in enumerate(zip(pairs, new_pairs)):
+        old, new = pair.strategy, new_pair.strategy
+        if (old.grids, old.position_per_grid, old.ie_position_per_grid) == \
+                (new.grids, new.position_per_grid, new.ie_position_per_grid):
+            continue
+        changed.append(i)
+        logger.info("Strategy of %s reloaded, grids=%s", pair.symbol, new.grids)
+        if pair.symbol in prices:
+            order_quantity, ie_order_quantity = new.cal_order_quantity(
+                prices[pair.symbol], broker_state.get_position(pair.symbol), broker_state.get_position(pair.ie_symbol))
+            logger.info("Reloaded strategy of %s will rebalance %s by %s and %s by %s at price %s", pair.symbol,
+                        pair.symbol, order_quantity, pair.ie_symbol, ie_order_quantity, prices[pair.symbol])
+    if accounting is not None:
+        accounting.set_pairs(new_pairs)
+    return new_pairs, changed
+
+
+def main(args):
+    # watch from before the config is read, so that no change is missed
+    watcher = ConfigWatcher(args['config'])
+    with open(args['config']) as f:
+        config = yaml.safe_load(f)
+
+    configure_logger()
+
+    global state_store
+    state_store = StateStore(config.get('state_file', Path(LOG_FILE).parent / "state.json"), market_now)
+    if not state_store.check_config(config_fingerprint(config)):
+        logger.info("Config changed since the last run, the recentered grids are dropped")
+    pairs = load_pairs(config)
+    global adaptive_grids
+    pairs, adaptive_grids = load_adaptive_grids(config, pairs, state_store.adaptive_grids)
+    connection.start_heartbeat()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    metrics.log_summary_periodically(METRICS_LOG_INTERVAL)
+    # idle until SIGUSR1, SIGUSR2 or a trigger file asks for a profile
+    Profiler(Path(LOG_FILE).parent / "profile").install()
+
+    global journal
+    journal = Journal(Path(LOG_FILE).parent / "journal", market_now)
+    atexit.register(journal.close)
+
+    global accounting
+    # the fills are saved by the background writer of the state store, off the futu push thread
+    accounting = Accounting(config.get('cash'), config.get('fee'), market_now,
+                            lambda: state_store.save_later('accounting', accounting.to_dict))
+    atexit.register(state_store.flush)
+    accounting.load(state_store.accounting)
+    accounting.set_pairs(pairs)
+    metrics.register_gauges(accounting.gauges)
+
+    def on_deals(data):
+        broker_state.update_deals(data)
+        journal.record_deals(data)
+        # only to log the drift after a restart, saved in the background off the futu push thread
+        state_store.save_later('positions', broker_state.get_positions)
+        accounting.update_deals(data)
+
+    broker_state.add_listener(on_order)
+    subscribe_trade(TradeOrderPushHandler(broker_state.update_orders), TradeDealPushHandler(on_deals))
+    # the positions of the last run, so that the fills while stopped are logged as drift
+    positions = state_store.positions
+    broker_state.load_positions({'code': list(positions), 'qty': list(positions.values())})
+    sync_broker_state(log_drift=bool(positions))
+    # the positions held before the accounting started, or changed while stopped, are accounted at the latest price
+    accounting.mark(get_latest_prices(pair_symbols(pairs)))
+    accounting.reconcile(broker_state.get_positions())
+    calendar = TradingCalendar.load(config.get('calendar', DEFAULT_CALENDAR_FILE))
+    gate = SessionGate(calendar, is_market_open, market_now)
+    # the orders of all pairs share the order rate limit of the account
+    if args.get('execution') == 'limit':
+        execution = start_limit_execution(pair_symbols(pairs))
+        executor = OrderExecutor(broker_state, execution, cancel_order,
+                                 # the limit execution cancels its own orders and returns before its leg times out
+                                 timeout=execution.max_duration + LIMIT_SLACK, max_rebalances=len(pairs))
+    else:
+        executor = OrderExecutor(broker_state, place_market_order, cancel_order, max_rebalances=len(pairs),
+                                 throttle=scheduler.limiter('place_order'))
+    pending = resume_pending_orders(executor, pairs)
+    logger.info(f"Futu-grid-trading started, mode={args['mode']}, execution={args.get('execution', 'market')}, "
+                f"pairs={[pair.symbol for pair in pairs]}")
+
+    try:
+        if args['mode'] == 'push':
+            run_push(executor, pairs, gate, pending, watcher)
+        elif args['mode'] == 'bus':
+            run_bus(executor, pairs, gate, pending, watcher, args.get('workers'))
+        else:
+            run_poll(executor, pairs, gate, pending, watcher)
     except:
         logger.error(traceback.format_exc())
         raise
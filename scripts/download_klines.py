@@ -0,0 +1,49 @@
+import argparse
+import logging
+import time
+from datetime import date
+
+from trade.api import connection, get_etf_symbols
+from trade.kline import KTYPES, DEFAULT_WORKERS, KlineStore, KlineDownloader, is_leveraged_inverse
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Download historical klines from OpenD into a local store')
+    parser.add_argument('symbols', type=str, nargs='*', help='stock sticks, e.g. HK.07226 HK.07552')
+    parser.add_argument('-f', '--symbol_file', type=str, default=None, help='file of stock sticks, one per line')
+    parser.add_argument('-l', '--leveraged_inverse', action='store_true',
+                        help='download all the leveraged and inverse products listed in Hong Kong')
+    parser.add_argument('-k', '--ktypes', type=str, nargs='+', default=['day'], choices=list(KTYPES),
+                        help='kline types')
+    parser.add_argument('-s', '--start', type=date.fromisoformat, required=True, help='first date, yyyy-mm-dd')
+    parser.add_argument('-e', '--end', type=date.fromisoformat, default=None,
+                        help='last date, yyyy-mm-dd, default to today')
+    parser.add_argument('-o', '--output', type=str, default='vol/kline', help='directory of the store')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of symbols downloaded at the same time')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    symbols = list(args['symbols'])
+    if args['symbol_file']:
+        with open(args['symbol_file']) as f:
+            symbols += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if args['leveraged_inverse']:
+        symbols += [symbol for symbol in get_etf_symbols() if is_leveraged_inverse(symbol)]
+    symbols = list(dict.fromkeys(symbols))
+    assert symbols, "Expect symbols, a symbol file or --leveraged_inverse"
+
+    start = time.perf_counter()
+    downloader = KlineDownloader(KlineStore(args['output']), workers=args['workers'])
+    results = downloader.download(symbols, args['ktypes'], args['start'], args['end'])
+    print("Downloaded {} klines of {}/{} symbol and kline type pairs in {:.1f}s into {}".format(
+        sum(results.values()), len(results), len(symbols) * len(args['ktypes']), time.perf_counter() - start,
+        args['output']))
+    connection.close()
+
+
+if __name__ == "__main__":
+    main(get_args())
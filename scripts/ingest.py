@@ -0,0 +1,20 @@
+import argparse
+
+from trade.datastore import ingest_csv
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Convert price csv files into .npy caches')
+    parser.add_argument('csv_files', type=str, nargs='+', help='csv files of daily OHLCV, minute bars or ticks')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    for csv_file in args['csv_files']:
+        npy_file = ingest_csv(csv_file)
+        print("{} -> {}".format(csv_file, npy_file))
+
+
+if __name__ == "__main__":
+    main(get_args())
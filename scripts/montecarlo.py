@@ -0,0 +1,56 @@
+import argparse
+import csv
+import time
+
+import yaml
+
+from trade.datastore import load
+from trade.montecarlo import run_simulation, summarize, format_summary, METRIC_NAMES
+from trade.strategy import CAPITAL_USE_LIMIT
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Backtest a GridTradingStrategy over synthetic price paths')
+    parser.add_argument('-c', '--config', type=str, required=True, help='monte carlo config file')
+    parser.add_argument('-d', '--data_file', type=str, default=None,
+                        help='price data file with columns time,price,ie_price to bootstrap the returns from')
+    parser.add_argument('-n', '--paths', type=int, default=None, help='number of paths, overrides the config')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random seed')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='write the metrics of every path to this csv file')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    with open(args['config']) as f:
+        config = yaml.safe_load(f)
+
+    model_params = dict(config['model'])
+    model = model_params.pop('type')
+    if model == 'bootstrap':
+        assert args['data_file'], "Expect a data file to bootstrap the returns from"
+        data = load(args['data_file'])
+        model_params.update(history=data['price'], ie_history=data['ie_price'])
+    n_paths = args['paths'] or config['paths']
+
+    start = time.perf_counter()
+    metrics = run_simulation(model, model_params, config['grid_trading_strategy'], config['lot_size'],
+                             config['ie_lot_size'], config['cash'], n_paths, config['steps'], config.get('fee'),
+                             args['seed'], processes=args['processes'])
+    print("Simulated {} {} paths of {} steps in {:.2f}s".format(n_paths, model, config['steps'],
+                                                                time.perf_counter() - start))
+    rows, over_limit = summarize(metrics)
+    print(format_summary(rows))
+    print("Paths using more than {:.0%} of the cash: {:.2%}".format(CAPITAL_USE_LIMIT, over_limit))
+
+    if args['output']:
+        with open(args['output'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(METRIC_NAMES)
+            writer.writerows(zip(*(metrics[name].tolist() for name in METRIC_NAMES)))
+
+
+if __name__ == "__main__":
+    main(get_args())
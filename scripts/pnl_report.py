@@ -0,0 +1,24 @@
+import argparse
+
+from trade.accounting import Accounting, format_report
+from trade.checkpoint import StateStore
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Report the daily P&L and the grid cycles of the live trading')
+    parser.add_argument('-s', '--state_file', type=str, default='vol/log/state.json', help='state file of the service')
+    parser.add_argument('-c', '--capital', type=float, default=None, help='cash allocated to the strategies')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    state_store = StateStore(args['state_file'])
+    accounting = Accounting(args['capital'])
+    accounting.load(state_store.accounting)
+    # the unrealized P&L at the prices marked by the service when it last saved the accounting
+    print(format_report(accounting.report(), accounting.summary()))
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,71 @@
+import argparse
+import importlib
+import os
+import threading
+import time
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Replay a recording through main.main() against a local OpenD '
+                                                 'stand-in')
+    parser.add_argument('-c', '--config', type=str, required=True, help='config file')
+    parser.add_argument('-r', '--recording', type=str, required=True, help='recording written with OPEND_RECORD')
+    parser.add_argument('-s', '--speed', type=float, default=1, help='replay speed, e.g. 100 for 100x, '
+                                                                     '0 for as fast as possible')
+    parser.add_argument('-m', '--mode', type=str, default='push', choices=['push', 'poll', 'bus'],
+                        help='main loop mode')
+    parser.add_argument('-e', '--execution', type=str, default='market', choices=['market', 'limit'],
+                        help='order execution')
+    parser.add_argument('-l', '--log_file', type=str, default='replay.log', help='log file')
+    args = vars(parser.parse_args())
+    return args
+
+
+def run(args):
+    """
+    Run main.main() until the recording is replayed to the end
+
+    :return: replay, quote context, trade context and wall time in seconds
+    """
+    os.environ['OPEND_REPLAY'] = args['recording']
+    os.environ['OPEND_REPLAY_SPEED'] = str(args['speed'])
+    os.environ.setdefault('DRY_RUN', 'False')
+    main = importlib.import_module('main')
+    from trade.api import connection
+    from trade.fake_opend import ReplayFinished
+
+    main.LOG_FILE = args['log_file']
+    errors = []
+
+    def target():
+        try:
+            main.main({'config': args['config'], 'mode': args['mode'], 'execution': args['execution']})
+        except BaseException as e:
+            errors.append(e)
+
+    # the push mode never returns, so main.main() runs in a daemon thread until the replay is finished
+    start = time.perf_counter()
+    thread = threading.Thread(target=target, name="main", daemon=True)
+    thread.start()
+    while thread.is_alive() and not connection.replay.finished.wait(0.1):
+        pass
+    # let the orders of the last ticks complete
+    thread.join(1)
+    elapsed = time.perf_counter() - start
+
+    if errors and not isinstance(errors[0], ReplayFinished):
+        raise errors[0]
+    return connection.replay, connection.quote_ctx, connection.trd_ctx, elapsed
+
+
+def main(args):
+    replay, quote_ctx, trd_ctx, elapsed = run(args)
+    ticks = quote_ctx.pushed if args['mode'] == 'push' else len(replay.ticks)
+    print("Replayed {:.0f}s of market time in {:.2f}s".format(replay.end - replay.start, elapsed))
+    print("ticks: {}, throughput: {:.0f} ticks/s".format(ticks, ticks / elapsed))
+    print("orders: {}".format(len(trd_ctx.orders)))
+    print("positions: {}".format(trd_ctx.positions))
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,49 @@
+import argparse
+import csv
+import time
+
+import yaml
+
+from trade.datastore import load
+from trade.sweep import expand_param_grid, validate_params, run_sweep, format_table, PARAM_NAMES, METRIC_NAMES
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Backtest a grid of GridTradingStrategy parameters')
+    parser.add_argument('-c', '--config', type=str, required=True, help='sweep config file')
+    parser.add_argument('-d', '--data_file', type=str, required=True,
+                        help='price data file with columns time,price,ie_price, csv or its .npy cache')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-t', '--top', type=int, default=20, help='number of rows to print')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write all results to this csv file')
+    args = vars(parser.parse_args())
+    return args
+
+
+def main(args):
+    with open(args['config']) as f:
+        config = yaml.safe_load(f)
+
+    data = load(args['data_file'])
+    prices, ie_prices = data['price'], data['ie_price']
+
+    params_list = expand_param_grid(config['grid_trading_strategy'])
+    valid = validate_params(params_list, config['lot_size'], config['ie_lot_size'])
+    print("{}/{} parameter sets are valid".format(len(valid), len(params_list)))
+
+    start = time.perf_counter()
+    results = run_sweep(prices, ie_prices, valid, config['lot_size'], config['ie_lot_size'], config['cash'],
+                        config.get('fee'), args['processes'])
+    print("Backtested {} parameter sets over {} prices in {:.2f}s".format(len(valid), len(prices),
+                                                                          time.perf_counter() - start))
+    print(format_table(results, args['top']))
+
+    if args['output']:
+        with open(args['output'], 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PARAM_NAMES + METRIC_NAMES)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main(get_args())
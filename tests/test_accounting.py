@@ -0,0 +1,141 @@
+import statistics
+from collections import namedtuple
+
+import pandas as pd
+import pytest
+
+from trade.accounting import Accounting, RunningStats
+from trade.checkpoint import StateStore
+from trade.strategy import GridTradingStrategy
+
+Pair = namedtuple('Pair', ['symbol', 'ie_symbol', 'strategy'])
+
+
+def make_accounting(**kwargs):
+    clock = iter(range(1609459200, 1609459200 + 100000, 60))
+    accounting = Accounting(now=lambda: next(clock), **kwargs)
+    strategy = GridTradingStrategy(grid_upper_limit_price=6, grid_lower_limit_price=4, grid_count=10,
+                                   grid_lower_limit_position=10000, ie_max_position=6000, lot_size=100,
+                                   ie_lot_size=100)
+    accounting.set_pairs([Pair('HK.07226', 'HK.07552', strategy)])
+    return accounting
+
+
+def test_running_stats():
+    values = [1.0, 4.0, -2.0, 7.5, 3.0]
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.std == pytest.approx(statistics.stdev(values))
+    assert (stats.min, stats.max) == (-2.0, 7.5)
+    stats.remove(values[0])
+    assert stats.mean == pytest.approx(statistics.mean(values[1:]))
+    assert stats.std == pytest.approx(statistics.stdev(values[1:]))
+
+
+def test_grid_round_trip():
+    accounting = make_accounting(capital=50000, fee_kwargs={'platform_fee': 1.0})
+    accounting.fill('HK.07226', 'BUY', 1000, 4.2)
+    accounting.fill('HK.07226', 'BUY', 1000, 4.0)
+    summary = accounting.summary()
+    assert summary['inventory'] == {'HK.07226': {1: 1000, 2: 1000}}
+    assert summary['cycles'] == 0
+
+    # the grid bought last is sold first
+    accounting.fill('HK.07226', 'SELL', 1000, 4.2)
+    summary = accounting.summary()
+    assert summary['cycles'] == 1
+    assert summary['realized'] == pytest.approx(1000 * 0.2 - 2.0)
+    assert summary['fees'] == pytest.approx(3.0)
+    assert summary['inventory'] == {'HK.07226': {2: 1000}}
+    # the buy fee of the open lot is unrealized
+    assert summary['unrealized'] == pytest.approx(-1.0)
+    assert summary['cash_use'] == pytest.approx(4200 / 50000)
+    assert accounting.report() == [{'day': '2021-01-01', 'realized': pytest.approx(198.0), 'fees': 3.0,
+                                    'turnover': pytest.approx(12400.0), 'fills': 3, 'cycles': 1}]
+
+
+def test_deals_applied_once_and_partial_close():
+    accounting = make_accounting()
+    deals = pd.DataFrame({'deal_id': ['1', '2'], 'order_id': ['1', '2'], 'code': ['HK.07552', 'HK.07552'],
+                          'trd_side': ['BUY', 'SELL'], 'qty': [600, 200], 'price': [10.0, 10.5]})
+    accounting.mark({'HK.07226': 4.5})
+    accounting.update_deals(deals)
+    accounting.update_deals(deals)
+    summary = accounting.summary()
+    assert summary['fills'] == 2
+    assert summary['positions'] == {'HK.07552': 400}
+    # the inverse equity is bought at the grid of the stock price
+    assert summary['inventory'] == {'HK.07552': {3: 400}}
+    assert summary['realized'] == pytest.approx(100.0)
+    assert summary['cycles'] == 0
+
+    accounting.fill('HK.07552', 'SELL', 400, 9.5)
+    summary = accounting.summary()
+    assert summary['cycles'] == 1
+    assert summary['cycle_pnl_mean'] == pytest.approx(100.0 - 200.0)
+
+
+def test_fees_charged_per_order(tmp_path):
+    fee_kwargs = {'commission_rate': 0.0003, 'min_commission': 3.0, 'platform_fee': 15.0, 'stamp_duty_rate': 0.0013}
+    store = StateStore(tmp_path / "state.json")
+    accounting = make_accounting(fee_kwargs=fee_kwargs)
+    accounting.on_change = lambda: store.save_later('accounting', accounting.to_dict)
+    # one order filled by three deals
+    accounting.fill('HK.07226', 'BUY', 1000, 4.0, deal_id='1', order_id='1')
+    accounting.fill('HK.07226', 'BUY', 2000, 4.0, deal_id='2', order_id='1')
+    store.flush()
+
+    # the deals applied already are skipped after a restart too
+    restored = make_accounting(fee_kwargs=fee_kwargs)
+    restored.load(StateStore(tmp_path / "state.json").accounting)
+    restored.fill('HK.07226', 'BUY', 2000, 4.0, deal_id='2', order_id='1')
+    restored.fill('HK.07226', 'BUY', 1000, 4.0, deal_id='3', order_id='1')
+    summary = restored.summary()
+    assert summary['positions'] == {'HK.07226': 4000}
+    # the fixed fees once, the commission and the stamp duty on the order value
+    assert summary['fees'] == pytest.approx(max(16000 * 0.0003, 3.0) + 15.0 + 21.0)
+    assert summary['unrealized'] == pytest.approx(-summary['fees'])
+
+    # the deals of a day are forgotten the next day
+    restored.now = lambda: 1609459200 + 86400
+    restored.fill('HK.07226', 'SELL', 1000, 4.0, deal_id='4', order_id='2')
+    assert restored.to_dict()['deal_ids'] == ['4']
+
+
+def test_cash_use_limit(caplog):
+    accounting = make_accounting(capital=10000)
+    accounting.fill('HK.07226', 'BUY', 2000, 4.0)
+    assert accounting.summary()['cash_use'] == pytest.approx(0.8)
+    accounting.mark({'HK.07226': 5.0})
+    assert "over the limit" in caplog.text
+    assert accounting.summary()['peak_cash_use'] == pytest.approx(1.0)
+
+
+def test_persist_and_reconcile(tmp_path):
+    store = StateStore(tmp_path / "state.json")
+    accounting = make_accounting()
+    accounting.on_change = lambda: store.save_later('accounting', accounting.to_dict)
+    accounting.fill('HK.07226', 'BUY', 1000, 4.0)
+    accounting.fill('HK.07226', 'BUY', 1000, 3.9)
+    accounting.fill('HK.07226', 'SELL', 1000, 4.1)
+    store.flush()
+
+    restored = make_accounting()
+    restored.load(StateStore(tmp_path / "state.json").accounting)
+    # marked at the price of the last fill until the first quote
+    assert restored.summary()['unrealized'] == pytest.approx(accounting.summary()['unrealized'])
+    restored.mark({'HK.07226': 4.2})
+    accounting.mark({'HK.07226': 4.2})
+    assert restored.summary() == accounting.summary()
+    assert restored.report() == accounting.report()
+
+    # bought 500 while stopped, opened at the latest price
+    restored.reconcile({'HK.07226': 1500})
+    assert restored.summary()['inventory'] == {'HK.07226': {1: 1000, 2: 500}}
+    # sold outside the strategy, dropped without realizing
+    restored.reconcile({'HK.07226': 200})
+    summary = restored.summary()
+    assert summary['positions'] == {'HK.07226': 200}
+    assert summary['realized'] == pytest.approx(200.0)
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+import pytest
+
+from trade.adaptive import AdaptiveGrid, EwmaVolatility, RollingRange, backtest_adaptive
+from trade.backtest import backtest
+from trade.checkpoint import StateStore
+from trade.strategy import GridTradingStrategy
+
+STRATEGY_PARAMS = {'grid_upper_limit_price': 6, 'grid_lower_limit_price': 4, 'grid_count': 10,
+                   'grid_lower_limit_position': 10000, 'ie_max_position': 6000}
+
+
+def test_ewma_volatility():
+    # log returns of +-1% every 60s
+    volatility = EwmaVolatility(halflife=600)
+    price = 5.0
+    for i in range(200):
+        volatility.update(price, i * 60)
+        price *= math.exp(0.01 if i % 2 else -0.01)
+    assert volatility.volatility(60) == pytest.approx(0.01)
+    assert volatility.volatility(3600) == pytest.approx(0.01 * math.sqrt(60))
+
+    # a calm market decays the variance by half every halflife
+    volatility.update(price, 200 * 60)
+    variance = volatility.variance
+    for i in range(201, 211):
+        volatility.update(price, i * 60)
+    assert volatility.variance == pytest.approx(variance / 2)
+
+
+def test_trading_clock_skips_market_closes():
+    # two weeks of ticks every minute in the trading sessions, +-1% log returns and a gap of 5% at every open
+    times = []
+    for day in range(14):
+        times += [day * 86400 + minute * 60 for minute in range(570, 720)]
+        times += [day * 86400 + minute * 60 for minute in range(780, 960)]
+    adaptive = AdaptiveGrid(STRATEGY_PARAMS, 100, 100, {'warmup': 6 * 3600, 'min_width': 0.01, 'max_width': 0.5})
+    price = 5.0
+    recentered = []
+    for i, t in enumerate(times):
+        opened = i and t - times[i - 1] > 3600
+        price *= math.exp(0.05 if opened else 0.01 if i % 2 else -0.01)
+        if adaptive.update(price, 10.0, t) is not None:
+            recentered.append(t)
+        if opened:
+            # neither the night nor the gap at the open are in the volatility
+            assert adaptive.volatility.volatility(60) == pytest.approx(0.01, rel=0.05)
+    # 5.5 hours of trading per day, a lunch break and a night are max_gap each
+    assert adaptive.clock == pytest.approx((len(times) - 1 - 27) * 60 + 27 * 600)
+    # not warmed up over the first night
+    assert recentered and recentered[0] > 86400 + 9.5 * 3600
+
+
+def test_rolling_range():
+    rng = np.random.default_rng(0)
+    prices = 5 + rng.standard_normal(500).cumsum() * 0.01
+    times = np.sort(rng.uniform(0, 5000, 500))
+    rolling = RollingRange(window=300)
+    for i, (price, t) in enumerate(zip(prices, times)):
+        rolling.update(price, t)
+        window = prices[:i + 1][times[:i + 1] >= t - 300]
+        assert (rolling.low, rolling.high) == (window.min(), window.max())
+
+
+def test_recenter_on_breakout():
+    adaptive = AdaptiveGrid(STRATEGY_PARAMS, 100, 100, {'warmup': 600, 'min_interval': 3600, 'max_shift': 0.1})
+    # a calm market inside the grid
+    for t in range(0, 600, 60):
+        assert adaptive.update(5.0 + 0.01 * (t % 120 == 0), 10.0, t) is None
+
+    strategy = adaptive.update(7.0, 8.0, 660)
+    assert strategy is not None
+    lower, upper = strategy.grids[0], strategy.grids[-1]
+    # the center moves at most max_shift toward the price
+    assert (lower + upper) / 2 == pytest.approx(5.5, abs=1e-3)
+    assert upper - lower >= 0.05 * 7.0
+    # the value of the grids stays the one of the configured grids at the first prices
+    assert strategy.position_per_grid * strategy.grid_count == 7000
+    assert strategy.ie_position_per_grid * strategy.grid_count == 7000
+
+    # rate limited
+    for t in range(720, 660 + 3600, 60):
+        assert adaptive.update(8.0, 7.0, t) is None
+    strategy = adaptive.update(8.0, 7.0, 660 + 3600)
+    assert (strategy.grids[0] + strategy.grids[-1]) / 2 == pytest.approx(5.5 * 1.1, abs=1e-3)
+    assert adaptive.recenter_count == 2
+
+
+def test_recenter_on_volatility_regime():
+    adaptive = AdaptiveGrid(STRATEGY_PARAMS, 100, 100, {'warmup': 600, 'range_window': 600, 'max_width': 0.2})
+    price = 5.0
+    recentered = []
+    for i in range(30):
+        price *= math.exp(0.001 if i % 2 else -0.001)
+        recentered.append(adaptive.update(price, 10.0, i * 60))
+    # a 40% wide grid in a calm market shrinks to the min width once warmed up
+    assert [i for i, strategy in enumerate(recentered) if strategy is not None] == [10]
+    strategy = recentered[10]
+    assert strategy.grids[-1] - strategy.grids[0] == pytest.approx(0.05 * price, abs=1e-3)
+
+
+def test_persist_recentered_grid(tmp_path):
+    store = StateStore(tmp_path / "state.json")
+    adaptive = AdaptiveGrid(STRATEGY_PARAMS, 100, 100, {'warmup': 0})
+    assert adaptive.to_dict() is None
+    adaptive.update(5.0, 10.0, 0)
+    strategy = adaptive.update(8.0, 7.0, 60)
+    store.set_adaptive_grid('HK.07226', adaptive.to_dict())
+
+    restored = AdaptiveGrid(STRATEGY_PARAMS, 100, 100, {'warmup': 0})
+    resumed = restored.load(StateStore(tmp_path / "state.json").adaptive_grids['HK.07226'])
+    assert (resumed.grids, resumed.position_per_grid, resumed.ie_position_per_grid) == \
+           (strategy.grids, strategy.position_per_grid, strategy.ie_position_per_grid)
+    assert restored.to_dict() == adaptive.to_dict()
+
+    # a changed config drops the recentered grids
+    store.check_config("changed")
+    assert store.adaptive_grids == {}
+
+
+def test_backtest_adaptive():
+    times = np.arange(2000) * 60.0
+    prices = 5 + 0.3 * np.sin(times / 3000)
+    ie_prices = 15 - prices
+    kwargs = {'lot_size': 100, 'ie_lot_size': 100, 'cash': 100000, 'platform_fee': 1.0}
+
+    # never recentered, the same as the plain backtest
+    result, recenterings = backtest_adaptive(STRATEGY_PARAMS, {'warmup': 1e9}, prices, ie_prices, times, **kwargs)
+    assert recenterings == []
+    strategy = GridTradingStrategy(**STRATEGY_PARAMS, lot_size=100, ie_lot_size=100)
+    expected = backtest(strategy, prices, ie_prices, 100000, platform_fee=1.0)
+    for actual, wanted in zip(result, expected):
+        np.testing.assert_allclose(actual, wanted)
+
+    # a trend out of the grid recenters it and keeps trading
+    trend = prices + times / times[-1] * 3
+    result, recenterings = backtest_adaptive(STRATEGY_PARAMS, {'min_interval': 7200}, trend, 20 - trend, times,
+                                             **kwargs)
+    assert len(recenterings) >= 2
+    assert all(j - i >= 120 for (i, _), (j, _) in zip(recenterings, recenterings[1:]))
+    assert recenterings[-1][1][-1] > 6
+    assert np.count_nonzero(result.order_quantity[recenterings[0][0]:]) > 0
+    assert result.position.shape == prices.shape
@@ -0,0 +1,56 @@
+import numpy as np
+
+from trade.backtest import backtest, cal_order_quantities, cal_fee
+from trade.strategy import GridTradingStrategy
+
+
+def scalar_order_quantities(strategy, prices, position, ie_position):
+    result = []
+    for price in prices:
+        order_quantity, ie_order_quantity = strategy.cal_order_quantity(price, position, ie_position)
+        position += order_quantity
+        ie_position += ie_order_quantity
+        result.append((order_quantity, ie_order_quantity, position, ie_position))
+    return [list(column) for column in zip(*result)]
+
+
+def test_cal_order_quantities_same_as_scalar():
+    strategy = GridTradingStrategy(11, 10, 10, 10000, 20000, 100, 100)
+    rng = np.random.default_rng(0)
+    prices = 10.5 + np.cumsum(rng.normal(0, 0.05, 2000))
+    # hit the grids exactly
+    prices[::50] = strategy.grids[5]
+
+    for position, ie_position in [(0, 0), (10000, 0), (5500, 2000), (3000, 20000)]:
+        expected = scalar_order_quantities(strategy, prices, position, ie_position)
+        actual = cal_order_quantities(strategy, prices, position, ie_position)
+        for e, a in zip(expected, actual):
+            assert e == a.tolist()
+
+
+def test_cal_order_quantities_paths():
+    strategy = GridTradingStrategy(11, 10, 10, 10000, 20000, 100, 100)
+    rng = np.random.default_rng(1)
+    prices = 10.5 + np.cumsum(rng.normal(0, 0.05, (3, 500)), axis=-1)
+    actual = cal_order_quantities(strategy, prices, [0, 10000, 5000], 0)
+    for i, position in enumerate([0, 10000, 5000]):
+        expected = scalar_order_quantities(strategy, prices[i], position, 0)
+        for e, a in zip(expected, actual):
+            assert e == a[i].tolist()
+
+
+def test_cal_fee():
+    fee = cal_fee(np.array([0, 1000, 100000]), commission_rate=0.0003, min_commission=3, platform_fee=15,
+                  stamp_duty_rate=0.0013)
+    assert np.allclose(fee, [0, 3 + 15 + 2, 30 + 15 + 130])
+
+
+def test_backtest():
+    strategy = GridTradingStrategy(4.4, 4, 2, 10000, 600, 100, 100)
+    prices = np.array([3.9, 4.25, 3.9])
+    ie_prices = np.array([10, 9.5, 10])
+    result = backtest(strategy, prices, ie_prices, 50000)
+    assert result.position.tolist() == [10000, 5000, 10000]
+    assert result.ie_position.tolist() == [0, 300, 0]
+    assert np.allclose(result.cash, [11000, 29400, 12900])
+    assert np.allclose(result.equity, [50000, 53500, 51900])
@@ -0,0 +1,64 @@
+import pandas as pd
+
+from trade.broker_state import BrokerState
+
+
+def test_load_positions():
+    state = BrokerState()
+    drift = state.load_positions(pd.DataFrame({'code': ['HK.07226'], 'qty': [1000.0]}))
+    assert state.get_position('HK.07226') == 1000
+    assert state.get_position('HK.07552') == 0
+    assert drift == {'HK.07226': (0, 1000)}
+
+    drift = state.load_positions(pd.DataFrame({'code': ['HK.07226'], 'qty': [1000.0]}))
+    assert drift == {}
+
+
+def test_update_deals():
+    state = BrokerState()
+    state.load_positions(pd.DataFrame({'code': ['HK.07226'], 'qty': [1000]}))
+    deals = pd.DataFrame({'deal_id': ['1', '2'], 'code': ['HK.07226', 'HK.07552'], 'trd_side': ['SELL', 'BUY'],
+                          'qty': [400, 200]})
+    state.update_deals(deals)
+    # the same deal pushed twice is only applied once
+    state.update_deals(deals)
+    assert state.get_position('HK.07226') == 600
+    assert state.get_position('HK.07552') == 200
+
+
+def test_update_orders():
+    state = BrokerState()
+    orders = pd.DataFrame({'order_id': ['1'], 'code': ['HK.07226'], 'trd_side': ['BUY'], 'qty': [400],
+                           'dealt_qty': [0], 'order_status': ['SUBMITTED']})
+    state.update_orders(orders)
+    assert state.get_order_status('1') == 'SUBMITTED'
+    assert not state.wait_order_filled_all('1', 0)
+
+    orders['dealt_qty'] = 400
+    orders['order_status'] = 'FILLED_ALL'
+    state.update_orders(orders)
+    assert state.wait_order_filled_all('1', 0)
+    assert state.get_order_status('2') is None
+
+
+def test_reconcile_races_deal_push():
+    clock = iter([100.0, 200.0, 300.0, 400.0])
+    state = BrokerState(now=lambda: next(clock))
+    state.load_positions(pd.DataFrame({'code': ['HK.07226'], 'qty': [1000]}))
+    # received at 100, before the query sent at 150 and reflected by it
+    state.update_deals(pd.DataFrame({'deal_id': ['1'], 'code': ['HK.07226'], 'trd_side': ['BUY'], 'qty': [500]}))
+    # made before the query but pushed after it returns
+    state.update_deals(pd.DataFrame({'deal_id': ['2'], 'code': ['HK.07226'], 'trd_side': ['BUY'], 'qty': [200],
+                                     'create_time': ['1970-01-01 08:02:00.000']}))
+    assert state.get_position('HK.07226') == 1700
+    # made after the query was sent, applied before the query returned
+    state.update_deals(pd.DataFrame({'deal_id': ['3'], 'code': ['HK.07226'], 'trd_side': ['SELL'], 'qty': [300]}))
+
+    drift = state.load_positions(pd.DataFrame({'code': ['HK.07226'], 'qty': [1700]}), query_time=150.0)
+    assert drift == {}
+    assert state.get_position('HK.07226') == 1400
+
+    # deal 2 pushed again late, and a deal made before the query pushed after it
+    state.update_deals(pd.DataFrame({'deal_id': ['2', '4'], 'code': ['HK.07226'] * 2, 'trd_side': ['BUY'] * 2,
+                                     'qty': [200, 100], 'create_time': ['1970-01-01 08:02:00.000'] * 2}))
+    assert state.get_position('HK.07226') == 1400
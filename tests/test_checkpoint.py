@@ -0,0 +1,61 @@
+from time import sleep
+
+from trade.checkpoint import StateStore, config_fingerprint
+
+
+def test_state_store_reloads(tmp_path):
+    path = tmp_path / 'state.json'
+    now = [1000.0]
+    store = StateStore(path, lambda: now[0], static_ttl=60)
+    assert not store.check_config(config_fingerprint({'symbol': 'HK.07226', 'ie_symbol': 'HK.07552'}))
+    store.set_lot_sizes({'HK.07226': 100, 'HK.07552': 500})
+    store.set_positions({'HK.07226': 1000})
+    store.add_pending_order('1', 'HK.07226', 'BUY', 1000)
+    store.add_pending_order('2', 'HK.07552', 'SELL', 500)
+    store.remove_pending_orders(['1', '3'])
+    store.set_adaptive_grid('HK.07226', {'center': 4.2})
+
+    store = StateStore(path, lambda: now[0], static_ttl=60)
+    # the same content in another key order
+    assert store.check_config(config_fingerprint({'ie_symbol': 'HK.07552', 'symbol': 'HK.07226'}))
+    assert store.get_lot_sizes(['HK.07226', 'HK.07552', 'HK.07300']) == {'HK.07226': 100, 'HK.07552': 500}
+    assert store.positions == {'HK.07226': 1000}
+    assert store.pending_orders == {'2': {'code': 'HK.07552', 'trd_side': 'SELL', 'qty': 500}}
+    assert store.adaptive_grids == {'HK.07226': {'center': 4.2}}
+
+    now[0] += 60
+    assert store.get_lot_sizes(['HK.07226']) == {}
+    # a changed config drops the recentered grids only
+    assert not store.check_config(config_fingerprint({'symbol': 'HK.07300'}))
+    assert store.adaptive_grids == {}
+    assert store.positions == {'HK.07226': 1000}
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_state_store_corrupted_file(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('{"version": 1, "positions": {"HK.07')
+    store = StateStore(path)
+    assert store.positions == {}
+    store.set_positions({'HK.07226': 1000})
+    assert StateStore(path).positions == {'HK.07226': 1000}
+
+
+def test_state_store_saves_later_in_batches(tmp_path):
+    path = tmp_path / 'state.json'
+    store = StateStore(path, save_interval=0.05)
+    calls = []
+
+    def source():
+        calls.append(len(calls))
+        return {'fills': len(calls)}
+
+    for _ in range(10):
+        store.save_later('accounting', source)
+    for _ in range(100):
+        if StateStore(path).accounting:
+            break
+        sleep(0.01)
+    # the changes made within the save interval are written once
+    assert StateStore(path).accounting == {'fills': 1}
+    assert calls == [0]
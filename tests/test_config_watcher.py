@@ -0,0 +1,32 @@
+import os
+
+from trade.config_watcher import ConfigWatcher
+
+
+def test_config_watcher(tmp_path):
+    path = tmp_path / 'config.yml'
+    path.write_text('symbol: HK.07226\n')
+    now = [0.0]
+    watcher = ConfigWatcher(path, interval=5, clock=lambda: now[0])
+    now[0] = 5
+    assert watcher.poll() is None
+
+    path.write_text('symbol: HK.07300\n')
+    # checked once per interval only
+    now[0] = 9
+    assert watcher.poll() is None
+    now[0] = 10
+    assert watcher.poll() == {'symbol': 'HK.07300'}
+    now[0] = 15
+    assert watcher.poll() is None
+
+    # an invalid file is skipped until the next change
+    path.write_text('symbol: [HK.07300\n')
+    now[0] = 20
+    assert watcher.poll() is None
+    path.write_text('symbol: HK.07226\n')
+    stat = path.stat()
+    # same size, only the modification time tells the change
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    now[0] = 25
+    assert watcher.poll() == {'symbol': 'HK.07226'}
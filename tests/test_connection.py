@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+from futu import RET_OK, RET_ERROR
+
+from trade import api
+from trade.connection import ConnectionManager
+
+
+class StubContext:
+    opened = 0
+
+    def __init__(self):
+        StubContext.opened += 1
+        self.handlers = []
+        self.subscriptions = []
+        self.alive = True
+        self.closed = False
+
+    def set_handler(self, handler):
+        self.handlers.append(handler)
+
+    def subscribe(self, code_list, subtype_list):
+        self.subscriptions.append(code_list)
+        return RET_OK, None
+
+    def get_global_state(self):
+        return (RET_OK, {'market_hk': 'MORNING'}) if self.alive else (RET_ERROR, "disconnected")
+
+    def get_stock_basicinfo(self, market, code_list):
+        return RET_OK, pd.DataFrame({'code': code_list, 'lot_size': [500]})
+
+    def close(self):
+        self.closed = True
+
+
+def test_lazy_contexts():
+    StubContext.opened = 0
+    connection = ConnectionManager(quote_factory=StubContext, trade_factory=StubContext)
+    assert StubContext.opened == 0
+
+    assert connection.quote_ctx is connection.quote_ctx
+    assert StubContext.opened == 1
+
+
+def test_reconnect_restores_handlers_and_subscriptions():
+    connection = ConnectionManager(quote_factory=StubContext, trade_factory=StubContext)
+    connection.set_quote_handler("handler")
+    connection.subscribe(['HK.07226'], ['QUOTE'])
+    old_ctx = connection.quote_ctx
+
+    old_ctx.alive = False
+    with pytest.raises(ValueError):
+        connection.ping()
+    connection.reconnect()
+
+    assert old_ctx.closed
+    assert connection.quote_ctx is not old_ctx
+    assert connection.quote_ctx.handlers == ["handler"]
+    assert connection.quote_ctx.subscriptions == [['HK.07226']]
+    connection.ping()
+
+
+def test_failed_reopen_is_unhealthy():
+    opened = []
+
+    def trade_factory():
+        if opened:
+            raise ValueError("Unable to unlock trade")
+        opened.append(StubContext())
+        return opened[-1]
+
+    connection = ConnectionManager(quote_factory=StubContext, trade_factory=trade_factory)
+    connection.trd_ctx
+    with pytest.raises(ValueError):
+        connection.reconnect()
+    # the trade context failed to reopen, the heartbeat keeps reconnecting
+    with pytest.raises(ValueError, match="trade context is not open"):
+        connection.ping()
+
+
+def test_get_lot_size_cached(monkeypatch):
+    StubContext.opened = 0
+    monkeypatch.setattr(api, "connection", ConnectionManager(quote_factory=StubContext, trade_factory=StubContext))
+    api.get_lot_size.cache_clear()
+    assert api.get_lot_size('HK.07226') == 500
+    api.connection.quote_ctx.get_stock_basicinfo = None
+    assert api.get_lot_size('HK.07226') == 500
+    api.get_lot_size.cache_clear()
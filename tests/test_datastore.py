@@ -0,0 +1,32 @@
+import numpy as np
+
+from trade import datastore
+from trade.datastore import ingest_csv, load
+
+
+def test_ingest_daily_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "CHUNK_ROWS", 2)
+    csv_path = tmp_path / "07226.csv"
+    csv_path.write_text("Date,Open,High,Low,Close,Adj Close,Volume\n"
+                        "2021-01-04,4.0,4.2,3.9,4.1,4.1,1000\n"
+                        "2021-01-05,null,null,null,null,null,null\n"
+                        "2021-01-06,4.1,4.3,4.0,4.2,4.2,2000\n"
+                        "2021-01-07,4.2,4.4,4.1,4.3,4.3,0\n")
+    data = np.load(ingest_csv(csv_path))
+    assert data.dtype.names == ('time', 'open', 'high', 'low', 'close', 'adj_close', 'volume')
+    assert data['time'].tolist() == list(np.array(['2021-01-04', '2021-01-06', '2021-01-07'],
+                                                  dtype='datetime64[s]').tolist())
+    assert data['close'].tolist() == [4.1, 4.2, 4.3]
+    assert data['volume'].tolist() == [1000, 2000, 0]
+
+
+def test_load_ticks_csv(tmp_path):
+    csv_path = tmp_path / "prices.csv"
+    csv_path.write_text("time,price,ie_price\n"
+                        "1609722000,4.0,10.0\n"
+                        "1609722001,4.1,9.8\n")
+    data = load(csv_path)
+    assert isinstance(data, np.memmap)
+    assert (tmp_path / "prices.csv.npy").exists()
+    assert data['time'].astype(np.int64).tolist() == [1609722000, 1609722001]
+    assert data['ie_price'].tolist() == [10.0, 9.8]
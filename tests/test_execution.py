@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from trade.broker_state import BrokerState
+from trade.execution import OrderExecutor
+from trade.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def push_order(state, order_id, code, trd_side, qty, order_status, deal=True):
+    filled = order_status == 'FILLED_ALL'
+    state.update_orders(pd.DataFrame({'order_id': [order_id], 'code': [code], 'trd_side': [trd_side], 'qty': [qty],
+                                      'dealt_qty': [qty if filled else 0], 'order_status': [order_status]}))
+    if filled and deal:
+        push_deal(state, order_id, code, trd_side, qty)
+
+
+def push_deal(state, order_id, code, trd_side, qty):
+    state.update_deals(pd.DataFrame({'deal_id': [order_id], 'order_id': [order_id], 'code': [code],
+                                     'trd_side': [trd_side], 'qty': [qty]}))
+
+
+def test_execute_sells_before_buys():
+    state = BrokerState()
+    placed = []
+
+    def place_order(symbol, quantity, trade_side):
+        placed.append((symbol, trade_side))
+        order_id = str(len(placed))
+        # fill the order immediately
+        push_order(state, order_id, symbol, trade_side, quantity, 'FILLED_ALL')
+        return order_id
+
+    executor = OrderExecutor(state, place_order, lambda order_id: None, timeout=1)
+    executor.execute([('HK.07226', 1000), ('HK.07552', -600)]).result(timeout=1)
+    assert placed == [('HK.07552', 'SELL'), ('HK.07226', 'BUY')]
+
+
+def test_execute_waits_for_deals():
+    state = BrokerState()
+
+    def place_order(symbol, quantity, trade_side):
+        # the order push comes before the deal push
+        push_order(state, '1', symbol, trade_side, quantity, 'FILLED_ALL', deal=False)
+        return '1'
+
+    executor = OrderExecutor(state, place_order, lambda order_id: None, timeout=1)
+    future = executor.execute([('HK.07226', 1000)])
+    with pytest.raises(TimeoutError):
+        future.result(timeout=0.2)
+    assert state.get_position('HK.07226') == 0
+    push_deal(state, '1', 'HK.07226', 'BUY', 1000)
+    future.result(timeout=1)
+    assert state.get_position('HK.07226') == 1000
+
+
+def test_execute_timeout_cancels_order():
+    state = BrokerState()
+    cancelled = []
+    executor = OrderExecutor(state, lambda symbol, quantity, trade_side: '1', cancelled.append, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        executor.execute([('HK.07226', -1000), ('HK.07552', 600)]).result(timeout=1)
+    assert cancelled == ['1']
+
+
+def test_order_placed_after_timeout_is_cancelled():
+    state = BrokerState()
+    cancelled = []
+    release = threading.Event()
+
+    def place_order(symbol, quantity, trade_side):
+        # still placing when the leg times out
+        release.wait(1)
+        return '1'
+
+    executor = OrderExecutor(state, place_order, cancelled.append, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        executor.execute([('HK.07226', 1000)]).result(timeout=1)
+    assert cancelled == []
+    release.set()
+    deadline = time.monotonic() + 1
+    while not cancelled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancelled == ['1']
+
+
+def test_queued_order_not_placed_after_timeout():
+    state = BrokerState()
+    placed = []
+    release = threading.Event()
+
+    def place_order(symbol, quantity, trade_side):
+        placed.append(symbol)
+        release.wait(1)
+        return None
+
+    # the second order of the leg is queued behind the first one
+    executor = OrderExecutor(state, place_order, lambda order_id: None, timeout=0.1, max_workers=1)
+    with pytest.raises(TimeoutError):
+        executor.execute([('HK.07226', 1000), ('HK.07552', 600)]).result(timeout=1)
+    release.set()
+    executor._order_pool.shutdown(wait=True)
+    assert placed == ['HK.07226']
+
+
+def test_execute_order_failed():
+    state = BrokerState()
+
+    def place_order(symbol, quantity, trade_side):
+        push_order(state, '1', symbol, trade_side, quantity, 'SUBMIT_FAILED')
+        return '1'
+
+    executor = OrderExecutor(state, place_order, lambda order_id: None, timeout=1)
+    with pytest.raises(ValueError):
+        executor.execute([('HK.07226', 1000)]).result(timeout=1)
+
+
+def test_execute_dry_run():
+    executor = OrderExecutor(BrokerState(), lambda symbol, quantity, trade_side: None, lambda order_id: None)
+    assert executor.execute([('HK.07226', 1000), ('HK.07552', -600)]).result(timeout=1) is None
+
+
+def test_execute_throttled_orders_of_concurrent_rebalances():
+    state = BrokerState()
+    clock = FakeClock()
+    placed = []
+
+    def place_order(symbol, quantity, trade_side):
+        placed.append((symbol, clock.now))
+        push_order(state, str(len(placed)), symbol, trade_side, quantity, 'FILLED_ALL')
+        return str(len(placed))
+
+    executor = OrderExecutor(state, place_order, lambda order_id: None, timeout=1, max_rebalances=2,
+                             throttle=RateLimiter(2, 30, clock=clock, sleep=clock.sleep))
+    futures = [executor.execute([('HK.07226', 1000)]), executor.execute([('HK.07300', 1000)]),
+               executor.execute([('HK.07552', -600)])]
+    for future in futures:
+        future.result(timeout=1)
+    assert sorted(t for _, t in placed) == [0, 0, 30]
+
+
+def test_resume_pending_orders():
+    state = BrokerState()
+    push_order(state, '1', 'HK.07226', 'BUY', 1000, 'FILLED_ALL')
+    push_order(state, '2', 'HK.07552', 'SELL', 600, 'SUBMITTED')
+    executor = OrderExecutor(state, lambda symbol, quantity, trade_side: pytest.fail("placed again"),
+                             lambda order_id: None, timeout=1)
+    resumed = executor.resume(['1', '2'])
+    assert not resumed.done()
+    push_order(state, '2', 'HK.07552', 'SELL', 600, 'FILLED_ALL')
+    resumed.result(timeout=1)
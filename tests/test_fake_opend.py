@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+from futu import RET_OK, RET_ERROR, OrderType, TrdSide, ModifyOrderOp
+
+from trade.fake_opend import Replay, FakeQuoteContext, FakeTradeContext, ReplayFinished
+from trade.recorder import Recorder, RecordingContext
+
+
+class StubQuoteContext:
+    def get_market_snapshot(self, code_list):
+        return RET_OK, pd.DataFrame({'code': code_list, 'update_time': '2021-01-04 09:30:00', 'last_price': 4.0,
+                                     'volume': 100})
+
+    def get_global_state(self):
+        return RET_OK, {'market_hk': 'MORNING'}
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    recorder = Recorder(path)
+    recorder.record('get_stock_basicinfo', pd.DataFrame({'code': ['HK.07226'], 'lot_size': [500]}))
+    recorder.record('position_list_query', pd.DataFrame({'code': ['HK.07226'], 'qty': [1000]}))
+    ctx = RecordingContext(StubQuoteContext(), recorder)
+    ctx.get_global_state()
+    ctx.get_market_snapshot(['HK.07226'])
+    recorder.record('quote', {'code': 'HK.07226', 'last_price': 4.2})
+    recorder.close()
+    return path
+
+
+def test_replay(recording):
+    replay = Replay(recording, speed=0)
+    assert replay.lot_sizes == {'HK.07226': 500}
+    assert replay.positions == {'HK.07226': 1000}
+    assert replay.market_state() == 'MORNING'
+
+    quote_ctx = FakeQuoteContext(replay)
+    ret, data = quote_ctx.get_market_snapshot('HK.07226')
+    assert ret == RET_OK and data['last_price'][0] == 4.0
+    # the order book is made up around the last price
+    ret, data = quote_ctx.get_order_book('HK.07226', num=2)
+    assert ret == RET_OK
+    assert [level[0] for level in data['Bid']] == [3.99, 3.98] and [level[0] for level in data['Ask']] == [4.0, 4.01]
+
+    replay.sleep(3600)
+    ret, data = quote_ctx.get_market_snapshot('HK.07226')
+    assert data['last_price'][0] == 4.2
+    with pytest.raises(ReplayFinished):
+        quote_ctx.get_global_state()
+
+
+def test_fake_trade_context(recording):
+    replay = Replay(recording, speed=0)
+    trd_ctx = FakeTradeContext(replay)
+
+    ret, data = trd_ctx.place_order(4.1, 500, 'HK.07226', TrdSide.BUY, OrderType.MARKET)
+    assert ret == RET_OK
+    ret, data = trd_ctx.position_list_query()
+    assert data.loc[data['code'] == 'HK.07226', 'qty'].tolist() == [1500]
+
+    # the limit is below the price, not filled
+    ret, data = trd_ctx.place_order(3.9, 500, 'HK.07226', TrdSide.BUY, OrderType.NORMAL)
+    order_id = data['order_id'][0]
+    ret, data = trd_ctx.order_list_query(order_id=order_id)
+    assert data['order_status'][0] == 'SUBMITTED'
+    assert trd_ctx.modify_order(ModifyOrderOp.CANCEL, order_id, 0, 0)[0] == RET_OK
+    assert trd_ctx.modify_order(ModifyOrderOp.CANCEL, order_id, 0, 0)[0] == RET_ERROR
@@ -0,0 +1,58 @@
+import numpy as np
+
+from trade.datastore import load
+from trade.gap import cal_ratios, expand_gap_params, simulate, scan, rank, find_data_files, DEFAULT_PARAMS
+
+DAILY_CSV = ("Date,Open,High,Low,Close,Adj Close,Volume\n"
+             "2021-01-04,10.0,10.0,10.0,10.0,10.0,1000\n"
+             # gap down 10%, low reaches the 2% take profit
+             "2021-01-05,9.0,9.1,8.8,8.9,8.9,1000\n"
+             # no volume, skipped
+             "2021-01-06,9.9,9.9,9.9,9.9,9.9,0\n"
+             # dip, high +5% without reaching the 1.2% take profit
+             "2021-01-07,8.8,9.24,8.8,9.2,9.2,1000\n"
+             # opens above the previous close, not traded
+             "2021-01-08,9.3,9.5,9.0,9.1,9.1,1000\n")
+
+
+def write_csv(path, text=DAILY_CSV):
+    path.write_text(text)
+    return path
+
+
+def test_simulate(tmp_path):
+    ratios = cal_ratios(load(write_csv(tmp_path / "07226.HK.csv")))
+    np.testing.assert_allclose(ratios[0], [-0.1, 8.8 / 8.9 - 1, 9.3 / 9.2 - 1])
+
+    params_list = expand_gap_params({'stop_loss': [0.1, 0.03]})
+    assert len(params_list) == 2 and params_list[0] == DEFAULT_PARAMS
+    result = simulate(ratios, params_list)
+    np.testing.assert_allclose(result['profit'], [0.02 - 0.05, 0.02 - 0.03])
+    assert result['trades'].tolist() == [2, 2]
+    assert result['profit_trades'].tolist() == [1, 1]
+    np.testing.assert_allclose(result['max_drawdown'], [0.05, 0.03])
+
+
+def test_scan_and_rank(tmp_path):
+    write_csv(tmp_path / "07226.HK.csv")
+    # only gaps down, always profits
+    write_csv(tmp_path / "07552.HK.csv", "Date,Open,High,Low,Close,Adj Close,Volume\n"
+                                         "2021-01-04,10.0,10.0,10.0,10.0,10.0,1000\n"
+                                         "2021-01-05,9.0,9.0,8.0,8.0,8.0,1000\n")
+    # not a daily OHLCV file
+    write_csv(tmp_path / "prices.csv", "time,price\n1609722000,4.0\n")
+
+    params_list = expand_gap_params({'gap_down_take_profit': [0.02, 0.04]})
+    scanned = scan(sorted(tmp_path.glob("*.csv")), params_list, processes=2)
+    assert sorted(scanned) == ['07226.HK', '07552.HK']
+    rows = rank(scanned, params_list, top=3)
+    assert [(r['symbol'], r['gap_down_take_profit']) for r in rows] == [('07552.HK', 0.04), ('07552.HK', 0.02),
+                                                                          ('07226.HK', 0.02)]
+    assert rows[0]['profit'] == 0.04
+
+
+def test_find_data_files_of_kline_store(tmp_path):
+    (tmp_path / "a.csv").write_text("")
+    (tmp_path / "a.csv.npy").write_text("")
+    (tmp_path / "HK.07226.npy").write_text("")
+    assert [p.name for p in find_data_files(tmp_path)] == ["HK.07226.npy", "a.csv"]
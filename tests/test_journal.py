@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pandas as pd
+
+from trade.journal import Journal, load_journal, JOURNAL_DTYPE, SIGNAL, ORDER, FILL, POSITION
+from trade.trading_calendar import HKT
+
+
+def test_journal(tmp_path):
+    now = [datetime(2021, 1, 4, 9, 30, tzinfo=HKT).timestamp()]
+    journal = Journal(tmp_path, lambda: now[0])
+    journal.record(SIGNAL, 'HK.07226', 1000, 4.2, 1, grid_index=3)
+    journal.record(ORDER, 'HK.07226', 1000, side=1, order_id='12345678901234567890')
+    journal.record_deals(pd.DataFrame({'deal_id': ['1'], 'order_id': ['12345678901234567890'], 'code': ['HK.07226'],
+                                       'trd_side': ['BUY'], 'qty': [1000], 'price': [4.21]}))
+    # the next day goes to another file
+    now[0] += 86400
+    journal.record_positions({'HK.07226': 1000, 'HK.07552': 0})
+    journal.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['2021-01-04.journal', '2021-01-05.journal']
+    records = load_journal(tmp_path)
+    assert records.dtype == JOURNAL_DTYPE
+    assert records['kind'].tolist() == [SIGNAL, ORDER, FILL, POSITION, POSITION]
+    assert records['order_id'][2] == b'12345678901234567890'
+    assert records['price'][2] == 4.21
+    assert records['grid_index'].tolist() == [3, -1, -1, -1, -1]
+    assert records['quantity'][3:].tolist() == [1000, 0]
+
+
+def test_partial_record_dropped(tmp_path):
+    now = datetime(2021, 1, 4, 9, 30, tzinfo=HKT).timestamp()
+    journal = Journal(tmp_path, lambda: now)
+    journal.record(POSITION, 'HK.07226', 1000)
+    journal.close()
+    path = tmp_path / '2021-01-04.journal'
+    with open(path, 'ab') as f:
+        f.write(b'partial')
+    assert len(load_journal(path)) == 1
+
+    journal = Journal(tmp_path, lambda: now)
+    journal.record(POSITION, 'HK.07226', 2000)
+    journal.close()
+    assert load_journal(path)['quantity'].tolist() == [1000, 2000]
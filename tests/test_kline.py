@@ -0,0 +1,129 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade.datastore import load
+from trade.fake_opend import FakeKlineContext
+from trade.kline import KlineStore, KlineDownloader, missing_ranges, is_leveraged_inverse, KLINE_DTYPE
+from trade.scheduler import RequestScheduler
+
+TODAY = date(2021, 1, 20)
+
+
+def make_klines(start, days, price=4.0):
+    times = [(start + timedelta(days=i)).isoformat() + " 00:00:00" for i in range(days)]
+    prices = price + np.arange(days) * 0.01
+    return pd.DataFrame({'time_key': times, 'open': prices, 'high': prices + 0.05, 'low': prices - 0.05,
+                         'close': prices, 'volume': 1000, 'turnover': prices * 1000})
+
+
+def make_downloader(store, ctx, workers=2):
+    scheduler = RequestScheduler()
+
+    def request_page(symbol, start, end, ktype, autype, page_req_key=None, max_count=1000):
+        ret, data, page_req_key = scheduler.call('request_history_kline', ctx.request_history_kline, symbol,
+                                                 start=start, end=end, ktype=ktype, autype=autype,
+                                                 max_count=3, page_req_key=page_req_key)
+        if ret != 0:
+            raise ValueError(data)
+        return data, page_req_key
+
+    def get_quota():
+        _, (used, remain, _) = ctx.get_history_kl_quota()
+        return used, remain
+
+    return KlineDownloader(store, request_page, get_quota, workers=workers, today=lambda: TODAY)
+
+
+def test_missing_ranges():
+    d = date(2021, 1, 10)
+    assert missing_ranges(None, d, d + timedelta(days=5)) == [(d, d + timedelta(days=5))]
+    coverage = (d, d + timedelta(days=5))
+    assert missing_ranges(coverage, d + timedelta(days=1), d + timedelta(days=3)) == []
+    assert missing_ranges(coverage, d - timedelta(days=2), d + timedelta(days=7)) == [
+        (d - timedelta(days=2), d - timedelta(days=1)), (d + timedelta(days=6), d + timedelta(days=7))]
+    # a range after the coverage is extended back to it, so the coverage has no hole
+    assert missing_ranges(coverage, d + timedelta(days=9), d + timedelta(days=9)) == [
+        (d + timedelta(days=6), d + timedelta(days=9))]
+
+
+def test_is_leveraged_inverse():
+    assert is_leveraged_inverse("HK.07226")
+    assert is_leveraged_inverse("HK.07552")
+    assert not is_leveraged_inverse("HK.02800")
+    assert not is_leveraged_inverse("US.7226")
+
+
+def test_download_incrementally(tmp_path):
+    ctx = FakeKlineContext({'HK.07226': make_klines(date(2021, 1, 1), 20),
+                            'HK.07552': make_klines(date(2021, 1, 1), 20, price=10)})
+    store = KlineStore(tmp_path)
+    downloader = make_downloader(store, ctx)
+
+    results = downloader.download(['HK.07226', 'HK.07552'], ['day'], date(2021, 1, 5), date(2021, 1, 10))
+    assert results == {('HK.07226', 'day'): 6, ('HK.07552', 'day'): 6}
+    assert store.coverage('HK.07226', 'day') == (date(2021, 1, 5), date(2021, 1, 10))
+    data = load(store.path('HK.07226', 'day'))
+    assert data.dtype == KLINE_DTYPE
+    assert data['time'][0] == np.datetime64('2021-01-05') and len(data) == 6
+
+    ctx.requests.clear()
+    results = downloader.download(['HK.07226'], ['day'], date(2021, 1, 3), date(2021, 1, 15))
+    # only the missing dates are requested
+    assert {(start, end) for _, start, end, _ in ctx.requests} == {('2021-01-03', '2021-01-04'),
+                                                                   ('2021-01-11', '2021-01-15')}
+    assert results == {('HK.07226', 'day'): 7}
+    data = store.load('HK.07226', 'day')
+    assert len(data) == 13 and np.all(np.diff(data['time'].astype(np.int64)) > 0)
+
+    # today is not over, it is fetched again next time
+    downloader.download(['HK.07226'], ['day'], date(2021, 1, 3), TODAY)
+    assert store.coverage('HK.07226', 'day') == (date(2021, 1, 3), TODAY - timedelta(days=1))
+    ctx.requests.clear()
+    downloader.download(['HK.07226'], ['day'], date(2021, 1, 3), TODAY)
+    assert {(start, end) for _, start, end, _ in ctx.requests} == {(TODAY.isoformat(), TODAY.isoformat())}
+    assert len(store.load('HK.07226', 'day')) == 18
+
+
+def test_resume_interrupted_download(tmp_path):
+    ctx = FakeKlineContext({'HK.07226': make_klines(date(2021, 1, 1), 10)})
+    store = KlineStore(tmp_path)
+    downloader = make_downloader(store, ctx, workers=1)
+    request_page = downloader.request_page
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise ConnectionError("OpenD disconnected")
+        return request_page(*args, **kwargs)
+
+    downloader.request_page = interrupted
+    assert downloader.download(['HK.07226'], ['day'], date(2021, 1, 1), date(2021, 1, 10)) == {}
+    assert store.coverage('HK.07226', 'day') is None
+    assert len(store.read_part('HK.07226', 'day')) == 6
+
+    # a crash in the middle of writing a record leaves a partial record
+    with open(tmp_path / "day" / "HK.07226.part", "ab") as f:
+        f.write(b"\0" * 10)
+
+    downloader = make_downloader(KlineStore(tmp_path), ctx, workers=1)
+    ctx.requests.clear()
+    assert downloader.download(['HK.07226'], ['day'], date(2021, 1, 1), date(2021, 1, 10)) == {
+        ('HK.07226', 'day'): 5}
+    # resumed from the day of the last kline downloaded
+    assert ctx.requests[0][1] == '2021-01-06'
+    store = downloader.store
+    assert store.coverage('HK.07226', 'day') == (date(2021, 1, 1), date(2021, 1, 10))
+    assert store.load('HK.07226', 'day')['close'].tolist() == pytest.approx(4.0 + np.arange(10) * 0.01)
+    assert not (tmp_path / "day" / "HK.07226.part").exists()
+
+
+def test_quota(tmp_path):
+    ctx = FakeKlineContext({symbol: make_klines(date(2021, 1, 1), 5) for symbol in ['HK.07226', 'HK.07552']},
+                           quota=1)
+    downloader = make_downloader(KlineStore(tmp_path), ctx)
+    results = downloader.download(['HK.07226', 'HK.07552'], ['day', '1m'], date(2021, 1, 1), date(2021, 1, 5))
+    assert results == {('HK.07226', 'day'): 5, ('HK.07226', '1m'): 5}
@@ -0,0 +1,56 @@
+import urllib.request
+
+import pytest
+
+from trade import metrics
+from trade.metrics import Stage, timed
+
+
+def test_percentile():
+    s = Stage("test")
+    for ns in range(1, 1001):
+        s.record(ns * 1000)
+    assert s.calls == 1000
+    assert s.max_ns == 1000000
+    # within the precision of the buckets
+    assert s.percentile(0.5) == pytest.approx(500000, rel=0.07)
+    assert s.percentile(0.99) == pytest.approx(990000, rel=0.07)
+    assert s.percentile(1) == 1000000
+    assert Stage("empty").percentile(0.5) == 0
+
+
+def test_timed_counts_errors():
+    @timed
+    def rate_limited_call():
+        raise ValueError("Unable to get data, error=获取快照频率太高")
+
+    with pytest.raises(ValueError):
+        rate_limited_call()
+    s = metrics.stage("rate_limited_call")
+    assert (s.calls, s.errors, s.rate_limited) == (1, 1, 1)
+
+
+def test_serve():
+    metrics.stage("served").record(1000)
+    server = metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'futu_grid_trading_calls_total{stage="served"} 1' in text
+    assert "served: calls=1" in metrics.format_summary()
+
+
+def test_gauges():
+    def gauges():
+        return {"test_realized_pnl": 12.5, "test_cash_use": None}
+
+    metrics.register_gauges(gauges)
+    try:
+        text = metrics.format_prometheus()
+        assert "futu_grid_trading_test_realized_pnl 12.5" in text
+        assert "test_cash_use" not in text
+    finally:
+        metrics.unregister_gauges(gauges)
+    assert "test_realized_pnl" not in metrics.format_prometheus()
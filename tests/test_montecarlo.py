@@ -0,0 +1,59 @@
+import numpy as np
+
+from trade.montecarlo import gbm_paths, bootstrap_paths, leveraged_paths, run_simulation, summarize, METRIC_NAMES
+
+STRATEGY_PARAMS = dict(grid_upper_limit_price=5.6, grid_lower_limit_price=3.6, grid_count=10,
+                       grid_lower_limit_position=10000, ie_max_position=10000)
+
+
+def test_gbm_paths():
+    prices, ie_prices = gbm_paths(np.random.default_rng(0), 200, 101, 4.6, 4.3, 0.01, rho=-0.8)
+    assert prices.shape == ie_prices.shape == (200, 101)
+    assert np.all(prices[:, 0] == 4.6) and np.all(ie_prices[:, 0] == 4.3)
+    returns, ie_returns = np.diff(np.log(prices)).ravel(), np.diff(np.log(ie_prices)).ravel()
+    assert abs(np.corrcoef(returns, ie_returns)[0, 1] + 0.8) < 0.02
+
+
+def test_bootstrap_paths():
+    history = np.array([4.0, 4.4, 4.0, 4.4, 4.0])
+    prices, ie_prices = bootstrap_paths(np.random.default_rng(0), 10, 7, history, 20 / history, block=2)
+    assert prices.shape == (10, 7)
+    # the joint returns are drawn together
+    np.testing.assert_allclose(prices * ie_prices, 20)
+    assert set(np.round(prices.ravel(), 6)) <= {4.0, 4.4, 3.636364}
+
+
+def test_leveraged_paths_decay():
+    rng = np.random.default_rng(0)
+    prices, ie_prices = leveraged_paths(rng, 1, 3, 4.0, 4.0, 0.0, leverage=2, ie_leverage=-2, steps_per_day=1)
+    np.testing.assert_allclose(prices, 4.0)
+
+    # the index goes up 10% and back in two days, both daily reset ETFs lose
+    class Rng:
+        def standard_normal(self, shape):
+            return np.array([[np.log(1.1), -np.log(1.1)]]) / 0.1
+
+    prices, ie_prices = leveraged_paths(Rng(), 1, 3, 4.0, 4.0, 0.1, mu=0.005, steps_per_day=1)
+    np.testing.assert_allclose(prices[0], [4.0, 4.8, 4.8 * (1 - 2 * (1 - 1 / 1.1))])
+    np.testing.assert_allclose(ie_prices[0], [4.0, 3.2, 3.2 * (1 + 2 * (1 - 1 / 1.1))])
+    assert prices[0, -1] < 4.0 and ie_prices[0, -1] < 4.0
+
+
+def test_run_simulation():
+    model_params = dict(price=4.6, ie_price=4.3, sigma=0.005, steps_per_day=10)
+    metrics = run_simulation('leveraged', model_params, STRATEGY_PARAMS, 100, 100, 100000, 50, 500, seed=1,
+                             batch_size=16, processes=1)
+    assert all(metrics[name].shape == (50,) for name in METRIC_NAMES)
+    # the positions are bought on the first tick
+    assert np.all(metrics['max_capital_use'] > 0.4)
+    assert np.all((0 <= metrics['time_outside']) & (metrics['time_outside'] <= 1))
+
+    # the same paths whatever the number of processes
+    pooled = run_simulation('leveraged', model_params, STRATEGY_PARAMS, 100, 100, 100000, 50, 500, seed=1,
+                            batch_size=16, processes=2)
+    for name in METRIC_NAMES:
+        np.testing.assert_array_equal(metrics[name], pooled[name])
+
+    rows, over_limit = summarize(metrics, capital_use_limit=0.4)
+    assert [row['metric'] for row in rows] == METRIC_NAMES
+    assert over_limit == 1.0
@@ -0,0 +1,159 @@
+import threading
+
+import pandas as pd
+
+from trade import orderbook
+from trade.broker_state import BrokerState
+from trade.orderbook import (OrderBook, OrderBookCache, LimitExecution, tick_size, book_tick_size, child_order,
+                             is_outpriced)
+from trade.push import OrderBookPushHandler
+from trade.ratelimit import RateLimiter
+
+
+def push_order(state, order_id, code, trd_side, qty, dealt_qty, order_status):
+    state.update_orders(pd.DataFrame({'order_id': [order_id], 'code': [code], 'trd_side': [trd_side], 'qty': [qty],
+                                      'dealt_qty': [dealt_qty], 'order_status': [order_status]}))
+    if dealt_qty:
+        state.update_deals(pd.DataFrame({'deal_id': [order_id], 'order_id': [order_id], 'code': [code],
+                                         'trd_side': [trd_side], 'qty': [dealt_qty]}))
+
+
+def test_tick_size():
+    assert tick_size(0.2) == 0.001
+    assert tick_size(4.5) == 0.01
+    assert tick_size(10) == 0.02
+    assert book_tick_size(OrderBook([(4.5, 100), (4.498, 100)], [(4.51, 100)])) == 0.002
+    assert book_tick_size(OrderBook([(4.5, 100)], [(4.51, 100)])) == 0.01
+
+
+def test_child_order():
+    book = OrderBook([(4.5, 3000), (4.49, 8000)], [(4.53, 1200), (4.54, 9000)])
+    # inside the wide spread
+    assert child_order(book, "BUY", 5000, 500, aggressive=False) == (4.51, 1000)
+    assert child_order(book, "SELL", 5000, 500, aggressive=False) == (4.52, 3000)
+    # the opposite touch, not more than displayed
+    assert child_order(book, "BUY", 5000, 500, aggressive=True) == (4.53, 1000)
+    assert child_order(book, "SELL", 2000, 500, aggressive=True) == (4.5, 2000)
+    assert child_order(book, "BUY", 5000, 500, aggressive=True, depth_fraction=0.1) == (4.53, 500)
+
+    # join the touch when the spread is one tick
+    book = OrderBook([(4.5, 3000), (4.49, 8000)], [(4.51, 1200)])
+    assert child_order(book, "BUY", 5000, 500, aggressive=False) == (4.5, 1000)
+    assert child_order(OrderBook([], [(4.51, 1200)]), "BUY", 5000, 500, aggressive=True) is None
+
+
+def test_is_outpriced():
+    book = OrderBook([(4.5, 3000)], [(4.53, 1200)])
+    # the child order may be the best bid itself
+    assert not is_outpriced(book, "BUY", 4.5, aggressive=False)
+    assert is_outpriced(book, "BUY", 4.49, aggressive=False)
+    assert is_outpriced(book, "BUY", 4.5, aggressive=True)
+    assert not is_outpriced(book, "SELL", 4.53, aggressive=False)
+    assert is_outpriced(book, "SELL", 4.53, aggressive=True)
+
+
+def test_order_book_push():
+    books = OrderBookCache()
+    updates = []
+    books.add_listener(lambda code, book: updates.append(code))
+    OrderBookPushHandler(books.update).handle_order_book(
+        {'code': 'HK.07226', 'Bid': [(4.5, 3000, 2, {})], 'Ask': [(4.51, 1200, 1, {}), (4.52, 800, 1, {})]})
+    assert books.get('HK.07226') == OrderBook([(4.5, 3000)], [(4.51, 1200), (4.52, 800)])
+    assert books.get('HK.07552') is None
+    assert updates == ['HK.07226']
+
+
+class Market:
+    """
+    Fill the child orders against the cached books, a buy at or above the best ask is filled all at once
+    """
+
+    def __init__(self, books, state):
+        self.books = books
+        self.state = state
+        self.placed = []
+        self.cancelled = []
+        self.orders = {}
+
+    def place_order(self, symbol, quantity, price, trade_side):
+        order_id = str(len(self.placed) + 1)
+        self.placed.append((symbol, quantity, price, trade_side))
+        self.orders[order_id] = (symbol, quantity, trade_side)
+        ask = self.books.get(symbol).asks[0][0]
+        status = 'FILLED_ALL' if trade_side == "BUY" and price >= ask else 'SUBMITTED'
+        push_order(self.state, order_id, symbol, trade_side, quantity, quantity if status == 'FILLED_ALL' else 0,
+                   status)
+        return order_id
+
+    def cancel_order(self, order_id):
+        self.cancelled.append(order_id)
+        symbol, quantity, trade_side = self.orders[order_id]
+        push_order(self.state, order_id, symbol, trade_side, quantity, 0, 'CANCELLED_ALL')
+
+
+def make_execution(**kwargs):
+    books = OrderBookCache()
+    state = BrokerState()
+    market = Market(books, state)
+    execution = LimitExecution(books, state, market.place_order, market.cancel_order, lambda symbol: 500, **kwargs)
+    return books, market, execution
+
+
+def test_limit_execution_sized_against_depth():
+    books, market, execution = make_execution(patience=0, timeout=1)
+    books.update('HK.07226', [(4.5, 3000)], [(4.51, 1500)])
+    assert execution.execute('HK.07226', 4000, "BUY") == 4000
+    assert market.placed == [('HK.07226', 1500, 4.51, "BUY"), ('HK.07226', 1500, 4.51, "BUY"),
+                             ('HK.07226', 1000, 4.51, "BUY")]
+
+
+def test_limit_execution_repriced_on_book_update():
+    books, market, execution = make_execution(patience=0.3, timeout=2)
+    books.update('HK.07226', [(4.5, 3000)], [(4.53, 5000)])
+    result = []
+    thread = threading.Thread(target=lambda: result.append(execution('HK.07226', 1000, "BUY")))
+    thread.start()
+    # another bid above the child order inside the spread
+    while not market.placed:
+        pass
+    books.update('HK.07226', [(4.52, 3000)], [(4.53, 5000)])
+    thread.join(2)
+    assert result == [None]
+    # outbid, placed again at the new touch, then crossing the spread once out of patience
+    assert [price for _, _, price, _ in market.placed] == [4.51, 4.52, 4.53]
+    assert market.cancelled == ['1', '2']
+
+
+def test_limit_execution_timeout(caplog):
+    books, market, execution = make_execution(patience=10, timeout=0.2)
+    books.update('HK.07226', [(4.5, 3000)], [(4.53, 5000)])
+    # the shortfall is logged and left to the next rebalance
+    assert execution.execute('HK.07226', 1000, "SELL") == 0
+    assert market.cancelled == ['1']
+    assert "1000 of 1000 not filled" in caplog.text
+
+    assert execution('HK.07552', 1000, "BUY") is None
+    assert "No order book of HK.07552" in caplog.text
+
+
+def test_limit_execution_stops_on_unconfirmed_cancel(monkeypatch, caplog):
+    monkeypatch.setattr(orderbook, 'CANCEL_TIMEOUT', 0.2)
+    books, market, execution = make_execution(patience=10, timeout=0.2)
+    # the cancel is never confirmed
+    execution.cancel_order = market.cancelled.append
+    books.update('HK.07226', [(4.5, 3000)], [(4.53, 5000)])
+    assert execution.execute('HK.07226', 1000, "SELL") == 0
+    # no other child order while the first one may be live
+    assert len(market.placed) == 1
+    assert market.cancelled == ['1']
+    assert "may still be live" in caplog.text
+
+
+def test_limit_execution_throttled_until_deadline(caplog):
+    throttle = RateLimiter(1, 30)
+    assert throttle.try_acquire()
+    books, market, execution = make_execution(patience=0, timeout=0.2, throttle=throttle)
+    books.update('HK.07226', [(4.5, 3000)], [(4.51, 1500)])
+    assert execution.execute('HK.07226', 1000, "BUY") == 0
+    assert market.placed == []
+    assert "rate limit" in caplog.text
@@ -0,0 +1,99 @@
+import signal
+import time
+import tracemalloc
+
+from trade import profiling
+from trade.profiling import Profiler, SamplingProfiler, MemoryProfiler
+
+
+def _busy_wait(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_sampling_profiler_writes_collapsed_stacks(tmp_path):
+    profiler = SamplingProfiler(tmp_path, interval=0.001)
+    profiler.toggle(0.2)
+    _busy_wait(0.3)
+    profiler._thread.join(1)
+    assert not profiler.running
+
+    [path] = tmp_path.glob("cpu-*.collapsed")
+    lines = path.read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any("test_profiling.py:_busy_wait" in line for line in lines)
+    assert not any("cpu-profiler" in line.split(";")[0] for line in lines)
+
+
+def test_sampling_profiler_toggle_stops_early(tmp_path):
+    profiler = SamplingProfiler(tmp_path)
+    profiler.toggle(60)
+    assert profiler.running
+    profiler.toggle()
+    profiler._thread.join(1)
+    assert not profiler.running
+    assert len(list(tmp_path.glob("cpu-*.collapsed"))) == 1
+
+
+def _allocate(keep):
+    keep.append([object() for _ in range(10000)])
+
+
+def test_memory_profiler_reports_allocation_sites(tmp_path):
+    assert not tracemalloc.is_tracing()
+    profiler = MemoryProfiler(tmp_path, patterns=["*/test_profiling.py"])
+    try:
+        assert profiler.snapshot() is None
+        assert tracemalloc.is_tracing()
+        keep = []
+        _allocate(keep)
+        path = profiler.snapshot()
+        report = path.read_text()
+        assert "top growth by the lines of */test_profiling.py:" in report
+        section = report.split("top growth by the lines of */test_profiling.py:")[1]
+        # the allocation is attributed to the line of this file calling into it
+        assert "test_profiling.py:" in section.splitlines()[1]
+    finally:
+        profiler.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_trigger_files(tmp_path, monkeypatch):
+    profiler = Profiler(tmp_path)
+    calls = []
+    monkeypatch.setattr(profiler.cpu, "toggle", lambda seconds: calls.append(("cpu", seconds)))
+    monkeypatch.setattr(profiler.memory, "snapshot", lambda: calls.append(("memory",)))
+    monkeypatch.setattr(profiler.memory, "stop", lambda: calls.append(("stop",)))
+
+    profiler.check_triggers()
+    assert calls == []
+
+    (tmp_path / profiling.CPU_TRIGGER).write_text("5\n")
+    (tmp_path / profiling.MEMORY_TRIGGER).touch()
+    profiler.check_triggers()
+    assert calls == [("cpu", 5.0), ("memory",)]
+    assert not (tmp_path / profiling.CPU_TRIGGER).exists()
+
+    (tmp_path / profiling.CPU_TRIGGER).touch()
+    (tmp_path / profiling.MEMORY_STOP_TRIGGER).touch()
+    profiler.check_triggers()
+    assert calls[2:] == [("cpu", profiling.CPU_PROFILE_SECONDS), ("stop",)]
+
+
+def test_signals_handled_by_trigger_thread(tmp_path, monkeypatch):
+    profiler = Profiler(tmp_path)
+    calls = []
+    monkeypatch.setattr(profiler.cpu, "toggle", lambda seconds: calls.append(("cpu", seconds)))
+    monkeypatch.setattr(profiler.memory, "snapshot", lambda: calls.append(("memory",)))
+
+    # the handlers only flag the requests
+    profiler._on_signal(signal.SIGUSR1, None)
+    profiler._on_signal(signal.SIGUSR2, None)
+    assert calls == []
+    profiler.check_signals()
+    assert calls == [("cpu", profiling.CPU_PROFILE_SECONDS), ("memory",)]
+    profiler.check_signals()
+    assert len(calls) == 2
@@ -0,0 +1,57 @@
+import multiprocessing
+
+from trade.quote_bus import QuoteBus, QuoteReader
+
+CODES = ['HK.07226', 'HK.07552']
+
+
+def test_publish_and_read():
+    bus = QuoteBus(CODES, capacity=4)
+    try:
+        bus.publish('HK.07226', 4.2, 1)
+        reader = QuoteReader(bus)
+        assert len(reader.read()) == 0
+        assert len(QuoteReader(bus, from_start=True).read()) == 1
+
+        bus.publish('HK.07552', 5.0, 2)
+        bus.publish('HK.07226', 4.3, 3)
+        ticks = reader.read()
+        assert ticks['seq'].tolist() == [2, 3]
+        assert ticks['code_id'].tolist() == [1, 0]
+        assert ticks['time'].tolist() == [2, 3]
+        assert reader.latest_prices(ticks) == {'HK.07552': 5.0, 'HK.07226': 4.3}
+        assert reader.dropped == 0
+
+        # the reader falls behind more than the capacity
+        for i in range(6):
+            bus.publish('HK.07226', 4.0 + i / 10, 4 + i)
+        ticks = reader.read()
+        assert ticks['seq'].tolist() == [6, 7, 8, 9]
+        assert reader.dropped == 2
+    finally:
+        bus.close()
+
+
+def read_ticks(name, codes, count, results):
+    bus = QuoteBus(codes, name=name)
+    reader = QuoteReader(bus, from_start=True)
+    prices = []
+    while len(prices) < count:
+        prices.extend(reader.read(timeout=1)['price'].tolist())
+    bus.close()
+    results.put(prices)
+
+
+def test_read_from_another_process():
+    bus = QuoteBus(CODES, capacity=1024)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=read_ticks, args=(bus.name, CODES, 100, results))
+    process.start()
+    try:
+        for i in range(100):
+            bus.publish(CODES[i % 2], float(i))
+        assert results.get(timeout=30) == [float(i) for i in range(100)]
+    finally:
+        process.join(timeout=5)
+        bus.close()
@@ -0,0 +1,44 @@
+from trade.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_window_full_until_oldest_expires():
+    clock = FakeClock()
+    limiter = RateLimiter(3, 30, clock=clock, sleep=clock.sleep)
+    assert [limiter.try_acquire() for _ in range(2)] == [True, True]
+    clock.now += 10
+    assert [limiter.try_acquire() for _ in range(2)] == [True, False]
+
+    clock.now += 10
+    assert not limiter.try_acquire()
+    clock.now += 20
+    # the calls leave the window 30 seconds after they are made
+    assert limiter.try_acquire()
+    clock.now += 1
+    assert [limiter.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_acquire_never_exceeds_window():
+    clock = FakeClock()
+    limiter = RateLimiter(15, 30, clock=clock, sleep=clock.sleep)
+    times = []
+    for i in range(100):
+        # idle now and then, so that bursts follow partly refilled windows
+        if i % 20 == 7:
+            clock.now += 12
+        limiter.acquire()
+        times.append(clock.now)
+    for i, start in enumerate(times):
+        assert sum(start <= t < start + 30 for t in times[i:]) <= 15
+    # the 16th call waits for the first one to leave the window
+    assert times[15] == 30
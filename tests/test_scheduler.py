@@ -0,0 +1,95 @@
+import threading
+
+import pandas as pd
+from futu import RET_OK
+
+from trade import api
+from trade.connection import ConnectionManager
+from trade.scheduler import RequestScheduler, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_pace():
+    clock = FakeClock()
+    scheduler = RequestScheduler({'place_order': (2, 30)}, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        scheduler.pace('place_order')
+    assert clock.now == 30
+
+    # not limited
+    scheduler.pace('get_global_state')
+    assert clock.now == 30
+
+
+def test_call_coalesces_identical_requests_in_flight():
+    scheduler = RequestScheduler()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def query(code_list):
+        calls.append(code_list)
+        started.set()
+        release.wait(1)
+        return RET_OK, len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.call('get_market_snapshot', query,
+                                                                             ['HK.07226'])))]
+    threads[0].start()
+    started.wait(1)
+    threads += [threading.Thread(target=lambda: results.append(scheduler.call('get_market_snapshot', query,
+                                                                              ['HK.07226'])))
+                for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    while scheduler.coalesced < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert calls == [['HK.07226']]
+    assert results == [(RET_OK, 1)] * 4
+    # the next request is sent again
+    release.set()
+    assert scheduler.call('get_market_snapshot', query, ['HK.07226']) == (RET_OK, 2)
+
+
+def test_ttl_cache():
+    clock = FakeClock()
+    cache = TTLCache(1, clock=clock)
+    cache.put('HK.07226', 4.0)
+    assert cache.get('HK.07226') == 4.0
+    clock.now = 1
+    assert cache.get('HK.07226') is None
+
+
+class SnapshotContext:
+    def __init__(self):
+        self.requests = []
+
+    def get_market_snapshot(self, code_list):
+        self.requests.append(list(code_list))
+        return RET_OK, pd.DataFrame({'code': code_list, 'update_time': '2021-01-04 09:30:00', 'last_price': 4.0})
+
+
+def test_snapshots_shared_within_ttl(monkeypatch):
+    ctx = SnapshotContext()
+    monkeypatch.setattr(api, "connection", ConnectionManager(quote_factory=lambda: ctx, trade_factory=None))
+    monkeypatch.setattr(api, "snapshot_cache", TTLCache(60))
+
+    assert api.get_latest_prices(['HK.07226', 'HK.07552']) == {'HK.07226': 4.0, 'HK.07552': 4.0}
+    assert api.get_latest_price('HK.07552')[1] == 4.0
+    assert api.get_latest_prices(['HK.07226', 'HK.07300'])['HK.07300'] == 4.0
+    assert ctx.requests == [['HK.07226', 'HK.07552'], ['HK.07300']]
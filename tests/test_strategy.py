@@ -43,3 +43,28 @@ def test_cal_order_quantity():
 
     assert strategy.cal_order_quantity(10.95, 0, 20000) == (0, 0)
     assert strategy.cal_order_quantity(10.95, 1000, 18000) == (0, 0)
+
+
+def test_geometric_grids():
+    strategy = GridTradingStrategy(8, 2, 4, 400, 400, 100, 100, grid_type="geometric")
+    assert strategy.grids == [2, 2.828, 4, 5.657, 8]
+
+
+def test_custom_grids():
+    strategy = GridTradingStrategy(grid_lower_limit_position=300, ie_max_position=300, lot_size=100, ie_lot_size=100,
+                                   grids=[1, 2, 4, 8])
+    assert strategy.grid_count == 3
+    assert strategy.cal_grid_index_by_price(3) == 2
+    assert strategy.cal_order_quantity(3, 0, 0) == (100, 200)
+
+
+def test_custom_grids_not_ascending():
+    with pytest.raises(Exception):
+        GridTradingStrategy(grid_lower_limit_position=300, ie_max_position=300, lot_size=100, ie_lot_size=100,
+                            grids=[1, 4, 2, 8])
+
+
+def test_cal_order_quantity_position_between_grids():
+    strategy = GridTradingStrategy(11, 10, 10, 10000, 20000, 100, 100)
+    # 1500 / 1000 = 1.5 grids is rounded half to even, 8.5 inverse equity grids -> 8
+    assert strategy.cal_order_quantity(10.85, 1500, 0) == (0, 16000)
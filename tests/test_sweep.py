@@ -0,0 +1,39 @@
+import numpy as np
+
+from trade.sweep import expand_values, expand_param_grid, validate_params, run_sweep
+
+
+def test_expand_values():
+    assert expand_values(5) == [5]
+    assert expand_values([5, 10]) == [5, 10]
+    assert expand_values({'start': 5, 'stop': 15, 'step': 5}) == [5, 10, 15]
+    assert expand_values({'start': 3.6, 'stop': 4.0, 'step': 0.2}) == [3.6, 3.8, 4.0]
+
+
+def test_validate_params():
+    params_list = expand_param_grid({
+        'grid_upper_limit_price': 11,
+        'grid_lower_limit_price': 10,
+        'grid_count': [5, 15],
+        'grid_lower_limit_position': 10000,
+        'ie_max_position': 20000,
+    })
+    assert len(params_list) == 2
+    # 10000 is not divisible by 15 * 100
+    assert [params['grid_count'] for params in validate_params(params_list, 100, 100)] == [5]
+
+
+def test_run_sweep():
+    rng = np.random.default_rng(0)
+    prices = 10.5 + np.cumsum(rng.normal(0, 0.05, 1000))
+    params_list = expand_param_grid({
+        'grid_upper_limit_price': 11,
+        'grid_lower_limit_price': 10,
+        'grid_count': [5, 10],
+        'grid_lower_limit_position': 10000,
+        'ie_max_position': 20000,
+    })
+    results = run_sweep(prices, 20 - prices, params_list, 100, 100, 500000, processes=2)
+    assert len(results) == 2
+    assert results[0]['total_return'] >= results[1]['total_return']
+    assert all(0 < r['max_capital_use'] < 1 for r in results)
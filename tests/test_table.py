@@ -0,0 +1,14 @@
+from trade.table import format_table, format_value
+
+
+def test_format_table():
+    rows = [{'symbol': 'HK.07226', 'total_return': 0.12345, 'order_count': 12},
+            {'symbol': 'HK.07552', 'total_return': -0.5, 'order_count': 3}]
+    assert format_table(rows, ['symbol', 'total_return']).split("\n") == [
+        "  symbol  total_return",
+        "HK.07226        0.1235",
+        "HK.07552       -0.5000",
+    ]
+    assert format_table([], ['day']) == "day"
+    assert format_value(2.5, digits=2) == "2.50"
+    assert format_value(12) == "12"
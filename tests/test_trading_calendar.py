@@ -0,0 +1,65 @@
+from datetime import date, datetime
+
+from trade.trading_calendar import HKT, TradingCalendar, SessionGate
+
+
+def hkt(*args):
+    return datetime(*args, tzinfo=HKT).timestamp()
+
+
+def test_default_calendar():
+    calendar = TradingCalendar.load()
+    assert 2026 in calendar.years
+    assert calendar.is_open(hkt(2026, 10, 16, 9, 30))
+    assert not calendar.is_open(hkt(2026, 10, 16, 12, 30))
+    assert not calendar.is_open(hkt(2026, 10, 16, 16, 0))
+    # holiday and weekend
+    assert calendar.sessions(date(2026, 10, 19)) == []
+    assert calendar.sessions(date(2026, 10, 17)) == []
+    # half day
+    assert calendar.sessions(date(2026, 12, 24)) == [(hkt(2026, 12, 24, 9, 30), hkt(2026, 12, 24, 12))]
+
+
+def test_next_open():
+    calendar = TradingCalendar(years=[2026], holidays=[date(2026, 10, 19)])
+    assert calendar.next_open(hkt(2026, 10, 16, 10)) == hkt(2026, 10, 16, 10)
+    assert calendar.next_open(hkt(2026, 10, 16, 12, 30)) == hkt(2026, 10, 16, 13)
+    # Friday close -> weekend -> Monday holiday -> Tuesday
+    assert calendar.next_open(hkt(2026, 10, 16, 16)) == hkt(2026, 10, 20, 9, 30)
+
+
+def test_closure(tmp_path):
+    path = tmp_path / "calendar.yml"
+    path.write_text('years: [2026]\nclosures:\n  - {date: 2026-09-01, start: "09:00", end: "14:00"}\n')
+    calendar = TradingCalendar.load(path)
+    assert calendar.sessions(date(2026, 9, 1)) == [(hkt(2026, 9, 1, 14), hkt(2026, 9, 1, 16))]
+
+
+def test_session_gate_confirms_once_per_session():
+    calendar = TradingCalendar(years=[2026])
+    now = [hkt(2026, 10, 16, 9)]
+    confirms = []
+
+    def confirm():
+        confirms.append(now[0])
+        return len(confirms) > 1
+
+    gate = SessionGate(calendar, confirm, lambda: now[0], recheck_interval=60)
+    assert not gate.is_open()
+    assert gate.seconds_until_open() == 1800
+    assert confirms == []
+
+    # OpenD disagrees at the open, asked again after the recheck interval
+    now[0] = hkt(2026, 10, 16, 9, 30)
+    assert not gate.is_open()
+    assert gate.seconds_until_open() == 60
+    now[0] += 60
+    assert gate.is_open()
+    now[0] += 3600
+    assert gate.is_open()
+    assert len(confirms) == 2
+
+    # confirmed again in the afternoon session
+    now[0] = hkt(2026, 10, 16, 13)
+    assert gate.is_open()
+    assert len(confirms) == 3
@@ -0,0 +1,458 @@
+import logging
+import math
+import threading
+from collections import deque
+from datetime import datetime
+from time import time
+
+from trade.backtest import cal_fee
+from trade.strategy import CAPITAL_USE_LIMIT
+from trade.table import format_table, format_value
+from trade.trading_calendar import HKT
+
+logger = logging.getLogger("futu-grid-trading")
+
+# number of the latest completed cycles of the rolling stats
+RECENT_CYCLES = 100
+DAY_FIELDS = ["realized", "fees", "turnover", "fills", "cycles"]
+BUY_SIDES = ("BUY", "BUY_BACK")
+
+
+class RunningStats:
+    """
+    Count, mean, standard deviation, min and max updated in O(1) per value with Welford's algorithm
+    """
+
+    __slots__ = ["count", "mean", "_m2", "min", "max"]
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, _min=None, _max=None):
+        self.count = count
+        self.mean = mean
+        self._m2 = m2
+        self.min = _min
+        self.max = _max
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def remove(self, value):
+        """
+        Remove a value added before, min and max are not updated
+        """
+        if self.count <= 1:
+            self.count, self.mean, self._m2 = 0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 = max(self._m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def std(self):
+        """
+        :return: sample standard deviation, 0 with less than 2 values
+        :rtype: float
+        """
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self._m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["count"], data["mean"], data["m2"], data["min"], data["max"])
+
+
+class Accounting:
+    """
+    P&L of the grid trading, updated incrementally with every fill
+
+    The stock and inverse equity bought are kept as lots tagged with the grid index of the stock price when they were
+    bought. A sell closes the latest lots first, which is the grid bought last, so a buy at one grid closed by the sell
+    one grid higher is a completed cycle. The realized P&L includes the fees of both legs, the fees of a buy are
+    realized when its lot is closed. A fill costs O(1) amortized, the totals are kept as running sums.
+
+    The fees are charged per order, the deals of an order are charged the fee of the order value so far less the fee
+    charged already, so the fixed fees are charged once per order. The deals and the orders of the current day are
+    remembered to skip the deals pushed again, the orders expire at the end of the day.
+    """
+
+    def __init__(self, capital=None, fee_kwargs=None, now=time, on_change=None):
+        """
+
+        :param capital: cash allocated to the strategies, the cash use is the value of the positions over it, None to
+            not track the cash use
+        :type capital: float
+        :param fee_kwargs: fee model, see trade.backtest.cal_fee
+        :type fee_kwargs: dict
+        :param now: function returning the current epoch seconds
+        :type now: callable
+        :param on_change: function called after every fill or reconciliation, e.g. to save to_dict() later, it is
+            called in the futu push thread so it must not serialize the state itself
+        :type on_change: callable
+        """
+        self.capital = capital
+        self.fee_kwargs = fee_kwargs or {}
+        self.now = now
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        # symbol -> (stock symbol of the pair, strategy)
+        self._pairs = {}
+        self._prices = {}
+        self._over_limit = False
+        self._reset()
+
+    def _reset(self):
+        # symbol -> list of open lots [qty, price, fee per share, grid index, open time, realized so far], latest last
+        self.lots = {}
+        # symbol -> grid index -> open quantity
+        self.inventory = {}
+        # symbol -> quantity, cost of the open lots including their fees
+        self.positions = {}
+        self.costs = {}
+        self.realized = 0.0
+        self.fees = 0.0
+        self.turnover = 0.0
+        self.fills = 0
+        self.cycles = 0
+        self.peak_cash_use = 0.0
+        self.cycle_pnl = RunningStats()
+        self.recent_cycle_pnl = RunningStats()
+        self.holding_seconds = RunningStats()
+        self._recent = deque()
+        # day -> DAY_FIELDS
+        self.days = {}
+        # day of the deals and the orders below
+        self._deal_day = None
+        self._deal_ids = set()
+        # order id -> value of the deals of the order so far
+        self._order_notional = {}
+
+    def set_pairs(self, pairs):
+        """
+        :param pairs: the traded pairs with symbol, ie_symbol and strategy
+        :type pairs: list
+        """
+        with self._lock:
+            self._pairs = {}
+            for pair in pairs:
+                self._pairs[pair.symbol] = (pair.symbol, pair.strategy)
+                self._pairs[pair.ie_symbol] = (pair.symbol, pair.strategy)
+
+    def _grid_index(self, symbol, price):
+        stock_symbol, strategy = self._pairs.get(symbol, (symbol, None))
+        if strategy is None:
+            return -1
+        # the inverse equity is bought at the grid of the latest stock price
+        stock_price = price if symbol == stock_symbol else self._prices.get(stock_symbol)
+        return -1 if stock_price is None else strategy.cal_grid_index_by_price(stock_price)
+
+    def update_deals(self, data):
+        """
+        Apply the trade deal push, the deals applied already are skipped
+
+        :param data: deal data frame with columns 'deal_id', 'order_id', 'code', 'trd_side', 'qty' and 'price'
+        :type data: pandas.DataFrame
+        """
+        for row in data.itertuples(index=False):
+            self.fill(str(row.code), str(row.trd_side), int(row.qty), float(row.price), deal_id=str(row.deal_id),
+                      order_id=str(row.order_id))
+
+    def fill(self, symbol, trd_side, qty, price, deal_id=None, order_id=None):
+        """
+        Apply a fill
+
+        :param symbol: a single stock stick, e.g. 'HK.07266'
+        :type symbol: str
+        :param trd_side: 'BUY' or 'SELL'
+        :type trd_side: str
+        :param qty: filled quantity
+        :type qty: int
+        :param price: fill price
+        :type price: float
+        :param deal_id: id of the deal to skip it if applied again
+        :type deal_id: str
+        :param order_id: id of the order of the deal, to charge the fees per order, None to charge the fill as an order
+        :type order_id: str
+        """
+        now = self.now()
+        notional = qty * price
+        with self._lock:
+            self._prune_deals(now)
+            if deal_id is not None:
+                if deal_id in self._deal_ids:
+                    return
+                self._deal_ids.add(deal_id)
+            if order_id is None:
+                fee = float(cal_fee(notional, **self.fee_kwargs))
+            else:
+                before = self._order_notional.get(order_id, 0.0)
+                self._order_notional[order_id] = before + notional
+                fee = float(cal_fee(before + notional, **self.fee_kwargs) - cal_fee(before, **self.fee_kwargs))
+            day = self._day(now)
+            day[1] += fee
+            day[2] += notional
+            day[3] += 1
+            self.turnover += notional
+            self.fills += 1
+            self.fees += fee
+            if trd_side in BUY_SIDES:
+                self._open(symbol, qty, price, fee / qty, self._grid_index(symbol, price), now)
+            else:
+                self._close(symbol, qty, price, fee / qty, now, day)
+            self._prices[symbol] = price
+        self._check_cash_use()
+        if self.on_change is not None:
+            self.on_change()
+
+    def _prune_deals(self, now):
+        # the orders and their deals do not outlive the day
+        key = datetime.fromtimestamp(now, HKT).strftime("%Y-%m-%d")
+        if key != self._deal_day:
+            self._deal_day = key
+            self._deal_ids = set()
+            self._order_notional = {}
+
+    def _day(self, now):
+        key = datetime.fromtimestamp(now, HKT).strftime("%Y-%m-%d")
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = [0.0, 0.0, 0.0, 0, 0]
+        return day
+
+    def _open(self, symbol, qty, price, fee_per_share, grid_index, now):
+        self.lots.setdefault(symbol, []).append([qty, price, fee_per_share, grid_index, now, 0.0])
+        inventory = self.inventory.setdefault(symbol, {})
+        inventory[grid_index] = inventory.get(grid_index, 0) + qty
+        self.positions[symbol] = self.positions.get(symbol, 0) + qty
+        self.costs[symbol] = self.costs.get(symbol, 0.0) + qty * (price + fee_per_share)
+
+    def _close(self, symbol, qty, price, fee_per_share, now, day):
+        lots = self.lots.get(symbol, [])
+        while qty > 0 and lots:
+            lot = lots[-1]
+            matched = min(qty, lot[0])
+            pnl = matched * (price - fee_per_share - lot[1] - lot[2])
+            lot[0] -= matched
+            lot[5] += pnl
+            qty -= matched
+            self.realized += pnl
+            day[0] += pnl
+            inventory = self.inventory[symbol]
+            inventory[lot[3]] -= matched
+            if inventory[lot[3]] == 0:
+                del inventory[lot[3]]
+            self.positions[symbol] -= matched
+            self.costs[symbol] -= matched * (lot[1] + lot[2])
+            if lot[0] == 0:
+                lots.pop()
+                self._complete_cycle(lot[5], now - lot[4])
+                day[4] += 1
+        if qty > 0:
+            # sold what was held before the accounting started, its cost is unknown
+            logger.warning("Sold %s %s more than the lots of the accounting, not realized", qty, symbol)
+
+    def _complete_cycle(self, pnl, holding_seconds):
+        self.cycles += 1
+        self.cycle_pnl.add(pnl)
+        self.holding_seconds.add(holding_seconds)
+        self.recent_cycle_pnl.add(pnl)
+        self._recent.append(pnl)
+        if len(self._recent) > RECENT_CYCLES:
+            self.recent_cycle_pnl.remove(self._recent.popleft())
+
+    def mark(self, prices):
+        """
+        Update the market prices of the unrealized P&L and the cash use
+
+        :param prices: symbol -> price
+        :type prices: dict[str, float]
+        """
+        with self._lock:
+            self._prices.update(prices)
+        self._check_cash_use()
+
+    def reconcile(self, positions):
+        """
+        Align the lots with the positions of the broker, e.g. the positions held before the accounting started are
+        opened at their latest price and the lots sold outside of the strategies are closed
+
+        :param positions: code -> quantity
+        :type positions: dict[str, int]
+        """
+        now = self.now()
+        with self._lock:
+            for symbol in self._pairs:
+                diff = positions.get(symbol, 0) - self.positions.get(symbol, 0)
+                price = self._prices.get(symbol)
+                if diff == 0 or price is None:
+                    continue
+                logger.info("Accounting of %s reconciled by %s at %s", symbol, diff, price)
+                if diff > 0:
+                    self._open(symbol, diff, price, 0.0, self._grid_index(symbol, price), now)
+                else:
+                    # not a sell of the strategies, the lots are dropped without realizing a P&L
+                    self._drop(symbol, -diff)
+        if self.on_change is not None:
+            self.on_change()
+
+    def _drop(self, symbol, qty):
+        lots = self.lots.get(symbol, [])
+        while qty > 0 and lots:
+            lot = lots[-1]
+            matched = min(qty, lot[0])
+            lot[0] -= matched
+            qty -= matched
+            inventory = self.inventory[symbol]
+            inventory[lot[3]] -= matched
+            if inventory[lot[3]] == 0:
+                del inventory[lot[3]]
+            self.positions[symbol] -= matched
+            self.costs[symbol] -= matched * (lot[1] + lot[2])
+            if lot[0] == 0:
+                lots.pop()
+
+    def _position_value(self):
+        # called with the lock held
+        return sum(qty * self._prices.get(symbol, 0.0) for symbol, qty in self.positions.items())
+
+    def _check_cash_use(self):
+        if not self.capital:
+            return
+        with self._lock:
+            cash_use = self._position_value() / self.capital
+            self.peak_cash_use = max(self.peak_cash_use, cash_use)
+            crossed = (cash_use > CAPITAL_USE_LIMIT) != self._over_limit
+            self._over_limit = cash_use > CAPITAL_USE_LIMIT
+        if crossed and self._over_limit:
+            logger.warning("Cash use %.1f%% is over the limit of %.0f%%", cash_use * 100, CAPITAL_USE_LIMIT * 100)
+        elif crossed:
+            logger.info("Cash use %.1f%% is back under the limit of %.0f%%", cash_use * 100, CAPITAL_USE_LIMIT * 100)
+
+    def summary(self):
+        """
+        :return: the P&L, cash use, cycles and their stats, and the position and grid inventory of every symbol
+        :rtype: dict
+        """
+        with self._lock:
+            unrealized = sum(qty * self._prices[symbol] - self.costs[symbol]
+                             for symbol, qty in self.positions.items() if qty and symbol in self._prices)
+            value = self._position_value()
+            return {
+                "realized": self.realized,
+                "unrealized": unrealized,
+                "fees": self.fees,
+                "turnover": self.turnover,
+                "fills": self.fills,
+                "cycles": self.cycles,
+                "cycle_pnl_mean": self.cycle_pnl.mean,
+                "cycle_pnl_std": self.cycle_pnl.std,
+                "recent_cycle_pnl_mean": self.recent_cycle_pnl.mean,
+                "holding_hours_mean": self.holding_seconds.mean / 3600,
+                "cash_use": value / self.capital if self.capital else None,
+                "peak_cash_use": self.peak_cash_use if self.capital else None,
+                "positions": {symbol: qty for symbol, qty in self.positions.items() if qty},
+                "inventory": {symbol: dict(sorted(inventory.items()))
+                              for symbol, inventory in self.inventory.items() if inventory},
+            }
+
+    def gauges(self):
+        """
+        :return: gauge name -> value of the P&L for trade.metrics.register_gauges
+        :rtype: dict[str, float]
+        """
+        summary = self.summary()
+        return {"realized_pnl": summary["realized"], "unrealized_pnl": summary["unrealized"],
+                "fees": summary["fees"], "cycles": summary["cycles"], "cash_use": summary["cash_use"]}
+
+    def report(self):
+        """
+        :return: one row per day with the day and DAY_FIELDS, in date order
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return [dict(day=day, **dict(zip(DAY_FIELDS, values))) for day, values in sorted(self.days.items())]
+
+    def to_dict(self):
+        """
+        :return: the state of the accounting, JSON serializable
+        :rtype: dict
+        """
+        with self._lock:
+            return self._to_dict()
+
+    def _to_dict(self):
+        return {
+            "lots": {symbol: [list(lot) for lot in lots] for symbol, lots in self.lots.items() if lots},
+            "realized": self.realized,
+            "fees": self.fees,
+            "turnover": self.turnover,
+            "fills": self.fills,
+            "cycles": self.cycles,
+            "peak_cash_use": self.peak_cash_use,
+            "cycle_pnl": self.cycle_pnl.to_dict(),
+            "holding_seconds": self.holding_seconds.to_dict(),
+            "recent": list(self._recent),
+            "days": {day: list(values) for day, values in self.days.items()},
+            "deal_day": self._deal_day,
+            "deal_ids": sorted(self._deal_ids),
+            "order_notional": dict(self._order_notional),
+            "prices": dict(self._prices),
+        }
+
+    def load(self, data):
+        """
+        Restore the state of to_dict, e.g. of the last run
+
+        :param data: result of to_dict, empty to start from scratch
+        :type data: dict
+        """
+        with self._lock:
+            self._reset()
+            if not data:
+                return
+            for symbol, lots in data["lots"].items():
+                for qty, price, fee_per_share, grid_index, opened, realized in lots:
+                    self._open(symbol, qty, price, fee_per_share, grid_index, opened)
+                    self.lots[symbol][-1][5] = realized
+            self.realized = data["realized"]
+            self.fees = data["fees"]
+            self.turnover = data["turnover"]
+            self.fills = data["fills"]
+            self.cycles = data["cycles"]
+            self.peak_cash_use = data["peak_cash_use"]
+            self.cycle_pnl = RunningStats.from_dict(data["cycle_pnl"])
+            self.holding_seconds = RunningStats.from_dict(data["holding_seconds"])
+            for pnl in data["recent"]:
+                self.recent_cycle_pnl.add(pnl)
+                self._recent.append(pnl)
+            self.days = {day: list(values) for day, values in data["days"].items()}
+            # missing in the state of the older versions
+            self._deal_day = data.get("deal_day")
+            self._deal_ids = set(data.get("deal_ids", []))
+            self._order_notional = dict(data.get("order_notional", {}))
+            # the unrealized P&L at the last marked prices until the first quote
+            self._prices.update(data.get("prices", {}))
+
+
+def format_report(rows, summary=None):
+    """
+    Format the daily rows and the summary as text
+
+    :param rows: result of Accounting.report
+    :type rows: list[dict]
+    :param summary: result of Accounting.summary
+    :type summary: dict
+    :return: report
+    :rtype: str
+    """
+    lines = [format_table(rows, ["day"] + DAY_FIELDS, digits=2)]
+    if summary:
+        lines.append("")
+        lines += ["{}: {}".format(name, format_value(value, digits=2)) for name, value in summary.items()]
+    return "\n".join(lines)
@@ -0,0 +1,345 @@
+import logging
+import math
+from collections import deque
+
+import numpy as np
+
+from trade.backtest import backtest, BacktestResult
+from trade.strategy import GridTradingStrategy
+
+logger = logging.getLogger("futu-grid-trading")
+
+# parameters of the adaptive mode, the ones left out of the config take these, the seconds are of trading time
+DEFAULT_ADAPTIVE_PARAMS = {
+    # seconds for the weight of a price return in the volatility to halve
+    "halflife": 3600,
+    # seconds of the rolling range
+    "range_window": 6 * 3600,
+    # the grid spans this many standard deviations of the price over the range window on each side of the center, and
+    # at least the rolling range
+    "width_sigmas": 2.0,
+    # bounds of the grid width as a fraction of the price
+    "min_width": 0.05,
+    "max_width": 0.5,
+    # recenter when the price leaves the grid by this fraction of the grid width
+    "breakout": 0.1,
+    # recenter when the target width changes by this factor from the current width
+    "width_change": 2.0,
+    # max move of the grid center per recentering as a fraction of the center
+    "max_shift": 0.1,
+    # seconds between two recenterings
+    "min_interval": 3600,
+    # seconds of prices before the first recentering
+    "warmup": 3600,
+    # a longer gap between two prices is a market close, e.g. overnight or the lunch break, which counts as this many
+    # seconds of trading time and whose return is left out of the volatility
+    "max_gap": 600,
+}
+
+
+class EwmaVolatility:
+    """
+    Exponentially weighted variance of the log returns per second, O(1) per price
+
+    The weight of a return decays with the time since it was observed, so prices sampled at irregular intervals, e.g.
+    the quote push, are weighted by time instead of by count.
+    """
+
+    __slots__ = ["halflife", "variance", "_price", "_time"]
+
+    def __init__(self, halflife):
+        """
+
+        :param halflife: seconds for the weight of a return to halve
+        :type halflife: float
+        """
+        self.halflife = halflife
+        self.variance = None
+        self._price = None
+        self._time = None
+
+    def update(self, price, t, skip_return=False):
+        """
+        :param price: price
+        :type price: float
+        :param t: seconds of the price
+        :type t: float
+        :param skip_return: start the returns again from this price, e.g. the first price after a market close
+        :type skip_return: bool
+        """
+        if self._price is not None and t > self._time and price > 0 and not skip_return:
+            dt = t - self._time
+            r2 = math.log(price / self._price) ** 2 / dt
+            alpha = 1 - 0.5 ** (dt / self.halflife)
+            self.variance = r2 if self.variance is None else self.variance + alpha * (r2 - self.variance)
+        if self._time is None or t >= self._time:
+            self._price, self._time = price, t
+
+    def volatility(self, horizon):
+        """
+        :param horizon: seconds
+        :type horizon: float
+        :return: standard deviation of the log return over the horizon, None before the second price
+        :rtype: float or None
+        """
+        if self.variance is None:
+            return None
+        return math.sqrt(self.variance * horizon)
+
+
+class RollingRange:
+    """
+    Min and max of the prices of the last window seconds, O(1) amortized per price with monotonic queues
+    """
+
+    __slots__ = ["window", "_mins", "_maxs"]
+
+    def __init__(self, window):
+        """
+
+        :param window: seconds
+        :type window: float
+        """
+        self.window = window
+        # (time, price) with increasing prices for the min and decreasing prices for the max
+        self._mins = deque()
+        self._maxs = deque()
+
+    def update(self, price, t):
+        while self._mins and self._mins[-1][1] >= price:
+            self._mins.pop()
+        self._mins.append((t, price))
+        while self._maxs and self._maxs[-1][1] <= price:
+            self._maxs.pop()
+        self._maxs.append((t, price))
+        start = t - self.window
+        while self._mins[0][0] < start:
+            self._mins.popleft()
+        while self._maxs[0][0] < start:
+            self._maxs.popleft()
+
+    @property
+    def low(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def high(self):
+        return self._maxs[0][1] if self._maxs else None
+
+
+class AdaptiveGrid:
+    """
+    Recenter the grid of a pair on the price and resize it to the volatility, so the capital keeps trading through
+    trends
+
+    The grid is recentered when the price leaves it by the breakout fraction of its width or when the volatility
+    regime makes the target width differ from the current one by the width change factor. The new center moves at
+    most max_shift toward the price, the width is bounded, and two recenterings are at least min_interval apart. The
+    positions per grid are scaled so that the value of the grids stays the one of the configured grid at the first
+    prices seen.
+
+    The estimators, the warmup and the min interval run on a trading clock which skips the market closes, so the
+    nights and the lunch breaks neither count as calm time nor end the warmup.
+    """
+
+    def __init__(self, strategy_params, lot_size, ie_lot_size, params=None):
+        """
+
+        :param strategy_params: the configured parameters of GridTradingStrategy
+        :type strategy_params: dict
+        :param lot_size: lot size
+        :type lot_size: int
+        :param ie_lot_size: inverse equity lot size
+        :type ie_lot_size: int
+        :param params: adaptive parameters, see DEFAULT_ADAPTIVE_PARAMS
+        :type params: dict
+        """
+        params = {**DEFAULT_ADAPTIVE_PARAMS, **(params or {})}
+        unknown = set(params) - set(DEFAULT_ADAPTIVE_PARAMS)
+        assert not unknown, "Expect adaptive parameters in {} but got {}".format(list(DEFAULT_ADAPTIVE_PARAMS),
+                                                                                 sorted(unknown))
+        assert 0 < params["min_width"] <= params["max_width"] and params["width_change"] > 1
+        self.params = params
+        self.strategy_params = dict(strategy_params)
+        self.lot_size = lot_size
+        self.ie_lot_size = ie_lot_size
+        self.strategy = GridTradingStrategy(**self.strategy_params, lot_size=lot_size, ie_lot_size=ie_lot_size)
+        self.volatility = EwmaVolatility(params["halflife"])
+        self.range = RollingRange(params["range_window"])
+        # prices at which the configured positions hold their value
+        self.reference = None
+        # trading seconds since the first price, and the time of the last price
+        self.clock = 0.0
+        self._time = None
+        self.started = None
+        self.recentered = None
+        self.recenter_count = 0
+
+    def update(self, price, ie_price, t):
+        """
+        Feed a price and recenter the grid if needed
+
+        :param price: stock price
+        :type price: float
+        :param ie_price: inverse equity price
+        :type ie_price: float
+        :param t: epoch seconds of the prices
+        :type t: float
+        :return: the recentered strategy, None if the grid is kept
+        :rtype: GridTradingStrategy or None
+        """
+        p = self.params
+        gap = False
+        if self._time is not None and t > self._time:
+            gap = t - self._time > p["max_gap"]
+            self.clock += min(t - self._time, p["max_gap"])
+        if self._time is None or t > self._time:
+            self._time = t
+        t = self.clock
+
+        self.volatility.update(price, t, skip_return=gap)
+        self.range.update(price, t)
+        if self.reference is None:
+            self.reference = (price, ie_price)
+        if self.started is None:
+            self.started = t
+
+        if t - self.started < p["warmup"]:
+            return None
+        if self.recentered is not None and t - self.recentered < p["min_interval"]:
+            return None
+        sigma = self.volatility.volatility(p["range_window"])
+        if sigma is None:
+            return None
+
+        grids = self.strategy.grids
+        lower, upper = grids[0], grids[-1]
+        width = upper - lower
+        target_width = min(max(p["width_sigmas"] * 2 * sigma * price, self.range.high - self.range.low,
+                               p["min_width"] * price), p["max_width"] * price)
+        breakout = price > upper + p["breakout"] * width or price < lower - p["breakout"] * width
+        regime = not 1 / p["width_change"] <= target_width / width <= p["width_change"]
+        if not breakout and not regime:
+            return None
+
+        center = (upper + lower) / 2
+        max_shift = p["max_shift"] * center
+        new_center = min(max(price, center - max_shift), center + max_shift)
+        strategy_params = self._strategy_params(new_center, target_width, price, ie_price)
+        try:
+            strategy = GridTradingStrategy(**strategy_params, lot_size=self.lot_size, ie_lot_size=self.ie_lot_size)
+        except AssertionError as e:
+            logger.warning("Unable to recenter the grid at %s, %r", new_center, e)
+            self.recentered = t
+            return None
+
+        logger.info("Grid recentered at price=%s, ie_price=%s, volatility=%.4f, range=[%s, %s], %s, grids=%s",
+                    price, ie_price, sigma, self.range.low, self.range.high,
+                    "breakout" if breakout else "volatility regime changed", strategy.grids)
+        self.strategy = strategy
+        self.recentered = t
+        self.recenter_count += 1
+        return strategy
+
+    def _strategy_params(self, center, width, price, ie_price):
+        params = {key: value for key, value in self.strategy_params.items() if key != "grids"}
+        grid_count = self.strategy.grid_count
+        price_0, ie_price_0 = self.reference
+        # the same value of the grids at the current prices as the configured positions at the reference prices
+        factor = grid_count * self.lot_size
+        position = self.strategy_params["grid_lower_limit_position"] * price_0 / price
+        ie_factor = grid_count * self.ie_lot_size
+        ie_position = self.strategy_params["ie_max_position"] * ie_price_0 / ie_price
+        params.update(grid_upper_limit_price=round(center + width / 2, 3),
+                      grid_lower_limit_price=round(max(center - width / 2, 0.001), 3), grid_count=grid_count,
+                      grid_lower_limit_position=max(int(position // factor), 1) * factor,
+                      ie_max_position=max(int(ie_position // ie_factor), 1) * ie_factor)
+        return params
+
+    def to_dict(self):
+        """
+        :return: the recentered grid to resume after a restart, None if never recentered
+        :rtype: dict or None
+        """
+        if self.recenter_count == 0:
+            return None
+        s = self.strategy
+        return {"grids": s.grids, "grid_lower_limit_position": s.position_per_grid * s.grid_count,
+                "ie_max_position": s.ie_position_per_grid * s.grid_count, "reference": list(self.reference)}
+
+    def load(self, data):
+        """
+        Resume the recentered grid of to_dict, the estimators warm up again
+
+        :param data: result of to_dict
+        :type data: dict or None
+        :return: the resumed strategy, None if there is nothing to resume
+        :rtype: GridTradingStrategy or None
+        """
+        if not data:
+            return None
+        self.strategy = GridTradingStrategy(
+            grids=data["grids"], grid_lower_limit_position=data["grid_lower_limit_position"],
+            ie_max_position=data["ie_max_position"], lot_size=self.lot_size, ie_lot_size=self.ie_lot_size)
+        self.reference = tuple(data["reference"])
+        self.recenter_count += 1
+        return self.strategy
+
+
+def backtest_adaptive(strategy_params, adaptive_params, prices, ie_prices, times, lot_size, ie_lot_size, cash,
+                      position=0, ie_position=0, **fee_kwargs):
+    """
+    Backtest the adaptive mode over one price path, the grids are recentered by AdaptiveGrid tick by tick and every
+    stretch of a grid is backtested in one vectorized pass
+
+    :param strategy_params: the configured parameters of GridTradingStrategy
+    :type strategy_params: dict
+    :param adaptive_params: adaptive parameters, see DEFAULT_ADAPTIVE_PARAMS
+    :type adaptive_params: dict
+    :param prices: stock prices
+    :type prices: numpy.ndarray
+    :param ie_prices: inverse equity prices
+    :type ie_prices: numpy.ndarray
+    :param times: epoch seconds of the prices
+    :type times: numpy.ndarray
+    :param lot_size: lot size
+    :type lot_size: int
+    :param ie_lot_size: inverse equity lot size
+    :type ie_lot_size: int
+    :param cash: initial cash
+    :type cash: float
+    :param position: initial stock position
+    :type position: int
+    :param ie_position: initial inverse equity position
+    :type ie_position: int
+    :param fee_kwargs: fee model, see trade.backtest.cal_fee
+    :return: result of the whole path, (tick index, grids) of every recentering
+    :rtype: (BacktestResult, list[(int, list[float])])
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    ie_prices = np.asarray(ie_prices, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    assert prices.ndim == 1 and prices.shape == ie_prices.shape == times.shape
+
+    adaptive = AdaptiveGrid(strategy_params, lot_size, ie_lot_size, adaptive_params)
+    segments = [(0, adaptive.strategy)]
+    recenterings = []
+    for i, (price, ie_price, t) in enumerate(zip(prices.tolist(), ie_prices.tolist(), times.tolist())):
+        strategy = adaptive.update(price, ie_price, t)
+        if strategy is None:
+            continue
+        recenterings.append((i, strategy.grids))
+        # the grid recentered at a tick trades from that tick on
+        if segments[-1][0] == i:
+            segments[-1] = (i, strategy)
+        else:
+            segments.append((i, strategy))
+
+    results = []
+    for (start, strategy), (end, _) in zip(segments, segments[1:] + [(len(prices), None)]):
+        result = backtest(strategy, prices[start:end], ie_prices[start:end], cash, position, ie_position,
+                          **fee_kwargs)
+        results.append(result)
+        position, ie_position, cash = int(result.position[-1]), int(result.ie_position[-1]), float(result.cash[-1])
+    result = BacktestResult(*(np.concatenate(arrays) for arrays in zip(*results)))
+    return result, recenterings
@@ -1,26 +1,83 @@
-import os
+import functools
 from datetime import datetime
+from time import sleep, monotonic, time
 
-from futu import SysConfig, OpenHKTradeContext, RET_OK, TrdSide, OrderType, OpenQuoteContext, Market
+from futu import SysConfig, RET_OK, TrdSide, OrderType, Market, SubType, ModifyOrderOp, SecurityType
+
+from trade.connection import ConnectionManager
+from trade.metrics import timed
+from trade.scheduler import RequestScheduler, TTLCache
+from trade.trading_calendar import HKT
 
 SysConfig.set_all_thread_daemon(True)
 
-trd_ctx = OpenHKTradeContext(host='127.0.0.1', port=11111)
-quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)  # Create quote object
+# OpenD contexts shared by all the strategies, connected on first use
+connection = ConnectionManager()
+
+# seconds to share a snapshot between the callers, e.g. the strategy loop and the market orders of a rebalance
+SNAPSHOT_TTL = 1
+
+
+def market_sleep(seconds):
+    """
+    Sleep for seconds of market time, which runs faster when replaying a recording
+
+    :param seconds:
+    :type seconds: float
+    """
+    replay = connection.replay
+    if replay is not None:
+        replay.sleep(seconds)
+    else:
+        sleep(seconds)
+
+
+def market_time():
+    """
+    Monotonic clock of the market time, which runs faster when replaying a recording
+
+    :return: seconds
+    :rtype: float
+    """
+    replay = connection.replay
+    if replay is not None:
+        return replay.now()
+    return monotonic()
+
 
-trd_ctx.unlock_trade(os.environ['PWD_UNLOCK'])
+def market_now():
+    """
+    Current time of the market, which runs faster when replaying a recording
 
+    :return: epoch seconds
+    :rtype: float
+    """
+    replay = connection.replay
+    if replay is not None:
+        return replay.now()
+    return time()
 
+
+# the queries are paced and coalesced by the scheduler, the orders are paced by the caller with
+# scheduler.limiter('place_order') so that an order timed out while waiting for the limiter is not placed any more
+scheduler = RequestScheduler(clock=market_time, sleep=market_sleep)
+# symbol -> (update time, price) of the snapshots and the quote push
+snapshot_cache = TTLCache(SNAPSHOT_TTL, clock=market_time)
+
+
+@functools.lru_cache(maxsize=None)
+@timed
 def get_lot_size(symbol):
     """
-    Get lot size of a given symbol
+    Get lot size of a given symbol, cached since it never changes while running
 
     :param symbol: a single stock stick, e.g. 'HK.07266'
     :type symbol: str
     :return: lot size
     :rtype: int
     """
-    ret, data = quote_ctx.get_stock_basicinfo(Market.HK, code_list=[symbol])
+    ret, data = scheduler.call('get_stock_basicinfo', connection.quote_ctx.get_stock_basicinfo, Market.HK,
+                               code_list=[symbol])
     if ret == RET_OK:
         lot_size = int(data['lot_size'][0])
     else:
@@ -29,6 +86,52 @@ def get_lot_size(symbol):
     return lot_size
 
 
+def get_snapshots(symbols):
+    """
+    Get the latest snapshots, the symbols not in the snapshot cache are requested together in one request
+
+    :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+    :type symbols: list[str]
+    :return: symbol -> (price updated time, price)
+    :rtype: dict[str, (datetime.datetime, float)]
+    """
+    snapshots = {}
+    missing = []
+    for symbol in symbols:
+        snapshot = snapshot_cache.get(symbol)
+        if snapshot is None:
+            missing.append(symbol)
+        else:
+            snapshots[symbol] = snapshot
+    if not missing:
+        return snapshots
+
+    ret, data = scheduler.call('get_market_snapshot', connection.quote_ctx.get_market_snapshot, missing)
+    if ret != RET_OK:
+        raise ValueError("Unable to get data of {}, error={}".format(missing, data))
+
+    for code, update_time_s, price in zip(data['code'], data['update_time'], data['last_price']):
+        snapshot = datetime.strptime(update_time_s, "%Y-%m-%d %H:%M:%S"), float(price)
+        snapshot_cache.put(str(code), snapshot)
+        snapshots[str(code)] = snapshot
+    return snapshots
+
+
+def cache_quote(symbol, price):
+    """
+    Put a pushed price into the snapshot cache, so that the market orders following a quote push do not request a
+    snapshot of the price just pushed
+
+    :param symbol: a single stock stick, e.g. 'HK.07266'
+    :type symbol: str
+    :param price: pushed last price
+    :type price: float
+    """
+    update_time = datetime.fromtimestamp(market_now(), HKT).replace(tzinfo=None)
+    snapshot_cache.put(symbol, (update_time, price))
+
+
+@timed
 def get_latest_price(symbol):
     """
     Get the latest price
@@ -38,19 +141,105 @@ def get_latest_price(symbol):
     :return: price updated time, price
     :rtype: datetime.datetime, float
     """
+    return get_snapshots([symbol])[symbol]
 
-    ret, data = quote_ctx.get_market_snapshot(symbol)
-    if ret == RET_OK:
-        update_time_s = data['update_time'][0]
-        update_time = datetime.strptime(update_time_s, "%Y-%m-%d %H:%M:%S")
 
-        price = float(data['last_price'][0])
+@timed
+def get_lot_sizes(symbols):
+    """
+    Get lot sizes of the symbols in one request
+
+    :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+    :type symbols: list[str]
+    :return: symbol -> lot size
+    :rtype: dict[str, int]
+    """
+    ret, data = scheduler.call('get_stock_basicinfo', connection.quote_ctx.get_stock_basicinfo, Market.HK,
+                               code_list=list(symbols))
+    if ret == RET_OK:
+        lot_sizes = {str(code): int(lot_size) for code, lot_size in zip(data['code'], data['lot_size'])}
     else:
-        raise ValueError("Unable to get data of {}, error={}".format(symbol, data))
+        raise ValueError("Unable to get data of {}, error={}".format(symbols, data))
+
+    missing = set(symbols) - set(lot_sizes)
+    if missing:
+        raise ValueError("Unable to get lot size of {}".format(sorted(missing)))
+    return lot_sizes
+
+
+@timed
+def get_latest_prices(symbols):
+    """
+    Get the latest prices of the symbols in one snapshot request
+
+    :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+    :type symbols: list[str]
+    :return: symbol -> price
+    :rtype: dict[str, float]
+    """
+    return {symbol: price for symbol, (_, price) in get_snapshots(symbols).items()}
+
+
+@timed
+def request_history_kline(symbol, start, end, ktype, autype, page_req_key=None, max_count=1000):
+    """
+    Request one page of historical klines
+
+    :param symbol: a single stock stick, e.g. 'HK.07226'
+    :type symbol: str
+    :param start: first date, 'yyyy-MM-dd'
+    :type start: str
+    :param end: last date, 'yyyy-MM-dd'
+    :type end: str
+    :param ktype: kline type, e.g. KLType.K_1M
+    :type ktype: str
+    :param autype: price adjustment, e.g. AuType.HFQ
+    :type autype: str
+    :param page_req_key: key of the page returned with the previous page, None for the first page
+    :type page_req_key: bytes
+    :param max_count: max number of klines of the page
+    :type max_count: int
+    :return: klines with the columns 'time_key', 'open', 'high', 'low', 'close', 'volume' and 'turnover', key of the
+        next page, None if this is the last page
+    :rtype: (pandas.DataFrame, bytes)
+    """
+    ret, data, page_req_key = scheduler.call('request_history_kline', connection.quote_ctx.request_history_kline,
+                                             symbol, start=start, end=end, ktype=ktype, autype=autype,
+                                             max_count=max_count, page_req_key=page_req_key)
+    if ret != RET_OK:
+        raise ValueError("Unable to get klines of {}, error={}".format(symbol, data))
+    return data, page_req_key
+
+
+def get_history_kline_quota():
+    """
+    Get the historical kline quota, every symbol requested in the last 30 days takes one
+
+    :return: used quota, remaining quota
+    :rtype: (int, int)
+    """
+    ret, data = scheduler.call('get_history_kl_quota', connection.quote_ctx.get_history_kl_quota)
+    if ret != RET_OK:
+        raise ValueError("Unable to get historical kline quota, error={}".format(data))
+    used, remain = data[0], data[1]
+    return int(used), int(remain)
 
-    return update_time, price
 
+def get_etf_symbols():
+    """
+    Get the symbols of all ETFs in Hong Kong market, including the leveraged and inverse products
+
+    :return: stock sticks, e.g. ['HK.02800', 'HK.07226']
+    :rtype: list[str]
+    """
+    ret, data = scheduler.call('get_stock_basicinfo', connection.quote_ctx.get_stock_basicinfo, Market.HK,
+                               SecurityType.ETF)
+    if ret != RET_OK:
+        raise ValueError("Unable to get ETFs, error={}".format(data))
+    return [str(code) for code in data['code']]
 
+
+@timed
 def is_market_open():
     """
     Check if Hong Kong market is open
@@ -58,13 +247,63 @@ def is_market_open():
     :return: If market is open
     :rtype: bool
     """
-    ret, data = quote_ctx.get_global_state()
+    ret, data = scheduler.call('get_global_state', connection.quote_ctx.get_global_state)
     if ret == RET_OK:
         return data['market_hk'] in ["MORNING", "AFTERNOON"]
     else:
         raise ValueError("Unable to check if market open, error={}".format(data))
 
 
+def subscribe_quote(symbols, handler):
+    """
+    Subscribe real-time quote push of the symbols
+
+    :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+    :type symbols: list[str]
+    :param handler: handler receiving the quote push, e.g. QuotePushHandler
+    :type handler: futu.StockQuoteHandlerBase
+    """
+    connection.set_quote_handler(handler)
+    ret, data = connection.subscribe(symbols, [SubType.QUOTE])
+    if ret != RET_OK:
+        raise ValueError("Unable to subscribe quote of {}, error={}".format(symbols, data))
+
+
+def subscribe_order_book(symbols, handler):
+    """
+    Subscribe the order book push of the symbols
+
+    :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+    :type symbols: list[str]
+    :param handler: handler receiving the order book push, e.g. OrderBookPushHandler
+    :type handler: futu.OrderBookHandlerBase
+    """
+    connection.set_quote_handler(handler)
+    ret, data = connection.subscribe(symbols, [SubType.ORDER_BOOK])
+    if ret != RET_OK:
+        raise ValueError("Unable to subscribe order book of {}, error={}".format(symbols, data))
+
+
+@timed
+def get_order_book(symbol, num=10):
+    """
+    Get the order book of a subscribed stock
+
+    :param symbol: a single stock stick, e.g. 'HK.07266'
+    :type symbol: str
+    :param num: number of levels
+    :type num: int
+    :return: order book dict with 'code', 'Bid' and 'Ask', every level a tuple starting with price and volume
+    :rtype: dict
+    """
+    ret, data = scheduler.call('get_order_book', connection.quote_ctx.get_order_book, symbol, num=num)
+    if ret == RET_OK:
+        return data
+    else:
+        raise ValueError("Unable to get order book of {}, error={}".format(symbol, data))
+
+
+@timed
 def get_position(symbol):
     """
     Get position of a stock
@@ -74,17 +313,61 @@ def get_position(symbol):
     :return: position
     :rtype: int
     """
-    ret, data = trd_ctx.position_list_query()
+    ret, data = scheduler.call('position_list_query', connection.trd_ctx.position_list_query)
     if ret == RET_OK:
         loc = data.loc[data['code'] == symbol]
         if not loc.empty:
-            return int(loc['qty'])
+            return int(loc['qty'].iloc[0])
         else:
             return 0
     else:
         raise ValueError("Unable to get position of {}, error={}".format(symbol, data))
 
 
+@timed
+def query_positions():
+    """
+    Query positions of all stocks
+
+    :return: position data frame
+    :rtype: pandas.DataFrame
+    """
+    ret, data = scheduler.call('position_list_query', connection.trd_ctx.position_list_query)
+    if ret == RET_OK:
+        return data
+    else:
+        raise ValueError("Unable to get positions, error={}".format(data))
+
+
+@timed
+def query_orders():
+    """
+    Query today's orders
+
+    :return: order data frame
+    :rtype: pandas.DataFrame
+    """
+    ret, data = scheduler.call('order_list_query', connection.trd_ctx.order_list_query)
+    if ret == RET_OK:
+        return data
+    else:
+        raise ValueError("Unable to get orders, error={}".format(data))
+
+
+def subscribe_trade(order_handler, deal_handler):
+    """
+    Receive the trade order push and trade deal push
+
+    :param order_handler: handler receiving the order push, e.g. TradeOrderPushHandler
+    :type order_handler: futu.TradeOrderHandlerBase
+    :param deal_handler: handler receiving the deal push, e.g. TradeDealPushHandler
+    :type deal_handler: futu.TradeDealHandlerBase
+    """
+    connection.set_trade_handler(order_handler)
+    connection.set_trade_handler(deal_handler)
+
+
+@timed
 def place_buy_market_order(symbol, quantity):
     """
     Place a buy market order
@@ -93,19 +376,20 @@ def place_buy_market_order(symbol, quantity):
     :type symbol: str
     :param quantity: the amount of the shares you want to buy
     :type quantity: int
-    :return: order being placed successfully
-    :rtype: bool
+    :return: order id
+    :rtype: str
     """
     assert quantity > 0, "Expect quantity to be a positive integer but got {}".format(quantity)
     _, price = get_latest_price(symbol)
-    ret, data = trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.BUY,
-                                    order_type=OrderType.MARKET)
+    ret, data = connection.trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.BUY,
+                                               order_type=OrderType.MARKET)
     if ret == RET_OK:
-        return True
+        return data['order_id'][0]
     else:
         raise ValueError("Unable to place buy market order, error={}".format(data))
 
 
+@timed
 def place_sell_market_order(symbol, quantity):
     """
     Place a sell market order
@@ -114,19 +398,20 @@ def place_sell_market_order(symbol, quantity):
     :type symbol: str
     :param quantity: the amount of the shares you want to sell
     :type quantity: int
-    :return: order being placed successfully
-    :rtype: bool
+    :return: order id
+    :rtype: str
     """
     assert quantity > 0, "Expect quantity to be a positive integer but got {}".format(quantity)
     _, price = get_latest_price(symbol)
-    ret, data = trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.SELL,
-                                    order_type=OrderType.MARKET)
+    ret, data = connection.trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.SELL,
+                                               order_type=OrderType.MARKET)
     if ret == RET_OK:
-        return True
+        return data['order_id'][0]
     else:
         raise ValueError("Unable to place sell market order, error={}".format(data))
 
 
+@timed
 def place_buy_normal_order(symbol, quantity, price, adjust_limit=0):
     """
     Place a buy market order
@@ -144,14 +429,15 @@ def place_buy_normal_order(symbol, quantity, price, adjust_limit=0):
     """
     assert adjust_limit >= 0
     assert quantity > 0, "Expect quantity to be a positive integer but got {}".format(quantity)
-    ret, data = trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.BUY,
-                                    order_type=OrderType.NORMAL, adjust_limit=adjust_limit)
+    ret, data = connection.trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.BUY,
+                                               order_type=OrderType.NORMAL, adjust_limit=adjust_limit)
     if ret == RET_OK:
         return data['order_id'][0]
     else:
         raise ValueError("Unable to place buy normal order, error={}".format(data))
 
 
+@timed
 def place_sell_normal_order(symbol, quantity, price, adjust_limit=0):
     """
     Place a sell market order
@@ -169,14 +455,29 @@ def place_sell_normal_order(symbol, quantity, price, adjust_limit=0):
     """
     assert adjust_limit <= 0
     assert quantity > 0, "Expect quantity to be a positive integer but got {}".format(quantity)
-    ret, data = trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.SELL,
-                                    order_type=OrderType.NORMAL, adjust_limit=adjust_limit)
+    ret, data = connection.trd_ctx.place_order(price=price, qty=quantity, code=symbol, trd_side=TrdSide.SELL,
+                                               order_type=OrderType.NORMAL, adjust_limit=adjust_limit)
     if ret == RET_OK:
         return data['order_id'][0]
     else:
         raise ValueError("Unable to place sell normal order, error={}".format(data))
 
 
+@timed
+def cancel_order(order_id):
+    """
+    Cancel an order
+
+    :param order_id:
+    :type order_id: str
+    """
+    scheduler.pace('modify_order')
+    ret, data = connection.trd_ctx.modify_order(ModifyOrderOp.CANCEL, order_id, 0, 0)
+    if ret != RET_OK:
+        raise ValueError("Unable to cancel order '{}', error={}".format(order_id, data))
+
+
+@timed
 def check_order_filled_all(order_id):
     """
     Check if given order filled all
@@ -186,7 +487,7 @@ def check_order_filled_all(order_id):
     :return:
     :rtype: bool
     """
-    ret, data = trd_ctx.order_list_query(order_id=order_id)
+    ret, data = scheduler.call('order_list_query', connection.trd_ctx.order_list_query, order_id=order_id)
     if ret != RET_OK:
         raise ValueError("Unable to get order status, error={}".format(data))
 
@@ -196,6 +497,7 @@ def check_order_filled_all(order_id):
     return str(data['order_status'][0]) == "FILLED_ALL"
 
 
+@timed
 def check_all_submitted_order_filled_all():
     """
     Check if all the submitted order filled all, i.e. all the trade is done.
@@ -203,8 +505,8 @@ def check_all_submitted_order_filled_all():
     :return:
     :rtype: bool
     """
-    ret, data = trd_ctx.order_list_query(
-        status_filter_list=["WAITING_SUBMIT", "SUBMITTING", "SUBMITTED", "FILLED_PART"])
+    ret, data = scheduler.call('order_list_query', connection.trd_ctx.order_list_query,
+                               status_filter_list=["WAITING_SUBMIT", "SUBMITTING", "SUBMITTED", "FILLED_PART"])
     if ret != RET_OK:
         raise ValueError("Unable to get submitted orders, error={}".format(data))
 
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+import numpy as np
+
+BacktestResult = namedtuple("BacktestResult", ["order_quantity", "ie_order_quantity", "position", "ie_position",
+                                               "fee", "cash", "equity"])
+
+
+def cal_order_quantities(strategy, prices, position=0, ie_position=0):
+    """
+    Vectorized GridTradingStrategy.cal_order_quantity over a price path, assuming every order is filled all
+
+    The new position of a tick only depends on the direction of the last grid index change: the position is clipped to
+    the lower bound of the grid when the price falls into a lower grid and to the upper bound when the price rises into
+    a higher grid. Before the first change the initial position is clipped into the first grid. So the whole path is
+    calculated without looping over the ticks.
+
+    :param strategy: grid trading strategy
+    :type strategy: trade.strategy.GridTradingStrategy
+    :param prices: stock prices, the last axis is time, leading axes are independent paths
+    :type prices: numpy.ndarray
+    :param position: initial stock position, scalar or one per path
+    :type position: int or numpy.ndarray
+    :param ie_position: initial inverse equity position, scalar or one per path
+    :type ie_position: int or numpy.ndarray
+    :return: order quantity, inverse equity order quantity, position, inverse equity position after each tick
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    assert prices.ndim >= 1 and prices.shape[-1] >= 1
+    leading_shape = prices.shape[:-1]
+    position = np.broadcast_to(np.asarray(position, dtype=np.int64), leading_shape)[..., None]
+    ie_position = np.broadcast_to(np.asarray(ie_position, dtype=np.int64), leading_shape)[..., None]
+    assert np.all(position % strategy.lot_size == 0), "Expect position to be whole lots"
+    assert np.all(ie_position % strategy.ie_lot_size == 0), "Expect ie_position to be whole lots"
+
+    position_per_grid = int(round(strategy.position_per_grid))
+    ie_position_per_grid = int(round(strategy.ie_position_per_grid))
+
+    grid_index = np.searchsorted(np.asarray(strategy.grids, dtype=np.float64), prices, side='right')
+    min_grid_position = (strategy.grid_count - grid_index).astype(np.int64) * position_per_grid
+    max_grid_position = min_grid_position + position_per_grid
+
+    # direction of the grid index change of each tick, 0 if unchanged
+    direction = np.zeros(prices.shape, dtype=np.int8)
+    direction[..., 1:] = np.sign(np.diff(grid_index, axis=-1))
+    # index of the last tick changing the grid index, -1 if the grid index never changed
+    ticks = np.arange(prices.shape[-1])
+    last_change = np.maximum.accumulate(np.where(direction != 0, ticks, -1), axis=-1)
+    last_direction = np.take_along_axis(direction, np.maximum(last_change, 0), axis=-1)
+
+    new_position = np.where(last_direction < 0, min_grid_position, max_grid_position)
+    new_position = np.where(last_change < 0, np.clip(position, min_grid_position, max_grid_position), new_position)
+
+    # same rounding as the scalar method, numpy also rounds half to even
+    ie_grid_index = np.round(strategy.grid_count - new_position / position_per_grid).astype(np.int64)
+    ie_new_position = ie_grid_index * ie_position_per_grid
+
+    order_quantity = np.diff(new_position, axis=-1, prepend=position)
+    ie_order_quantity = np.diff(ie_new_position, axis=-1, prepend=ie_position)
+    return order_quantity, ie_order_quantity, new_position, ie_new_position
+
+
+def cal_fee(notional, commission_rate=0.0, min_commission=0.0, platform_fee=0.0, stamp_duty_rate=0.0):
+    """
+    Calculate the trading fee of orders
+
+    :param notional: absolute order value, zero means no order
+    :type notional: numpy.ndarray
+    :param commission_rate: commission as a fraction of the order value
+    :type commission_rate: float
+    :param min_commission: minimum commission per order
+    :type min_commission: float
+    :param platform_fee: fixed fee per order
+    :type platform_fee: float
+    :param stamp_duty_rate: stamp duty as a fraction of the order value, rounded up to a whole dollar
+    :type stamp_duty_rate: float
+    :return: fee of each order
+    :rtype: numpy.ndarray
+    """
+    notional = np.asarray(notional, dtype=np.float64)
+    fee = np.maximum(notional * commission_rate, min_commission) + platform_fee + np.ceil(notional * stamp_duty_rate)
+    return np.where(notional > 0, fee, 0.0)
+
+
+def backtest(strategy, prices, ie_prices, cash, position=0, ie_position=0, **fee_kwargs):
+    """
+    Backtest the grid trading strategy over price paths in one vectorized pass, assuming every order is filled all at
+    the tick price
+
+    :param strategy: grid trading strategy
+    :type strategy: trade.strategy.GridTradingStrategy
+    :param prices: stock prices, the last axis is time, leading axes are independent paths
+    :type prices: numpy.ndarray
+    :param ie_prices: inverse equity prices, same shape as prices
+    :type ie_prices: numpy.ndarray
+    :param cash: initial cash, scalar or one per path
+    :type cash: float or numpy.ndarray
+    :param position: initial stock position, scalar or one per path
+    :type position: int or numpy.ndarray
+    :param ie_position: initial inverse equity position, scalar or one per path
+    :type ie_position: int or numpy.ndarray
+    :param fee_kwargs: fee model, see cal_fee
+    :return: order quantities, positions, fee, cash and equity after each tick
+    :rtype: BacktestResult
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    ie_prices = np.asarray(ie_prices, dtype=np.float64)
+    assert prices.shape == ie_prices.shape, "Expect prices and ie_prices to have the same shape"
+
+    order_quantity, ie_order_quantity, new_position, ie_new_position = cal_order_quantities(
+        strategy, prices, position, ie_position)
+
+    value = order_quantity * prices
+    ie_value = ie_order_quantity * ie_prices
+    fee = cal_fee(np.abs(value), **fee_kwargs) + cal_fee(np.abs(ie_value), **fee_kwargs)
+
+    cash = np.asarray(cash, dtype=np.float64)[..., None] - np.cumsum(value + ie_value + fee, axis=-1)
+    equity = cash + new_position * prices + ie_new_position * ie_prices
+    return BacktestResult(order_quantity, ie_order_quantity, new_position, ie_new_position, fee, cash, equity)
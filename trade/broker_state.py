@@ -0,0 +1,236 @@
+import logging
+import threading
+from datetime import datetime
+from time import time
+
+from trade.trading_calendar import HKT
+
+logger = logging.getLogger("futu-grid-trading")
+
+FILLED_ALL = "FILLED_ALL"
+
+
+class BrokerState:
+    """
+    In-process book of positions and orders
+
+    The book is seeded with the position and order queries at startup and then kept current with the trade order and
+    trade deal push. Reconciling with the queries periodically catches anything the push missed. A position query
+    reflects the deals made before it was sent, so the deals made after it are applied on top of it whether they are
+    pushed before or after the query returns, and the deals made before it are never applied again. The deal time is
+    the create_time of the push, or the time it is received if missing, and the local clock is assumed in sync with
+    OpenD. All methods are thread safe since the push is received in the futu push thread.
+    """
+
+    def __init__(self, now=time):
+        """
+
+        :param now: function returning the current epoch seconds, the time of the deals pushed without a create_time
+        :type now: callable
+        """
+        self.now = now
+        self._cond = threading.Condition()
+        # code -> quantity
+        self.positions = {}
+        # order_id -> order dict with code, trd_side, qty, dealt_qty and order_status
+        self.orders = {}
+        # deal_id -> (code, signed quantity, epoch seconds) of the deals of the current trading day
+        self._deals = {}
+        # order_id -> quantity of the deals received of the order
+        self._order_deals = {}
+        self._deal_day = None
+        # epoch seconds the last position query was sent, None if the positions are not from a query
+        self._query_time = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Call the callback with the order dict whenever an order is updated or a deal of the order is received
+
+        :param callback: function called with the order dict, outside the lock
+        :type callback: callable
+        """
+        self._listeners.append(callback)
+
+    def load_positions(self, data, query_time=None):
+        """
+        Replace the positions with the result of a position query, plus the deals made after the query was sent
+
+        :param data: position data frame with columns 'code' and 'qty', or a dict of the same lists
+        :type data: pandas.DataFrame or dict
+        :param query_time: epoch seconds the query was sent, None if the positions are not from a query, e.g. the
+            positions saved before a restart
+        :type query_time: float
+        :return: code -> (cached quantity, queried quantity) of the positions drifted from the query
+        :rtype: dict
+        """
+        positions = {str(code): int(qty) for code, qty in zip(data['code'], data['qty'])}
+        with self._cond:
+            self._query_time = query_time
+            if query_time is not None:
+                for code, qty, deal_time in self._deals.values():
+                    if deal_time > query_time:
+                        positions[code] = positions.get(code, 0) + qty
+            drift = {}
+            for code in set(positions) | set(self.positions):
+                cached, queried = self.positions.get(code, 0), positions.get(code, 0)
+                if cached != queried:
+                    drift[code] = (cached, queried)
+            self.positions = positions
+            self._cond.notify_all()
+        return drift
+
+    def update_orders(self, data):
+        """
+        Update the orders with an order query or the trade order push
+
+        :param data: order data frame with columns 'order_id', 'code', 'trd_side', 'qty', 'dealt_qty' and
+            'order_status'
+        :type data: pandas.DataFrame
+        """
+        updated = []
+        with self._cond:
+            for row in data.itertuples(index=False):
+                order = {
+                    'order_id': str(row.order_id),
+                    'code': str(row.code),
+                    'trd_side': str(row.trd_side),
+                    'qty': int(row.qty),
+                    'dealt_qty': int(row.dealt_qty),
+                    'order_status': str(row.order_status),
+                }
+                self.orders[order['order_id']] = order
+                updated.append(dict(order))
+                logger.debug("Order updated, %s", order)
+            self._cond.notify_all()
+
+        for order in updated:
+            for callback in self._listeners:
+                callback(order)
+
+    def update_deals(self, data):
+        """
+        Apply the trade deal push to the positions
+
+        :param data: deal data frame with columns 'deal_id', 'code', 'trd_side' and 'qty'
+        :type data: pandas.DataFrame
+        """
+        received = self.now()
+        updated = []
+        with self._cond:
+            for row in data.itertuples(index=False):
+                deal_id = str(row.deal_id)
+                if deal_id in self._deals:
+                    continue
+                deal_time = self._deal_time(getattr(row, 'create_time', None), received)
+                self._prune_deals(deal_time)
+
+                code = str(row.code)
+                qty = int(row.qty) if str(row.trd_side) in ("BUY", "BUY_BACK") else -int(row.qty)
+                self._deals[deal_id] = (code, qty, deal_time)
+                order_id = getattr(row, 'order_id', None)
+                if order_id is not None:
+                    order_id = str(order_id)
+                    self._order_deals[order_id] = self._order_deals.get(order_id, 0) + abs(qty)
+                    if order_id in self.orders:
+                        updated.append(dict(self.orders[order_id]))
+                if self._query_time is not None and deal_time <= self._query_time:
+                    # already in the positions of the last query
+                    logger.debug("Deal received, deal_id=%s, code=%s, qty=%s, already queried", deal_id, code, qty)
+                    continue
+                self.positions[code] = self.positions.get(code, 0) + qty
+                logger.debug("Deal received, deal_id=%s, code=%s, trd_side=%s, qty=%s, position=%s", deal_id, code,
+                             row.trd_side, abs(qty), self.positions[code])
+            self._cond.notify_all()
+
+        for order in updated:
+            for callback in self._listeners:
+                callback(order)
+
+    @staticmethod
+    def _deal_time(create_time, received):
+        if not create_time:
+            return received
+        try:
+            return datetime.fromisoformat(str(create_time)).replace(tzinfo=HKT).timestamp()
+        except ValueError:
+            return received
+
+    def _prune_deals(self, deal_time):
+        # the deal ids are unique within a trading day, and the queries of the day reflect the deals of the days before
+        day = datetime.fromtimestamp(deal_time, HKT).date()
+        if self._deal_day is None or day > self._deal_day:
+            if self._deal_day is not None:
+                self._deals.clear()
+                self._order_deals.clear()
+            self._deal_day = day
+
+    def get_positions(self):
+        """
+        :return: copy of all positions, code -> quantity
+        :rtype: dict[str, int]
+        """
+        with self._cond:
+            return dict(self.positions)
+
+    def get_position(self, symbol):
+        """
+        Get position of a stock
+
+        :param symbol: a single stock stick, e.g. 'HK.07266'
+        :type symbol: str
+        :return: position
+        :rtype: int
+        """
+        with self._cond:
+            return self.positions.get(symbol, 0)
+
+    def get_order(self, order_id):
+        """
+        Get an order
+
+        :param order_id:
+        :type order_id: str
+        :return: copy of the order dict, None if the order is unknown
+        :rtype: dict or None
+        """
+        with self._cond:
+            order = self.orders.get(str(order_id))
+            return dict(order) if order else None
+
+    def get_deal_qty(self, order_id):
+        """
+        :param order_id:
+        :type order_id: str
+        :return: quantity of the deals of the order applied to the positions, 0 if none
+        :rtype: int
+        """
+        with self._cond:
+            return self._order_deals.get(str(order_id), 0)
+
+    def get_order_status(self, order_id):
+        """
+        Get status of an order
+
+        :param order_id:
+        :type order_id: str
+        :return: order status, None if the order is unknown
+        :rtype: str or None
+        """
+        with self._cond:
+            order = self.orders.get(str(order_id))
+            return order['order_status'] if order else None
+
+    def wait_order_filled_all(self, order_id, timeout):
+        """
+        Wait until the order is filled all
+
+        :param order_id:
+        :type order_id: str
+        :param timeout: seconds to wait
+        :type timeout: float
+        :return: if the order is filled all
+        :rtype: bool
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.get_order_status(order_id) == FILLED_ALL, timeout)
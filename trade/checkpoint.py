@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from time import time, sleep
+
+logger = logging.getLogger("futu-grid-trading")
+
+STATE_VERSION = 1
+# seconds to trust the cached static info, lot sizes only change on rare corporate actions
+STATIC_TTL = 7 * 24 * 3600
+# seconds to batch the changes saved in the background into one write
+SAVE_INTERVAL = 1
+
+
+def config_fingerprint(config):
+    """
+    Fingerprint of a config, the same for configs of the same content regardless of the key order
+
+    :param config: config dict
+    :type config: dict
+    :return: hex digest
+    :rtype: str
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _empty_state():
+    return {"version": STATE_VERSION, "config": None, "static": {}, "positions": {}, "pending_orders": {},
+            "accounting": {}, "adaptive": {}}
+
+
+class StateStore:
+    """
+    Small JSON file of the state needed to warm start after a restart
+
+    It holds the static security info with the time it was fetched, the fingerprint of the config, the last known
+    positions, the orders placed but not finished yet, the state of the accounting with its last marked prices and the
+    recentered adaptive grids.
+    Every change is written at once to a temporary file which then replaces the state file, so a crash leaves either
+    the old or the new state on disk. The frequent changes whose loss is recovered on restart, e.g. the accounting of
+    every fill, are saved later by a background writer instead, which batches them into one write per save interval.
+    """
+
+    def __init__(self, path, now=time, static_ttl=STATIC_TTL, save_interval=SAVE_INTERVAL):
+        """
+
+        :param path: state file, created on the first change
+        :type path: str or Path
+        :param now: function returning the current epoch seconds
+        :type now: callable
+        :param static_ttl: seconds to trust the cached static info
+        :type static_ttl: float
+        :param save_interval: seconds to batch the changes saved later
+        :type save_interval: float
+        """
+        self.path = Path(path)
+        self.now = now
+        self.static_ttl = static_ttl
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._state = self._read()
+        # key -> function returning the value of the key to save later
+        self._later = {}
+        self._writer = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return _empty_state()
+        except (OSError, ValueError):
+            logger.exception("Unable to read the state file %s, starting without it", self.path)
+            return _empty_state()
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            logger.warning("Ignoring the state file %s of another version", self.path)
+            return _empty_state()
+        # the last processed prices of the older versions, now saved with the accounting
+        state.pop("last_prices", None)
+        return dict(_empty_state(), **state)
+
+    def _save(self):
+        # called with the lock held
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def save_later(self, key, source):
+        """
+        Save a key of the state in the background within the save interval, the value is only taken when it is written
+
+        :param key: key of the state, e.g. 'accounting'
+        :type key: str
+        :param source: function returning the value, called in the writer thread
+        :type source: callable
+        """
+        with self._lock:
+            self._later[key] = source
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_later, name="state-writer", daemon=True)
+                self._writer.start()
+            self._changed.notify()
+
+    def flush(self):
+        """
+        Write the changes to save later now, e.g. at exit
+        """
+        with self._lock:
+            later, self._later = self._later, {}
+        if not later:
+            return
+        # the sources may take their own locks, they are not called with the lock held
+        values = {key: source() for key, source in later.items()}
+        with self._lock:
+            self._state.update(values)
+            self._save()
+
+    def _write_later(self):
+        while 1:
+            with self._changed:
+                self._changed.wait_for(lambda: self._later)
+            sleep(self.save_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Unable to save the state file %s", self.path)
+
+    def check_config(self, fingerprint):
+        """
+        Compare the config with the one of the saved state, the recentered grids are dropped if it changed
+
+        :param fingerprint: config_fingerprint of the current config
+        :type fingerprint: str
+        :return: if the saved state belongs to the same config
+        :rtype: bool
+        """
+        with self._lock:
+            same = self._state["config"] == fingerprint
+            if not same:
+                self._state["config"] = fingerprint
+                self._state["adaptive"] = {}
+                self._save()
+            return same
+
+    def get_lot_sizes(self, symbols):
+        """
+        Get the cached lot sizes not expired yet
+
+        :param symbols: stock sticks, e.g. ['HK.07266']
+        :type symbols: list[str]
+        :return: symbol -> lot size of the cached symbols only
+        :rtype: dict[str, int]
+        """
+        now = self.now()
+        with self._lock:
+            static = self._state["static"]
+            return {symbol: static[symbol]["lot_size"] for symbol in symbols
+                    if symbol in static and now - static[symbol]["time"] < self.static_ttl}
+
+    def set_lot_sizes(self, lot_sizes):
+        """
+        Cache the lot sizes fetched from OpenD
+
+        :param lot_sizes: symbol -> lot size
+        :type lot_sizes: dict[str, int]
+        """
+        now = self.now()
+        with self._lock:
+            for symbol, lot_size in lot_sizes.items():
+                self._state["static"][symbol] = {"lot_size": int(lot_size), "time": now}
+            self._save()
+
+    @property
+    def positions(self):
+        """
+        :return: copy of the last known positions, code -> quantity
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._state["positions"])
+
+    def set_positions(self, positions):
+        """
+        :param positions: code -> quantity
+        :type positions: dict[str, int]
+        """
+        positions = {str(code): int(qty) for code, qty in positions.items()}
+        with self._lock:
+            if positions != self._state["positions"]:
+                self._state["positions"] = positions
+                self._save()
+
+    @property
+    def pending_orders(self):
+        """
+        :return: copy of the orders placed but not finished, order_id -> dict with code, trd_side and qty
+        :rtype: dict[str, dict]
+        """
+        with self._lock:
+            return {order_id: dict(order) for order_id, order in self._state["pending_orders"].items()}
+
+    def add_pending_order(self, order_id, code, trd_side, qty):
+        """
+        Remember an order until it is finished
+
+        :param order_id:
+        :type order_id: str
+        :param code: stock code, e.g. 'HK.07226'
+        :type code: str
+        :param trd_side: ['BUY', 'SELL']
+        :type trd_side: str
+        :param qty: order quantity
+        :type qty: int
+        """
+        with self._lock:
+            self._state["pending_orders"][str(order_id)] = {"code": code, "trd_side": trd_side, "qty": int(qty)}
+            self._save()
+
+    def remove_pending_orders(self, order_ids):
+        """
+        Forget finished orders, unknown order ids are ignored
+
+        :param order_ids:
+        :type order_ids: list[str]
+        """
+        with self._lock:
+            pending = self._state["pending_orders"]
+            removed = [pending.pop(str(order_id)) for order_id in order_ids if str(order_id) in pending]
+            if removed:
+                self._save()
+
+    @property
+    def accounting(self):
+        """
+        :return: the saved state of trade.accounting.Accounting, empty if none
+        :rtype: dict
+        """
+        with self._lock:
+            return self._state["accounting"]
+
+    @property
+    def adaptive_grids(self):
+        """
+        :return: copy of the recentered grids, symbol -> result of trade.adaptive.AdaptiveGrid.to_dict
+        :rtype: dict[str, dict]
+        """
+        with self._lock:
+            return dict(self._state["adaptive"])
+
+    def set_adaptive_grid(self, symbol, data):
+        """
+        :param symbol: stock stick of the pair
+        :type symbol: str
+        :param data: result of trade.adaptive.AdaptiveGrid.to_dict
+        :type data: dict
+        """
+        with self._lock:
+            self._state["adaptive"][symbol] = data
+            self._save()
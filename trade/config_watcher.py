@@ -0,0 +1,72 @@
+import logging
+import os
+from time import monotonic
+
+import yaml
+
+logger = logging.getLogger("futu-grid-trading")
+
+# seconds between the checks of the config file
+WATCH_INTERVAL = 5
+
+
+class ConfigWatcher:
+    """
+    Watch a YAML config file by polling its modification time and size
+
+    Polling a stat every few seconds costs nothing next to the trading loop and also works on the bind mounts of docker,
+    where file system events of the host are not always delivered to the container.
+    """
+
+    def __init__(self, path, interval=WATCH_INTERVAL, clock=monotonic):
+        """
+
+        :param path: config file
+        :type path: str or Path
+        :param interval: min seconds between the checks
+        :type interval: float
+        :param clock: function returning monotonic seconds
+        :type clock: callable
+        """
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self._checked = clock()
+        self._stat = self._read_stat()
+
+    def _read_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        """
+        Check the config file if the interval passed since the last check
+
+        :return: the new config if the file changed, None otherwise or if the new file is not a valid YAML mapping
+        :rtype: dict or None
+        """
+        now = self.clock()
+        if now - self._checked < self.interval:
+            return None
+        self._checked = now
+
+        stat = self._read_stat()
+        # a missing file is usually being replaced, wait for the new one
+        if stat is None or stat == self._stat:
+            return None
+        self._stat = stat
+
+        try:
+            with open(self.path) as f:
+                config = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError):
+            logger.exception("Unable to read the changed config %s", self.path)
+            return None
+        if not isinstance(config, dict):
+            logger.error("Expect the changed config %s to be a mapping but got %r", self.path, config)
+            return None
+        logger.info("Config %s changed", self.path)
+        return config
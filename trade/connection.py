@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+
+from futu import OpenHKTradeContext, OpenQuoteContext, RET_OK
+
+logger = logging.getLogger("futu-grid-trading")
+
+HOST = '127.0.0.1'
+PORT = 11111
+
+
+class ConnectionManager:
+    """
+    Shared OpenD contexts, created on first use and kept alive
+
+    Nothing is connected until a context is used, so importing trade.api costs nothing when OpenD is not needed. Once
+    the heartbeat is started, a failing heartbeat closes and reopens the contexts with exponential backoff, and the
+    handlers, subscriptions and trade unlock are applied again on the new contexts.
+
+    OPEND_REPLAY=<recording> replays a recording against a local stand-in of OpenD instead of connecting to OpenD,
+    OPEND_RECORD=<recording> records the OpenD responses and push while trading.
+    """
+
+    def __init__(self, host=HOST, port=PORT, quote_factory=None, trade_factory=None, heartbeat_interval=30,
+                 max_backoff=60):
+        """
+
+        :param host: OpenD host
+        :type host: str
+        :param port: OpenD port
+        :type port: int
+        :param quote_factory: function returning a new quote context, default to OpenD according to the environment
+        :type quote_factory: callable
+        :param trade_factory: function returning a new unlocked trade context, default to OpenD according to the
+            environment
+        :type trade_factory: callable
+        :param heartbeat_interval: seconds between the heartbeats
+        :type heartbeat_interval: float
+        :param max_backoff: max seconds between the reconnections
+        :type max_backoff: float
+        """
+        self.host = host
+        self.port = port
+        self.quote_factory = quote_factory or self._open_quote_ctx
+        self.trade_factory = trade_factory or self._open_trade_ctx
+        self.heartbeat_interval = heartbeat_interval
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+
+        self._lock = threading.RLock()
+        self._quote_ctx = None
+        self._trd_ctx = None
+        self._replay = None
+        self._recorder = None
+        self._quote_handlers = []
+        self._trade_handlers = []
+        self._subscriptions = []
+        # 'quote' and 'trade' once the context is used, so that a context failed to reopen is still checked
+        self._in_use = set()
+        self._stop = None
+
+    @property
+    def quote_ctx(self):
+        """
+        :return: the shared quote context, connected on first use
+        """
+        ctx = self._quote_ctx
+        if ctx is None:
+            with self._lock:
+                if self._quote_ctx is None:
+                    self._in_use.add('quote')
+                    self._quote_ctx = self._setup_quote_ctx(self.quote_factory())
+                ctx = self._quote_ctx
+        return ctx
+
+    @property
+    def trd_ctx(self):
+        """
+        :return: the shared unlocked trade context, connected on first use
+        """
+        ctx = self._trd_ctx
+        if ctx is None:
+            with self._lock:
+                if self._trd_ctx is None:
+                    self._in_use.add('trade')
+                    self._trd_ctx = self._setup_trade_ctx(self.trade_factory())
+                ctx = self._trd_ctx
+        return ctx
+
+    @property
+    def replay(self):
+        """
+        :return: the replay when replaying a recording, otherwise None
+        :rtype: trade.fake_opend.Replay or None
+        """
+        if self._replay is None and os.environ.get('OPEND_REPLAY'):
+            with self._lock:
+                if self._replay is None:
+                    from trade.fake_opend import Replay
+
+                    self._replay = Replay(os.environ['OPEND_REPLAY'], float(os.environ.get('OPEND_REPLAY_SPEED', 1)))
+        return self._replay
+
+    def set_quote_handler(self, handler):
+        """
+        Set a quote push handler, also on the contexts reopened later
+        """
+        with self._lock:
+            self._quote_handlers.append(handler)
+            self.quote_ctx.set_handler(handler)
+
+    def set_trade_handler(self, handler):
+        """
+        Set a trade push handler, also on the contexts reopened later
+        """
+        with self._lock:
+            self._trade_handlers.append(handler)
+            self.trd_ctx.set_handler(handler)
+
+    def subscribe(self, code_list, subtype_list):
+        """
+        Subscribe the quote push, also on the contexts reopened later
+
+        :return: ret, data of OpenQuoteContext.subscribe
+        """
+        with self._lock:
+            ret, data = self.quote_ctx.subscribe(code_list, subtype_list)
+            if ret == RET_OK:
+                self._subscriptions.append((list(code_list), list(subtype_list)))
+            return ret, data
+
+    def _setup_quote_ctx(self, ctx):
+        for handler in self._quote_handlers:
+            ctx.set_handler(handler)
+        for code_list, subtype_list in self._subscriptions:
+            ret, data = ctx.subscribe(code_list, subtype_list)
+            if ret != RET_OK:
+                logger.error(f"Unable to subscribe {code_list} again, error={data}")
+        return ctx
+
+    def _setup_trade_ctx(self, ctx):
+        for handler in self._trade_handlers:
+            ctx.set_handler(handler)
+        return ctx
+
+    def _open_quote_ctx(self):
+        if self.replay is not None:
+            from trade.fake_opend import FakeQuoteContext
+
+            return FakeQuoteContext(self.replay)
+
+        logger.info(f"Connecting quote context to OpenD {self.host}:{self.port}")
+        return self._record(OpenQuoteContext(host=self.host, port=self.port))
+
+    def _open_trade_ctx(self):
+        if self.replay is not None:
+            from trade.fake_opend import FakeTradeContext
+
+            return FakeTradeContext(self.replay, self.quote_ctx)
+
+        logger.info(f"Connecting trade context to OpenD {self.host}:{self.port}")
+        ctx = self._record(OpenHKTradeContext(host=self.host, port=self.port))
+        ret, data = ctx.unlock_trade(os.environ['PWD_UNLOCK'])
+        if ret != RET_OK:
+            ctx.close()
+            raise ValueError("Unable to unlock trade, error={}".format(data))
+        return ctx
+
+    def _record(self, ctx):
+        if not os.environ.get('OPEND_RECORD'):
+            return ctx
+
+        from trade.recorder import Recorder, RecordingContext
+
+        if self._recorder is None:
+            self._recorder = Recorder(os.environ['OPEND_RECORD'])
+        return RecordingContext(ctx, self._recorder)
+
+    def ping(self):
+        """
+        Check the contexts in use with a cheap request
+
+        :raise ValueError: if OpenD does not respond, or a context in use is not open, e.g. it failed to reopen
+        """
+        quote_ctx, trd_ctx = self._quote_ctx, self._trd_ctx
+        for name, ctx in (('quote', quote_ctx), ('trade', trd_ctx)):
+            if name in self._in_use and ctx is None:
+                raise ValueError("The {} context is not open".format(name))
+        if quote_ctx is not None:
+            ret, data = quote_ctx.get_global_state()
+            if ret != RET_OK:
+                raise ValueError("Quote context heartbeat failed, error={}".format(data))
+        if trd_ctx is not None:
+            ret, data = trd_ctx.get_acc_list()
+            if ret != RET_OK:
+                raise ValueError("Trade context heartbeat failed, error={}".format(data))
+
+    def reconnect(self):
+        """
+        Close the contexts in use and open them again
+
+        :raise Exception: if a context fails to reopen, it is reopened on the next heartbeat or first use
+        """
+        with self._lock:
+            quote_ctx, trd_ctx = self._quote_ctx, self._trd_ctx
+            self._quote_ctx = self._trd_ctx = None
+            for ctx in (trd_ctx, quote_ctx):
+                if ctx is not None:
+                    try:
+                        ctx.close()
+                    except Exception:
+                        logger.exception("Unable to close context")
+
+            self.reconnects += 1
+            if 'quote' in self._in_use:
+                self.quote_ctx
+            if 'trade' in self._in_use:
+                self.trd_ctx
+        logger.info("Reconnected to OpenD")
+
+    def start_heartbeat(self):
+        """
+        Ping the contexts every heartbeat_interval seconds in a daemon thread and reconnect on failure
+        """
+        if self._stop is not None:
+            return
+        self._stop = threading.Event()
+        threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True).start()
+
+    def stop_heartbeat(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def _heartbeat(self):
+        stop = self._stop
+        backoff = 0
+        while not stop.wait(backoff or self.heartbeat_interval):
+            try:
+                self.ping()
+                backoff = 0
+                continue
+            except Exception as e:
+                logger.warning(f"OpenD heartbeat failed, {e}")
+
+            backoff = min(max(backoff * 2, 1), self.max_backoff)
+            try:
+                self.reconnect()
+            except Exception:
+                logger.exception(f"Unable to reconnect to OpenD, retry in {backoff} seconds")
+
+    def close(self):
+        """
+        Stop the heartbeat and close the contexts
+        """
+        self.stop_heartbeat()
+        with self._lock:
+            for ctx in (self._trd_ctx, self._quote_ctx):
+                if ctx is not None:
+                    ctx.close()
+            self._quote_ctx = self._trd_ctx = None
+            self._in_use.clear()
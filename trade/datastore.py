@@ -0,0 +1,137 @@
+import csv
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("futu-grid-trading")
+
+TIME_COLUMNS = ["date", "time", "time_key", "datetime", "timestamp"]
+CHUNK_ROWS = 65536
+
+
+def normalize_column(name):
+    """
+    Normalize a csv column name into a field name, e.g. 'Adj Close' -> 'adj_close'
+
+    :param name: csv column name
+    :type name: str
+    :return: field name
+    :rtype: str
+    """
+    return name.strip().lower().replace(" ", "_")
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _scan(csv_path):
+    """
+    Read the csv once to find the time column, the numeric columns and the number of valid rows
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = [normalize_column(c) for c in next(reader)]
+        time_index = next((i for i, c in enumerate(header) if c in TIME_COLUMNS), None)
+        assert time_index is not None, "Expect one of the columns {} in {}".format(TIME_COLUMNS, csv_path)
+
+        numeric_indexes = None
+        epoch_time = False
+        count = 0
+        for row in reader:
+            if not _is_valid(row, len(header)):
+                continue
+            if numeric_indexes is None:
+                numeric_indexes = [i for i, v in enumerate(row) if i != time_index and _is_number(v)]
+                epoch_time = _is_number(row[time_index])
+            count += 1
+
+    numeric_indexes = numeric_indexes or []
+    dtype = np.dtype([('time', 'datetime64[s]')] + [(header[i], np.float64) for i in numeric_indexes])
+    return time_index, numeric_indexes, epoch_time, dtype, count
+
+
+def _is_valid(row, width):
+    # Yahoo exports contain 'null' rows for the non-trading days
+    return len(row) == width and all(v and v != "null" for v in row)
+
+
+def ingest_csv(csv_path, npy_path=None):
+    """
+    Convert a csv of daily OHLCV, minute bars or ticks into a structured .npy file
+
+    The csv is streamed twice, once to count the rows and once to fill the memory-mapped output chunk by chunk, so the
+    memory use stays flat for any file size. The time column (one of TIME_COLUMNS, as date string or epoch seconds)
+    becomes the 'time' field, every other numeric column becomes a float64 field named by normalize_column. Rows with
+    empty or 'null' values are skipped.
+
+    :param csv_path: csv file
+    :type csv_path: str
+    :param npy_path: output file, default to csv_path + '.npy'
+    :type npy_path: str
+    :return: output file
+    :rtype: str
+    """
+    npy_path = str(npy_path or str(csv_path) + ".npy")
+    time_index, numeric_indexes, epoch_time, dtype, count = _scan(csv_path)
+
+    tmp_path = npy_path + ".tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(count,))
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        width = len(next(reader))
+        offset = 0
+        chunk = []
+        for row in reader:
+            if not _is_valid(row, width):
+                continue
+            chunk.append(row)
+            if len(chunk) == CHUNK_ROWS:
+                _write_chunk(out, offset, chunk, time_index, numeric_indexes, epoch_time)
+                offset += len(chunk)
+                chunk = []
+        if chunk:
+            _write_chunk(out, offset, chunk, time_index, numeric_indexes, epoch_time)
+    out.flush()
+    del out
+    os.replace(tmp_path, npy_path)
+
+    logger.info(f"Ingested {count} rows from {csv_path} into {npy_path}")
+    return npy_path
+
+
+def _write_chunk(out, offset, chunk, time_index, numeric_indexes, epoch_time):
+    columns = list(zip(*chunk))
+    end = offset + len(chunk)
+    if epoch_time:
+        out['time'][offset:end] = np.array(columns[time_index], dtype=np.float64).astype(np.int64)
+    else:
+        out['time'][offset:end] = np.array(columns[time_index], dtype='datetime64[s]')
+    for i, name in zip(numeric_indexes, out.dtype.names[1:]):
+        out[name][offset:end] = np.array(columns[i], dtype=np.float64)
+
+
+def load(path):
+    """
+    Load a price data file as a read-only memory-mapped structured array
+
+    A csv is ingested into a .npy cache next to it on the first load and whenever the csv is newer than the cache.
+
+    :param path: .npy file or csv file
+    :type path: str
+    :return: structured array with the 'time' field and the numeric fields
+    :rtype: numpy.memmap
+    """
+    path = Path(path)
+    if path.suffix != ".npy":
+        npy_path = Path(str(path) + ".npy")
+        if not npy_path.exists() or npy_path.stat().st_mtime < path.stat().st_mtime:
+            ingest_csv(path, npy_path)
+        path = npy_path
+    return np.load(path, mmap_mode='r')
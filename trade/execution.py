@@ -0,0 +1,227 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from time import perf_counter_ns
+
+from trade import metrics
+from trade.broker_state import FILLED_ALL
+
+logger = logging.getLogger("futu-grid-trading")
+
+FAILED_STATUSES = {"SUBMIT_FAILED", "FAILED", "DISABLED", "DELETED", "TIMEOUT", "CANCELLED_PART", "CANCELLED_ALL",
+                   "FILL_CANCELLED"}
+
+REBALANCE_STAGE = metrics.stage("rebalance")
+ORDER_FILL_STAGE = metrics.stage("order_fill")
+ORDER_THROTTLE_STAGE = metrics.stage("order_throttle")
+# max orders of a leg of a rebalance, one per symbol of a pair
+LEG_ORDERS = 2
+
+
+class OrderExecutor:
+    """
+    Place the orders of a rebalance concurrently without blocking the strategy loop
+
+    Every order gets a future which is resolved by the trade order push through the broker state, once the deals of the
+    order are applied to the positions too, so that the next rebalance never sees the positions before the fill. The
+    sell orders of a rebalance are placed together first and the buy orders are placed together once the sells are
+    filled, so that the cash from the sells is available to the buys. The rebalances of different strategies run
+    concurrently and share the order throttle, which keeps the orders of all strategies within the Futu rate limit.
+    """
+
+    def __init__(self, broker_state, place_order, cancel_order, timeout=30, max_workers=None, max_rebalances=1,
+                 throttle=None):
+        """
+
+        :param broker_state: broker state receiving the trade order push
+        :type broker_state: trade.broker_state.BrokerState
+        :param place_order: function called with (symbol, quantity, trade_side) returning the order id, or None if no
+            order is placed (e.g. dry run)
+        :type place_order: callable
+        :param cancel_order: function called with the order id to cancel an order
+        :type cancel_order: callable
+        :param timeout: seconds to wait for the orders of a leg to be filled all before cancelling them
+        :type timeout: float
+        :param max_workers: max number of orders being placed at the same time, default to the orders of a leg of every
+            running rebalance, so that no order is queued behind another until its leg times out
+        :type max_workers: int
+        :param max_rebalances: max number of rebalances running at the same time, usually the number of strategies
+        :type max_rebalances: int
+        :param throttle: rate limiter acquired before placing every order, None for no limit
+        :type throttle: trade.ratelimit.RateLimiter
+        """
+        self.broker_state = broker_state
+        self.place_order = place_order
+        self.cancel_order = cancel_order
+        self.timeout = timeout
+        self.throttle = throttle
+
+        self._order_pool = ThreadPoolExecutor(max_workers=max_workers or LEG_ORDERS * max_rebalances,
+                                              thread_name_prefix="order")
+        self._rebalance_pool = ThreadPoolExecutor(max_workers=max_rebalances, thread_name_prefix="rebalance")
+        self._lock = threading.Lock()
+        # order_id -> future of the order
+        self._fills = {}
+
+        broker_state.add_listener(self._on_order)
+
+    def submit_order(self, symbol, quantity, trade_side):
+        """
+        Place an order in the background
+
+        :param symbol: a single stock stick, e.g. 'HK.07266'
+        :type symbol: str
+        :param quantity: order quantity
+        :type quantity: int
+        :param trade_side: ['BUY', 'SELL']
+        :type trade_side: str
+        :return: future resolved with the order dict when the order is filled all
+        :rtype: concurrent.futures.Future
+        """
+        fill = Future()
+        fill.order_id = None
+        fill.submitted_ns = perf_counter_ns()
+        # quantity dealt without a deal push to wait for
+        fill.dealt_base = 0
+        self._order_pool.submit(self._place, fill, symbol, quantity, trade_side)
+        return fill
+
+    def execute(self, orders):
+        """
+        Execute the orders of a rebalance in the background, sells before buys
+
+        :param orders: list of (symbol, order quantity), positive means buy, negative means sell
+        :type orders: list[(str, int)]
+        :return: future resolved when all orders are filled all
+        :rtype: concurrent.futures.Future
+        """
+        return self._rebalance_pool.submit(self._execute, orders)
+
+    def resume(self, order_ids):
+        """
+        Wait for the orders placed before a restart in the background, like the orders of a rebalance, so that they are
+        not placed again
+
+        :param order_ids: ids of the orders known to the broker state and not finished yet
+        :type order_ids: list[str]
+        :return: future resolved when all orders are filled all
+        :rtype: concurrent.futures.Future
+        """
+        fills = []
+        for order_id in order_ids:
+            fill = Future()
+            fill.order_id = str(order_id)
+            fill.submitted_ns = perf_counter_ns()
+            # the deals before the restart are in the queried positions, their push is not received again
+            order = self.broker_state.get_order(order_id)
+            fill.dealt_base = max((order['dealt_qty'] if order else 0) - self.broker_state.get_deal_qty(order_id), 0)
+            with self._lock:
+                self._fills[fill.order_id] = fill
+            fills.append(fill)
+
+            # the order may be finished before it is registered
+            if order:
+                self._on_order(order)
+        return self._rebalance_pool.submit(self._wait, fills)
+
+    def _execute(self, orders):
+        start = perf_counter_ns()
+        try:
+            self._execute_legs(orders)
+        except Exception as e:
+            REBALANCE_STAGE.record_error(e)
+            raise
+        finally:
+            REBALANCE_STAGE.record(perf_counter_ns() - start)
+
+    def _execute_legs(self, orders):
+        sells = [self.submit_order(symbol, -quantity, "SELL") for symbol, quantity in orders if quantity < 0]
+        self._wait(sells)
+
+        buys = [self.submit_order(symbol, quantity, "BUY") for symbol, quantity in orders if quantity > 0]
+        self._wait(buys)
+
+    def _place(self, fill, symbol, quantity, trade_side):
+        try:
+            if self.throttle is not None:
+                start = perf_counter_ns()
+                self.throttle.acquire()
+                ORDER_THROTTLE_STAGE.record(perf_counter_ns() - start)
+            if fill.done():
+                # timed out while queued or waiting for the throttle, do not place it any more
+                return
+            order_id = self.place_order(symbol, quantity, trade_side)
+        except BaseException as e:
+            with self._lock:
+                if not fill.done():
+                    fill.set_exception(e)
+            return
+
+        if order_id is None:
+            with self._lock:
+                if not fill.done():
+                    fill.set_result(None)
+            return
+
+        order_id = str(order_id)
+        with self._lock:
+            fill.order_id = order_id
+            timed_out = fill.done()
+            if not timed_out:
+                self._fills[order_id] = fill
+        if timed_out:
+            # the leg timed out while the order was being placed, nobody waits for it any more
+            logger.warning(f"Order '{order_id}' placed after its leg timed out, cancelling it")
+            try:
+                self.cancel_order(order_id)
+            except ValueError:
+                logger.exception(f"Unable to cancel order '{order_id}'")
+            return
+
+        # the push may arrive before the order id is returned
+        order = self.broker_state.get_order(order_id)
+        if order:
+            self._on_order(order)
+
+    def _on_order(self, order):
+        status = order['order_status']
+        if status != FILLED_ALL and status not in FAILED_STATUSES:
+            return
+
+        with self._lock:
+            fill = self._fills.get(order['order_id'])
+            if fill is None or fill.done():
+                self._fills.pop(order['order_id'], None)
+                return
+            if status == FILLED_ALL and \
+                    self.broker_state.get_deal_qty(order['order_id']) + fill.dealt_base < order['dealt_qty']:
+                # called again when the deals are received
+                return
+            del self._fills[order['order_id']]
+            if status == FILLED_ALL:
+                ORDER_FILL_STAGE.record(perf_counter_ns() - fill.submitted_ns)
+                fill.set_result(order)
+            else:
+                fill.set_exception(ValueError("Order '{}' is not filled all, status={}".format(order['order_id'],
+                                                                                               status)))
+
+    def _wait(self, fills):
+        _, not_done = wait(fills, timeout=self.timeout)
+        for fill in not_done:
+            with self._lock:
+                if fill.done():
+                    continue
+                if fill.order_id is not None:
+                    self._fills.pop(fill.order_id, None)
+                fill.set_exception(TimeoutError(f"Order '{fill.order_id}' is not filled all after {self.timeout} "
+                                                f"seconds"))
+
+            if fill.order_id is not None:
+                logger.warning(f"Cancelling order '{fill.order_id}'")
+                try:
+                    self.cancel_order(fill.order_id)
+                except ValueError:
+                    logger.exception(f"Unable to cancel order '{fill.order_id}'")
+
+        for fill in fills:
+            fill.result()
@@ -0,0 +1,411 @@
+import itertools
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import pandas as pd
+from futu import RET_OK, RET_ERROR, ModifyOrderOp, OrderType, SubType
+
+from trade.orderbook import tick_size
+from trade.push import QuotePushHandler, OrderBookPushHandler, TradeOrderPushHandler, TradeDealPushHandler
+from trade.recorder import read_records
+
+logger = logging.getLogger("futu-grid-trading")
+
+DEFAULT_LOT_SIZE = 100
+# quantity of every level of the order books made up from the last prices
+BOOK_DEPTH = 100000
+ORDER_COLUMNS = ['order_id', 'code', 'trd_side', 'order_type', 'order_status', 'qty', 'price', 'dealt_qty',
+                 'dealt_avg_price', 'create_time', 'updated_time']
+
+
+class ReplayFinished(Exception):
+    """
+    The recording is replayed to the end
+    """
+
+
+class Replay:
+    """
+    Market timeline of a recording and the clock replaying it
+
+    With a positive speed the market time runs speed times faster than the wall clock. With speed <= 0 the market time
+    only moves when the ticks are pushed or when sleep is called, so the recording is replayed as fast as possible.
+    The replay is finished once the market state is checked after the last tick.
+    """
+
+    def __init__(self, path, speed=1.0):
+        """
+
+        :param path: recording written by trade.recorder.Recorder
+        :type path: str
+        :param speed: replay speed, e.g. 100 for 100x, <= 0 for as fast as possible
+        :type speed: float
+        """
+        self.speed = speed
+        self.ticks = []
+        self.lot_sizes = {}
+        self.positions = None
+        states = []
+        for record in read_records(path):
+            method, data = record['m'], record['d']
+            if method in ('get_market_snapshot', 'quote'):
+                for row in data if isinstance(data, list) else [data]:
+                    self.ticks.append((record['t'], str(row['code']), float(row['last_price'])))
+            elif method == 'get_global_state':
+                states.append((record['t'], data['market_hk']))
+            elif method == 'get_stock_basicinfo':
+                self.lot_sizes.update({str(row['code']): int(row['lot_size']) for row in data})
+            elif method == 'position_list_query' and self.positions is None:
+                self.positions = {str(row['code']): int(row['qty']) for row in data}
+        assert self.ticks, "Expect quotes in the recording {}".format(path)
+
+        self.ticks.sort(key=lambda tick: tick[0])
+        self.positions = self.positions or {}
+        self.start = self.ticks[0][0]
+        self.end = self.ticks[-1][0]
+
+        self._prices = {}
+        for t, code, price in self.ticks:
+            times, prices = self._prices.setdefault(code, ([], []))
+            times.append(t)
+            prices.append(price)
+        states.sort(key=lambda state: state[0])
+        self._state_times = [t for t, _ in states]
+        self._states = [state for _, state in states]
+
+        self._lock = threading.Lock()
+        self._started = None
+        self._now = self.start
+        self.finished = threading.Event()
+
+    def now(self):
+        """
+        :return: market time in epoch seconds
+        :rtype: float
+        """
+        with self._lock:
+            if self.speed <= 0:
+                return self._now
+            if self._started is None:
+                self._started = time.monotonic()
+            return self.start + (time.monotonic() - self._started) * self.speed
+
+    def advance(self, t):
+        """
+        Move the market time forward to t, only used when replaying as fast as possible
+        """
+        with self._lock:
+            self._now = max(self._now, t)
+
+    def sleep(self, seconds):
+        """
+        Sleep for seconds of market time
+
+        :param seconds: market time seconds
+        :type seconds: float
+        """
+        self.check_finished()
+        if self.speed <= 0:
+            self.advance(self.now() + seconds)
+            # let the other threads, e.g. the order threads, catch up with the market time
+            time.sleep(0.001)
+        else:
+            time.sleep(seconds / self.speed)
+
+    def check_finished(self):
+        if self.finished.is_set() or self.now() > self.end:
+            self.finished.set()
+            raise ReplayFinished("Replayed to the end of the recording")
+
+    def price(self, code):
+        """
+        :return: the latest price of code at the market time, None if not quoted yet
+        :rtype: float or None
+        """
+        times, prices = self._prices.get(code, ([], []))
+        i = bisect_right(times, self.now())
+        if i == 0:
+            return prices[0] if prices else None
+        return prices[i - 1]
+
+    def market_state(self):
+        """
+        :return: Hong Kong market state at the market time, open if the recording has no market state
+        :rtype: str
+        """
+        if not self._states:
+            return "MORNING"
+        i = bisect_right(self._state_times, self.now())
+        return self._states[max(i - 1, 0)]
+
+
+class FakeQuoteContext:
+    """
+    Stand-in of OpenQuoteContext serving the quotes of a replay
+
+    The order books are made up from the last price, which is the best ask one tick above the best bid.
+    """
+
+    def __init__(self, replay):
+        """
+
+        :param replay: replay
+        :type replay: Replay
+        """
+        self.replay = replay
+        self.handler = None
+        self.order_book_handler = None
+        self.subscribed = set()
+        self.order_book_subscribed = set()
+        self.pushed = 0
+        self._tick_listeners = []
+        self._thread = None
+
+    def add_tick_listener(self, callback):
+        self._tick_listeners.append(callback)
+
+    def get_market_snapshot(self, code_list):
+        code_list = [code_list] if isinstance(code_list, str) else list(code_list)
+        update_time = datetime.fromtimestamp(self.replay.now()).strftime("%Y-%m-%d %H:%M:%S")
+        prices = [self.replay.price(code) for code in code_list]
+        if any(price is None for price in prices):
+            return RET_ERROR, "Unknown code in {}".format(code_list)
+        return RET_OK, pd.DataFrame({'code': code_list, 'update_time': update_time, 'last_price': prices})
+
+    def get_order_book(self, code, num=10):
+        price = self.replay.price(code)
+        if price is None:
+            return RET_ERROR, "Unknown code {}".format(code)
+        return RET_OK, self._order_book(code, price, num)
+
+    def _order_book(self, code, price, num=10):
+        tick = tick_size(price)
+        return {'code': code, 'Bid': [(round(price - tick * (i + 1), 3), BOOK_DEPTH, 1, {}) for i in range(num)],
+                'Ask': [(round(price + tick * i, 3), BOOK_DEPTH, 1, {}) for i in range(num)]}
+
+    def get_global_state(self):
+        self.replay.check_finished()
+        return RET_OK, {'market_hk': self.replay.market_state()}
+
+    def get_stock_basicinfo(self, market, stock_type='STOCK', code_list=None):
+        code_list = list(code_list or [])
+        lot_sizes = [self.replay.lot_sizes.get(code, DEFAULT_LOT_SIZE) for code in code_list]
+        return RET_OK, pd.DataFrame({'code': code_list, 'lot_size': lot_sizes})
+
+    def set_handler(self, handler):
+        if isinstance(handler, QuotePushHandler):
+            self.handler = handler
+        elif isinstance(handler, OrderBookPushHandler):
+            self.order_book_handler = handler
+        return RET_OK
+
+    def subscribe(self, code_list, subtype_list, **kwargs):
+        code_list = [code_list] if isinstance(code_list, str) else code_list
+        if SubType.ORDER_BOOK in subtype_list:
+            self.order_book_subscribed.update(code_list)
+        self.subscribed.update(code_list)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._push, name="replay", daemon=True)
+            self._thread.start()
+        return RET_OK, None
+
+    def _push(self):
+        start = bisect_left([t for t, _, _ in self.replay.ticks], self.replay.now())
+        for t, code, price in itertools.islice(self.replay.ticks, start, None):
+            if code not in self.subscribed:
+                continue
+            if self.replay.speed <= 0:
+                self.replay.advance(t)
+            else:
+                delay = (t - self.replay.now()) / self.replay.speed
+                if delay > 0:
+                    time.sleep(delay)
+
+            for callback in self._tick_listeners:
+                callback(code, price)
+            if self.handler is not None:
+                self.handler.handle_quote(pd.DataFrame({'code': [code], 'last_price': [price]}))
+            if self.order_book_handler is not None and code in self.order_book_subscribed:
+                self.order_book_handler.handle_order_book(self._order_book(code, price))
+            self.pushed += 1
+
+        logger.info(f"Replay finished, pushed {self.pushed} quotes")
+        self.replay.finished.set()
+
+    def close(self):
+        pass
+
+
+class FakeTradeContext:
+    """
+    Stand-in of OpenHKTradeContext filling the orders against the prices of a replay
+
+    Market orders are filled all at the latest price with the slippage, normal orders are filled all at the latest
+    price once the limit price is reached.
+    """
+
+    def __init__(self, replay, quote_ctx=None, slippage=0.0):
+        """
+
+        :param replay: replay
+        :type replay: Replay
+        :param quote_ctx: quote context pushing the ticks, pending normal orders are checked on every tick
+        :type quote_ctx: FakeQuoteContext
+        :param slippage: slippage of market orders as a fraction of the price
+        :type slippage: float
+        """
+        self.replay = replay
+        self.slippage = slippage
+        self.positions = dict(replay.positions)
+        self.orders = {}
+        self.order_handler = None
+        self.deal_handler = None
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        if quote_ctx is not None:
+            quote_ctx.add_tick_listener(lambda code, price: self._match(code))
+
+    def unlock_trade(self, password=None, **kwargs):
+        return RET_OK, None
+
+    def get_acc_list(self):
+        return RET_OK, pd.DataFrame({'acc_id': [0], 'trd_env': ['REAL']})
+
+    def set_handler(self, handler):
+        if isinstance(handler, TradeOrderPushHandler):
+            self.order_handler = handler
+        elif isinstance(handler, TradeDealPushHandler):
+            self.deal_handler = handler
+        return RET_OK
+
+    def position_list_query(self, code='', **kwargs):
+        with self._lock:
+            positions = [(c, q) for c, q in self.positions.items() if not code or c == code]
+        return RET_OK, pd.DataFrame(positions, columns=['code', 'qty'])
+
+    def order_list_query(self, order_id='', status_filter_list=[], code='', **kwargs):
+        with self._lock:
+            orders = [dict(o) for o in self.orders.values()
+                      if (not order_id or o['order_id'] == str(order_id))
+                      and (not status_filter_list or o['order_status'] in status_filter_list)
+                      and (not code or o['code'] == code)]
+        return RET_OK, pd.DataFrame(orders, columns=ORDER_COLUMNS)
+
+    def place_order(self, price, qty, code, trd_side, order_type=OrderType.NORMAL, adjust_limit=0, **kwargs):
+        if self.replay.price(code) is None:
+            return RET_ERROR, "Unknown code {}".format(code)
+
+        now = datetime.fromtimestamp(self.replay.now()).strftime("%Y-%m-%d %H:%M:%S")
+        # the push is sent under the lock so that the updates of an order are pushed in order
+        with self._lock:
+            order = {'order_id': str(next(self._ids)), 'code': code, 'trd_side': str(trd_side),
+                     'order_type': str(order_type), 'order_status': 'SUBMITTED', 'qty': int(qty),
+                     'price': float(price), 'dealt_qty': 0, 'dealt_avg_price': 0.0, 'create_time': now,
+                     'updated_time': now}
+            self.orders[order['order_id']] = order
+            self._push_order(order)
+            self._match(code)
+        return RET_OK, pd.DataFrame({'order_id': [order['order_id']]})
+
+    def modify_order(self, modify_order_op, order_id, qty, price, **kwargs):
+        with self._lock:
+            order = self.orders.get(str(order_id))
+            if order is None:
+                return RET_ERROR, "Order '{}' not found".format(order_id)
+            if modify_order_op != ModifyOrderOp.CANCEL:
+                return RET_ERROR, "Only cancelling is supported"
+            if order['order_status'] != 'SUBMITTED':
+                return RET_ERROR, "Order '{}' is {}".format(order_id, order['order_status'])
+            order['order_status'] = 'CANCELLED_ALL'
+            self._push_order(order)
+        return RET_OK, pd.DataFrame({'order_id': [order['order_id']]})
+
+    def _match(self, code):
+        last_price = self.replay.price(code)
+        with self._lock:
+            for order in self.orders.values():
+                if order['code'] != code or order['order_status'] != 'SUBMITTED':
+                    continue
+                buy = order['trd_side'] == 'BUY'
+                if order['order_type'] == OrderType.MARKET:
+                    price = last_price * (1 + self.slippage if buy else 1 - self.slippage)
+                elif (buy and order['price'] >= last_price) or (not buy and order['price'] <= last_price):
+                    price = last_price
+                else:
+                    continue
+
+                order.update(order_status='FILLED_ALL', dealt_qty=order['qty'], dealt_avg_price=price)
+                self.positions[code] = self.positions.get(code, 0) + (order['qty'] if buy else -order['qty'])
+                self._push_order(order)
+                if self.deal_handler is not None:
+                    self.deal_handler.callback(pd.DataFrame({
+                        'deal_id': [order['order_id']], 'order_id': [order['order_id']], 'code': [code],
+                        'trd_side': [order['trd_side']], 'qty': [order['qty']], 'price': [price]}))
+
+    def _push_order(self, order):
+        if self.order_handler is not None:
+            self.order_handler.callback(pd.DataFrame([order], columns=ORDER_COLUMNS))
+
+    def close(self):
+        pass
+
+
+class FakeKlineContext:
+    """
+    Stand-in of OpenQuoteContext serving canned historical klines page by page
+
+    The same klines are served for any kline type and price adjustment. Every symbol requested for the first time takes
+    one quota, the requests beyond the quota fail like OpenD.
+    """
+
+    def __init__(self, klines, quota=100, etfs=None):
+        """
+
+        :param klines: symbol -> klines with the columns 'time_key', 'open', 'high', 'low', 'close', 'volume' and
+            'turnover', in time order
+        :type klines: dict[str, pandas.DataFrame]
+        :param quota: historical kline quota
+        :type quota: int
+        :param etfs: symbols listed as ETFs, default to the symbols of klines
+        :type etfs: list[str]
+        """
+        self.klines = klines
+        self.quota = quota
+        self.etfs = list(klines) if etfs is None else etfs
+        self.used = set()
+        # (symbol, start, end, page_req_key) of every request
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def request_history_kline(self, code, start=None, end=None, ktype='K_DAY', autype='qfq', fields=None,
+                              max_count=1000, page_req_key=None, **kwargs):
+        with self._lock:
+            self.requests.append((code, start, end, page_req_key))
+            if code not in self.used and len(self.used) >= self.quota:
+                return RET_ERROR, "Historical kline quota exceeded", None
+            self.used.add(code)
+        if code not in self.klines:
+            return RET_ERROR, "Unknown code {}".format(code), None
+
+        klines = self.klines[code]
+        dates = klines['time_key'].str[:10]
+        selected = klines[(dates >= (start or "")) & (dates <= (end or "9999"))]
+        offset = int(page_req_key or 0)
+        page = selected.iloc[offset:offset + max_count].reset_index(drop=True)
+        offset += max_count
+        next_page_req_key = str(offset).encode() if offset < len(selected) else None
+        return RET_OK, page.assign(code=code), next_page_req_key
+
+    def get_history_kl_quota(self, get_detail=False):
+        with self._lock:
+            used = len(self.used)
+        return RET_OK, (used, self.quota - used, [])
+
+    def get_stock_basicinfo(self, market, stock_type='STOCK', code_list=None):
+        return RET_OK, pd.DataFrame({'code': self.etfs, 'lot_size': [DEFAULT_LOT_SIZE] * len(self.etfs)})
+
+    def close(self):
+        pass
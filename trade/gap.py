@@ -0,0 +1,216 @@
+import itertools
+import logging
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from trade.datastore import load
+from trade.sweep import expand_values
+from trade.table import format_table
+
+logger = logging.getLogger("futu-grid-trading")
+
+# thresholds of the gap strategy, the defaults are the ones sim_earn used to hard-code
+DEFAULT_PARAMS = {
+    # open vs previous close below which the gap down take profit applies
+    "gap_down": -0.05,
+    # open vs previous close above which the gap up take profit applies
+    "gap_up": 0.05,
+    "gap_down_take_profit": 0.02,
+    "gap_up_take_profit": 0.012,
+    # take profit of the other days opening below the previous close
+    "dip_take_profit": 0.012,
+    # max loss of a trade as a fraction of the open
+    "stop_loss": 0.1,
+}
+PARAM_NAMES = list(DEFAULT_PARAMS)
+METRIC_NAMES = ["profit", "trades", "profit_trades", "win_rate", "profit_per_trade", "max_drawdown"]
+# max number of parameter sets times days evaluated at once, 2MB per float64 array stays in the cpu cache
+BATCH_CELLS = 262_144
+
+# parameter sets of the worker processes, set by _init_worker
+_params_list = None
+
+
+def cal_ratios(data):
+    """
+    Calculate the daily ratios of a daily OHLCV array, the days without volume are skipped
+
+    :param data: structured array with the fields 'open', 'high', 'low', 'close' and 'volume'
+    :type data: numpy.ndarray
+    :return: open vs previous close, high vs open, low vs open, close vs open of every day but the first
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    traded = data['volume'] != 0
+    _open, high, low, close = (np.asarray(data[name][traded], dtype=np.float64)
+                               for name in ('open', 'high', 'low', 'close'))
+    prev_close = close[:-1]
+    _open, high, low, close = _open[1:], high[1:], low[1:], close[1:]
+    return (_open - prev_close) / prev_close, (high - _open) / _open, (low - _open) / _open, (close - _open) / _open
+
+
+def expand_gap_params(param_grid=None):
+    """
+    Expand a grid of thresholds into all the combinations, the thresholds left out take the DEFAULT_PARAMS
+
+    :param param_grid: threshold name -> value spec, see trade.sweep.expand_values
+    :type param_grid: dict
+    :return: list of parameter dicts
+    :rtype: list[dict]
+    """
+    param_grid = {**DEFAULT_PARAMS, **(param_grid or {})}
+    unknown = set(param_grid) - set(PARAM_NAMES)
+    assert not unknown, "Expect parameters in {} but got {}".format(PARAM_NAMES, sorted(unknown))
+    values = [expand_values(param_grid[name]) for name in PARAM_NAMES]
+    return [dict(zip(PARAM_NAMES, combination)) for combination in itertools.product(*values)]
+
+
+def simulate(ratios, params_list):
+    """
+    Simulate the gap strategy for every parameter set at once
+
+    A day is traded by shorting at the open if the open gaps down, gaps up or opens below the previous close. The trade
+    earns the take profit of its gap if the low reaches it, otherwise it loses the high vs open, at most the stop loss.
+
+    :param ratios: result of cal_ratios
+    :type ratios: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    :param params_list: list of parameter dicts
+    :type params_list: list[dict]
+    :return: metric name -> value of every parameter set
+    :rtype: dict[str, numpy.ndarray]
+    """
+    open_vs_prev_close, high_vs_open, low_vs_open, _ = ratios
+    batch = max(1, BATCH_CELLS // max(len(open_vs_prev_close), 1))
+    results = [_simulate_batch(open_vs_prev_close, high_vs_open, low_vs_open, params_list[i:i + batch])
+               for i in range(0, len(params_list), batch)]
+    if not results:
+        return {name: np.empty(0) for name in METRIC_NAMES}
+    return {name: np.concatenate([r[name] for r in results]) for name in METRIC_NAMES}
+
+
+def _simulate_batch(open_vs_prev_close, high_vs_open, low_vs_open, params_list):
+    # one row per parameter set, one column per day
+    p = {name: np.array([params[name] for params in params_list], dtype=np.float64)[:, None] for name in PARAM_NAMES}
+    gap = open_vs_prev_close[None, :]
+    take_profit = np.select([gap < p['gap_down'], gap > p['gap_up'], gap < 0],
+                            [p['gap_down_take_profit'], p['gap_up_take_profit'], p['dip_take_profit']], np.nan)
+    traded = ~np.isnan(take_profit)
+    profited = low_vs_open[None, :] <= -take_profit
+    pnl = np.where(profited, take_profit, -np.minimum(p['stop_loss'], high_vs_open[None, :]))
+    pnl[~traded] = 0
+
+    equity = np.cumsum(pnl, axis=-1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=-1), 0)
+    trades = traded.sum(axis=-1)
+    profit_trades = profited.sum(axis=-1)
+    profit = equity[:, -1] if equity.shape[-1] else np.zeros(len(params_list))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'profit': profit,
+            'trades': trades,
+            'profit_trades': profit_trades,
+            'win_rate': np.where(trades > 0, profit_trades / trades, 0.0),
+            'profit_per_trade': np.where(trades > 0, profit / trades, 0.0),
+            'max_drawdown': np.max(peak - equity, axis=-1, initial=0.0),
+        }
+
+
+def _init_worker(params_list):
+    global _params_list
+    _params_list = params_list
+
+
+def _scan_file(path):
+    try:
+        data = load(path)
+        ratios = cal_ratios(data)
+    except (ValueError, KeyError, AssertionError) as e:
+        logger.warning(f"Skipping {path}, {e}")
+        return None
+    return simulate(ratios, _params_list)
+
+
+def scan(paths, params_list, processes=None):
+    """
+    Simulate every parameter set over the daily prices of every file in a process pool
+
+    :param paths: daily OHLCV csv files or their .npy caches, one per symbol
+    :type paths: list[str or Path]
+    :param params_list: list of parameter dicts
+    :type params_list: list[dict]
+    :param processes: number of worker processes, default to the number of cores, 1 to run in this process
+    :type processes: int
+    :return: symbol (file name without the suffixes) -> metric name -> value of every parameter set, the files which can
+        not be read are left out
+    :rtype: dict[str, dict[str, numpy.ndarray]]
+    """
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        _init_worker(params_list)
+        results = [_scan_file(path) for path in paths]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(params_list,)) as pool:
+            results = pool.map(_scan_file, paths, chunksize=max(1, len(paths) // (processes * 4)))
+    gaps = {}
+    for path, result in zip(paths, results):
+        if result is None:
+            continue
+        name = Path(path).name.split(".csv")[0]
+        gaps[name[:-4] if name.endswith(".npy") else name] = result
+    return gaps
+
+
+def find_data_files(path):
+    """
+    :param path: a data file, or a directory of csv files or of .npy files, e.g. the daily klines of trade.kline
+    :type path: str or Path
+    :return: data files
+    :rtype: list[Path]
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return [path]
+    # the .npy caches of the csv files are loaded through their csv
+    return sorted(list(path.glob("*.csv")) + [p for p in path.glob("*.npy") if not p.name.endswith(".csv.npy")])
+
+
+def rank(scanned, params_list, top=None, key="profit"):
+    """
+    Rank the (symbol, parameter set) pairs by a metric
+
+    :param scanned: result of scan
+    :type scanned: dict[str, dict[str, numpy.ndarray]]
+    :param params_list: list of parameter dicts of the scan
+    :type params_list: list[dict]
+    :param top: number of rows, default to all
+    :type top: int
+    :param key: metric to rank by, descending
+    :type key: str
+    :return: rows with the symbol, the parameters and the metrics
+    :rtype: list[dict]
+    """
+    symbols = list(scanned)
+    if not symbols:
+        return []
+    values = np.concatenate([scanned[symbol][key] for symbol in symbols])
+    order = np.argsort(-values, kind='stable')[:top]
+    rows = []
+    for i in order.tolist():
+        symbol, params_index = symbols[i // len(params_list)], i % len(params_list)
+        metrics = {name: scanned[symbol][name][params_index].item() for name in METRIC_NAMES}
+        rows.append(dict(symbol=symbol, **params_list[params_index], **metrics))
+    return rows
+
+
+def format_report(rows):
+    """
+    Format the ranked rows as a text table
+
+    :param rows: rows of rank
+    :type rows: list[dict]
+    :return: table
+    :rtype: str
+    """
+    return format_table(rows, ["symbol"] + PARAM_NAMES + METRIC_NAMES)
@@ -0,0 +1,171 @@
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from queue import SimpleQueue
+
+import numpy as np
+
+from trade.trading_calendar import HKT
+
+logger = logging.getLogger("futu-grid-trading")
+
+# record kinds
+SIGNAL = 1
+ORDER = 2
+FILL = 3
+POSITION = 4
+KIND_NAMES = {SIGNAL: "signal", ORDER: "order", FILL: "fill", POSITION: "position"}
+
+# fixed-width little endian records without header, so a journal file is an array of JOURNAL_DTYPE as it is
+JOURNAL_DTYPE = np.dtype([
+    ('time', '<i8'),  # epoch nanoseconds of the market time
+    ('kind', 'u1'),
+    ('side', 'i1'),  # 1 buy, -1 sell, 0 for positions
+    ('grid_index', '<i2'),  # grid index of the signals, -1 otherwise
+    ('code', 'S12'),
+    ('order_id', 'S24'),
+    ('quantity', '<i8'),  # order quantity of signals and orders, dealt quantity of fills, position of positions
+    ('price', '<f8'),
+])
+SUFFIX = ".journal"
+_STOP = None
+
+
+class Journal:
+    """
+    Append-only binary journal of the signals, orders, fills and position snapshots, one file per Hong Kong day
+
+    Recording only puts a tuple into a queue, the records are encoded and written in batches by a background thread,
+    so a slow disk never delays trading. Load the files with load_journal.
+    """
+
+    def __init__(self, directory, now):
+        """
+
+        :param directory: directory of the journal files, created if missing
+        :type directory: str or Path
+        :param now: function returning the current epoch seconds, e.g. trade.api.market_now
+        :type now: callable
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.now = now
+        self._queue = SimpleQueue()
+        self._thread = threading.Thread(target=self._write, name="journal", daemon=True)
+        self._thread.start()
+
+    def record(self, kind, code, quantity, price=0.0, side=0, order_id="", grid_index=-1):
+        """
+        Queue a record, the time is taken now
+
+        :param kind: SIGNAL, ORDER, FILL or POSITION
+        :type kind: int
+        :param code: stock code, e.g. 'HK.07226'
+        :type code: str
+        :param quantity: see JOURNAL_DTYPE
+        :type quantity: int
+        :param price: price, 0 if unknown, e.g. market orders
+        :type price: float
+        :param side: 1 buy, -1 sell, 0 none
+        :type side: int
+        :param order_id: order id of orders and fills
+        :type order_id: str
+        :param grid_index: grid index of signals
+        :type grid_index: int
+        """
+        self._queue.put((int(self.now() * 1e9), kind, side, grid_index, code.encode(), str(order_id).encode(),
+                         int(quantity), float(price)))
+
+    def record_deals(self, data):
+        """
+        Queue a fill record per deal of the trade deal push
+
+        :param data: deal data frame with columns 'order_id', 'code', 'trd_side', 'qty' and 'price'
+        :type data: pandas.DataFrame
+        """
+        for order_id, code, trd_side, qty, price in zip(data['order_id'], data['code'], data['trd_side'],
+                                                        data['qty'], data['price']):
+            side = 1 if str(trd_side) in ("BUY", "BUY_BACK") else -1
+            self.record(FILL, str(code), qty, price, side, order_id)
+
+    def record_positions(self, positions):
+        """
+        Queue a position record per code
+
+        :param positions: code -> position
+        :type positions: dict[str, int]
+        """
+        for code, position in positions.items():
+            self.record(POSITION, code, position)
+
+    def close(self):
+        """
+        Write the queued records and stop the writer thread
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _open(self, day):
+        f = open(self.directory / (day + SUFFIX), "ab")
+        # drop a partial record left by a crash, otherwise the following records would be misaligned
+        partial = f.tell() % JOURNAL_DTYPE.itemsize
+        if partial:
+            logger.warning("Dropping a partial record of %s bytes at the end of the %s journal", partial, day)
+            f.truncate(f.tell() - partial)
+        return f
+
+    def _write(self):
+        day, f = None, None
+        while True:
+            records = [self._queue.get()]
+            # drain the queue to write a batch at once
+            while not self._queue.empty():
+                records.append(self._queue.get())
+            stop = _STOP in records
+            records = [r for r in records if r is not _STOP]
+
+            try:
+                array = np.array(records, dtype=JOURNAL_DTYPE)
+                days = np.array([datetime.fromtimestamp(t / 1e9, HKT).strftime("%Y-%m-%d") for t in array['time']])
+                for record_day in sorted(set(days)):
+                    if record_day != day:
+                        if f is not None:
+                            f.close()
+                        day, f = record_day, self._open(record_day)
+                    f.write(array[days == record_day].tobytes())
+                if f is not None:
+                    f.flush()
+            except Exception:
+                logger.exception("Unable to write %s journal records", len(records))
+
+            if stop:
+                if f is not None:
+                    f.close()
+                return
+
+
+def load_journal(path):
+    """
+    Load a journal file, or all journal files of a directory in time order
+
+    A file is memory-mapped, the files of a directory are concatenated. A partial record at the end of a file, e.g.
+    after a crash, is ignored.
+
+    :param path: journal file or directory
+    :type path: str or Path
+    :return: records
+    :rtype: numpy.ndarray
+    """
+    path = Path(path)
+    paths = sorted(path.glob("*" + SUFFIX)) if path.is_dir() else [path]
+    arrays = []
+    for p in paths:
+        count = p.stat().st_size // JOURNAL_DTYPE.itemsize
+        if count:
+            arrays.append(np.memmap(p, dtype=JOURNAL_DTYPE, mode='r', shape=(count,)))
+    if len(arrays) == 1:
+        return arrays[0]
+    if not arrays:
+        return np.empty(0, dtype=JOURNAL_DTYPE)
+    return np.concatenate(arrays)
@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+from futu import KLType, AuType
+
+logger = logging.getLogger("futu-grid-trading")
+
+# kline type names of the store -> futu kline types
+KTYPES = {
+    "1m": KLType.K_1M,
+    "5m": KLType.K_5M,
+    "15m": KLType.K_15M,
+    "60m": KLType.K_60M,
+    "day": KLType.K_DAY,
+}
+# one kline of the store, loadable by trade.datastore.load like the ingested csv files
+KLINE_DTYPE = np.dtype([
+    ('time', 'datetime64[s]'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('turnover', '<f8'),
+])
+PAGE_SIZE = 1000
+# the backward adjusted prices of the past never change, so new klines are appended without fetching the old ones
+# again, unlike the forward adjusted prices which change on every split or dividend
+DEFAULT_AUTYPE = AuType.HFQ
+DEFAULT_WORKERS = 4
+MANIFEST = "manifest.json"
+# stock codes of the leveraged and inverse products in Hong Kong
+LEVERAGED_INVERSE_CODES = range(7200, 7600)
+
+
+def is_leveraged_inverse(symbol):
+    """
+    :param symbol: stock stick, e.g. 'HK.07226'
+    :type symbol: str
+    :return: if the symbol is a leveraged or inverse product listed in Hong Kong
+    :rtype: bool
+    """
+    market, _, code = symbol.partition(".")
+    return market == "HK" and code.isdigit() and int(code) in LEVERAGED_INVERSE_CODES
+
+
+def to_records(data):
+    """
+    Convert a page of klines into KLINE_DTYPE records
+
+    :param data: klines of trade.api.request_history_kline
+    :type data: pandas.DataFrame
+    :return: records
+    :rtype: numpy.ndarray
+    """
+    records = np.empty(len(data), dtype=KLINE_DTYPE)
+    records['time'] = np.array(data['time_key'].tolist(), dtype='datetime64[s]')
+    for name in KLINE_DTYPE.names[1:]:
+        records[name] = np.asarray(data[name], dtype=np.float64)
+    return records
+
+
+class KlineStore:
+    """
+    Local store of klines, one .npy file per symbol and kline type under <root>/<ktype>/<symbol>.npy
+
+    The manifest records the date range covered by every file and the range being downloaded. The pages of a download
+    are appended to a .part file next to the .npy and merged into it once the range is complete, so an interrupted
+    download resumes from its last page.
+    """
+
+    def __init__(self, root):
+        """
+
+        :param root: directory of the store
+        :type root: str or Path
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        manifest = self.root / MANIFEST
+        self._manifest = json.loads(manifest.read_text()) if manifest.exists() else {}
+
+    @staticmethod
+    def _key(symbol, ktype):
+        return "{}/{}".format(ktype, symbol)
+
+    def path(self, symbol, ktype):
+        return self.root / ktype / "{}.npy".format(symbol)
+
+    def _part_path(self, symbol, ktype):
+        return self.root / ktype / "{}.part".format(symbol)
+
+    def symbols(self):
+        """
+        :return: the symbols with klines or a download in progress
+        :rtype: set[str]
+        """
+        with self._lock:
+            return {key.split("/", 1)[1] for key in self._manifest}
+
+    def coverage(self, symbol, ktype):
+        """
+        :return: first date, last date of the stored klines, None if none
+        :rtype: (datetime.date, datetime.date) or None
+        """
+        with self._lock:
+            item = self._manifest.get(self._key(symbol, ktype), {})
+        if 'start' not in item:
+            return None
+        return date.fromisoformat(item['start']), date.fromisoformat(item['end'])
+
+    def pending(self, symbol, ktype):
+        """
+        :return: first date, last date of the download in progress, None if none
+        :rtype: (datetime.date, datetime.date) or None
+        """
+        with self._lock:
+            item = self._manifest.get(self._key(symbol, ktype), {})
+        if 'pending' not in item:
+            return None
+        start, end = item['pending']
+        return date.fromisoformat(start), date.fromisoformat(end)
+
+    def load(self, symbol, ktype):
+        """
+        :return: the stored klines, empty if none
+        :rtype: numpy.ndarray
+        """
+        path = self.path(symbol, ktype)
+        if not path.exists():
+            return np.empty(0, dtype=KLINE_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def begin(self, symbol, ktype, start, end):
+        """
+        Record the range about to be downloaded
+
+        :param start: first date
+        :type start: datetime.date
+        :param end: last date
+        :type end: datetime.date
+        """
+        with self._lock:
+            item = self._manifest.setdefault(self._key(symbol, ktype), {})
+            item['pending'] = [start.isoformat(), end.isoformat()]
+            self._save_manifest()
+
+    def append(self, symbol, ktype, records):
+        """
+        Append a page of the download in progress, durably
+        """
+        path = self._part_path(symbol, ktype)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_part(self, symbol, ktype):
+        """
+        Read the download in progress, a record cut by a crash is truncated so that the next page is appended after
+        the last complete record
+
+        :return: the klines of the download in progress
+        :rtype: numpy.ndarray
+        """
+        path = self._part_path(symbol, ktype)
+        if not path.exists():
+            return np.empty(0, dtype=KLINE_DTYPE)
+        data = path.read_bytes()
+        cut = len(data) % KLINE_DTYPE.itemsize
+        if cut:
+            data = data[:len(data) - cut]
+            with open(path, "r+b") as f:
+                f.truncate(len(data))
+        return np.frombuffer(data, dtype=KLINE_DTYPE)
+
+    def commit(self, symbol, ktype, covered_end):
+        """
+        Merge the download in progress into the stored klines and extend the covered range
+
+        :param covered_end: last date known complete, the klines of later dates are fetched again next time
+        :type covered_end: datetime.date
+        :return: number of klines stored
+        :rtype: int
+        """
+        start, _ = self.pending(symbol, ktype)
+        part = self.read_part(symbol, ktype)
+        stored = np.array(self.load(symbol, ktype))
+        merged = np.concatenate([stored, part])
+        # the downloaded klines replace the stored ones of the same time
+        times = merged['time'][::-1]
+        _, last = np.unique(times, return_index=True)
+        merged = merged[len(merged) - 1 - last]
+
+        path = self.path(symbol, ktype)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.npy")
+        np.save(tmp_path, merged)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            item = self._manifest[self._key(symbol, ktype)]
+            del item['pending']
+            if start <= covered_end:
+                item['start'] = min(item.get('start', start.isoformat()), start.isoformat())
+                item['end'] = max(item.get('end', covered_end.isoformat()), covered_end.isoformat())
+            self._save_manifest()
+        self._part_path(symbol, ktype).unlink(missing_ok=True)
+        return len(merged)
+
+    def _save_manifest(self):
+        path = self.root / MANIFEST
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._manifest, indent=1, sort_keys=True))
+        os.replace(tmp_path, path)
+
+
+def missing_ranges(coverage, start, end):
+    """
+    Find the ranges to download so that the covered range includes [start, end] and stays contiguous
+
+    :param coverage: first date, last date of the stored klines, None if none
+    :type coverage: (datetime.date, datetime.date) or None
+    :param start: first date wanted
+    :type start: datetime.date
+    :param end: last date wanted
+    :type end: datetime.date
+    :return: ranges of dates to download
+    :rtype: list[(datetime.date, datetime.date)]
+    """
+    if start > end:
+        return []
+    if coverage is None:
+        return [(start, end)]
+    covered_start, covered_end = coverage
+    ranges = []
+    if start < covered_start:
+        ranges.append((start, covered_start - timedelta(days=1)))
+    if end > covered_end:
+        ranges.append((covered_end + timedelta(days=1), end))
+    return ranges
+
+
+class KlineDownloader:
+    """
+    Download the klines of many symbols into a KlineStore, only the dates not stored yet
+
+    The symbols are downloaded by a pool of threads, their pages are paced by the scheduler of trade.api within the
+    request limit of OpenD. Every symbol not downloaded before takes one historical kline quota, the symbols exceeding
+    the remaining quota are skipped.
+    """
+
+    def __init__(self, store, request_page=None, get_quota=None, workers=DEFAULT_WORKERS, autype=DEFAULT_AUTYPE,
+                 today=date.today):
+        """
+
+        :param store: store of the klines
+        :type store: KlineStore
+        :param request_page: function returning a page of klines, default to trade.api.request_history_kline
+        :type request_page: callable
+        :param get_quota: function returning the used and remaining quota, default to
+            trade.api.get_history_kline_quota
+        :type get_quota: callable
+        :param workers: number of symbols downloaded at the same time
+        :type workers: int
+        :param autype: price adjustment
+        :type autype: str
+        :param today: function returning today, the klines of today are fetched again until the day is over
+        :type today: callable
+        """
+        if request_page is None or get_quota is None:
+            from trade import api
+            request_page = request_page or api.request_history_kline
+            get_quota = get_quota or api.get_history_kline_quota
+        self.store = store
+        self.request_page = request_page
+        self.get_quota = get_quota
+        self.workers = workers
+        self.autype = autype
+        self.today = today
+
+    def download(self, symbols, ktypes, start, end=None):
+        """
+        Download the klines of every symbol and kline type from start to end, resuming the interrupted downloads first
+
+        :param symbols: stock sticks, e.g. ['HK.07226', 'HK.07552']
+        :type symbols: list[str]
+        :param ktypes: kline types, keys of KTYPES
+        :type ktypes: list[str]
+        :param start: first date
+        :type start: datetime.date
+        :param end: last date, default to today
+        :type end: datetime.date
+        :return: (symbol, ktype) -> number of klines downloaded, the failed downloads are left out
+        :rtype: dict[(str, str), int]
+        """
+        unknown = set(ktypes) - set(KTYPES)
+        assert not unknown, "Expect kline types in {} but got {}".format(list(KTYPES), sorted(unknown))
+        today = self.today()
+        end = min(end or today, today)
+
+        new_symbols = sorted(set(symbols) - self.store.symbols())
+        if new_symbols:
+            used, remain = self.get_quota()
+            logger.info(f"Historical kline quota used={used}, remain={remain}, new symbols={len(new_symbols)}")
+            if remain < len(new_symbols):
+                skipped = set(new_symbols[remain:])
+                logger.warning(f"Skipping {len(skipped)} symbols exceeding the quota: {sorted(skipped)}")
+                symbols = [symbol for symbol in symbols if symbol not in skipped]
+
+        jobs = [(symbol, ktype) for symbol in symbols for ktype in ktypes]
+        results = {}
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="kline") as pool:
+            futures = {job: pool.submit(self._download, *job, start, end, today) for job in jobs}
+            for job, future in futures.items():
+                try:
+                    results[job] = future.result()
+                except Exception as e:
+                    logger.error(f"Unable to download the {job[1]} klines of {job[0]}, {e}")
+        return results
+
+    def _download(self, symbol, ktype, start, end, today):
+        count = 0
+        pending = self.store.pending(symbol, ktype)
+        if pending is not None:
+            part = self.store.read_part(symbol, ktype)
+            # the day of the last kline is fetched again, it may be incomplete
+            resume = part['time'][-1].astype(object).date() if len(part) else pending[0]
+            logger.info(f"Resuming the {ktype} klines of {symbol} from {resume} to {pending[1]}")
+            count += self._fetch(symbol, ktype, resume, pending[1], today)
+
+        for range_start, range_end in missing_ranges(self.store.coverage(symbol, ktype), start, end):
+            self.store.begin(symbol, ktype, range_start, range_end)
+            count += self._fetch(symbol, ktype, range_start, range_end, today)
+        return count
+
+    def _fetch(self, symbol, ktype, start, end, today):
+        count = 0
+        page_req_key = None
+        while True:
+            data, page_req_key = self.request_page(symbol, start.isoformat(), end.isoformat(), KTYPES[ktype],
+                                                   self.autype, page_req_key=page_req_key, max_count=PAGE_SIZE)
+            if len(data):
+                self.store.append(symbol, ktype, to_records(data))
+                count += len(data)
+            if page_req_key is None:
+                break
+        # today is not over, keep it out of the covered range
+        covered_end = min(end, today - timedelta(days=1))
+        total = self.store.commit(symbol, ktype, covered_end)
+        logger.info(f"Downloaded {count} {ktype} klines of {symbol} from {start} to {end}, {total} stored")
+        return count
@@ -0,0 +1,258 @@
+import functools
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter_ns
+
+logger = logging.getLogger("futu-grid-trading")
+
+# values below 2 ** SUB_BITS ns get their own bucket, larger values share 2 ** (SUB_BITS - 1) buckets per power of two,
+# i.e. about 6% relative precision like an HDR histogram with one significant digit
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+HALF_SUB_COUNT = SUB_COUNT >> 1
+BUCKET_COUNT = (64 - SUB_BITS + 1) * HALF_SUB_COUNT + HALF_SUB_COUNT
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+RATE_LIMIT_KEYWORDS = ["频率", "too frequent", "frequency limit"]
+PREFIX = "futu_grid_trading"
+
+
+def _bucket_index(value):
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift + 1) * HALF_SUB_COUNT + (value >> shift) - HALF_SUB_COUNT
+
+
+def _bucket_value(index):
+    """
+    :return: the highest value of the bucket
+    """
+    if index < SUB_COUNT:
+        return index
+    shift = index // HALF_SUB_COUNT - 1
+    return (((index % HALF_SUB_COUNT) + HALF_SUB_COUNT + 1) << shift) - 1
+
+
+class Stage:
+    """
+    Latency histogram in nanoseconds and counters of a stage, e.g. an OpenD call
+
+    Recording is a few integer operations without lock, concurrent recordings may rarely lose a count which is fine for
+    monitoring.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.buckets = [0] * BUCKET_COUNT
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        """
+        Record a latency
+
+        :param ns: latency in nanoseconds
+        :type ns: int
+        """
+        self.buckets[_bucket_index(ns)] += 1
+        self.calls += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def record_error(self, error):
+        """
+        Count an error, and a rate limit rejection if the error message says so
+
+        :param error: the exception raised
+        :type error: Exception
+        """
+        self.errors += 1
+        message = str(error).lower()
+        if any(keyword in message for keyword in RATE_LIMIT_KEYWORDS):
+            self.rate_limited += 1
+
+    def percentile(self, quantile):
+        """
+        :param quantile: e.g. 0.99
+        :type quantile: float
+        :return: latency in nanoseconds at the quantile, 0 if nothing is recorded
+        :rtype: int
+        """
+        buckets = list(self.buckets)
+        count = sum(buckets)
+        if count == 0:
+            return 0
+        rank = quantile * count
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(_bucket_value(index), self.max_ns)
+        return self.max_ns
+
+
+_stages = {}
+_lock = threading.Lock()
+_gauge_funcs = []
+
+
+def stage(name):
+    """
+    Get or create the stage of a name
+
+    :param name: stage name, e.g. 'get_latest_price'
+    :type name: str
+    :return: stage
+    :rtype: Stage
+    """
+    s = _stages.get(name)
+    if s is None:
+        with _lock:
+            s = _stages.setdefault(name, Stage(name))
+    return s
+
+
+def register_gauges(func):
+    """
+    Serve the values returned by a function as gauges, e.g. the P&L of the accounting
+
+    :param func: function returning gauge name -> value, the None values are left out
+    :type func: callable
+    """
+    with _lock:
+        _gauge_funcs.append(func)
+
+
+def unregister_gauges(func):
+    """
+    Stop serving the gauges of a function registered by register_gauges
+
+    :param func: function registered before
+    :type func: callable
+    """
+    with _lock:
+        if func in _gauge_funcs:
+            _gauge_funcs.remove(func)
+
+
+def timed(func):
+    """
+    Decorator recording the latency and errors of a function into the stage named after it
+    """
+    s = stage(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            s.record_error(e)
+            raise
+        finally:
+            s.record(perf_counter_ns() - start)
+
+    return wrapper
+
+
+def format_prometheus():
+    """
+    Format the stages in the Prometheus text exposition format
+
+    :return: metrics text
+    :rtype: str
+    """
+    lines = [f"# TYPE {PREFIX}_latency_seconds summary",
+             f"# TYPE {PREFIX}_calls_total counter",
+             f"# TYPE {PREFIX}_errors_total counter",
+             f"# TYPE {PREFIX}_rate_limited_total counter"]
+    for name, s in sorted(_stages.items()):
+        label = f'stage="{name}"'
+        for quantile in QUANTILES:
+            seconds = s.percentile(quantile) / 1e9
+            lines.append(f'{PREFIX}_latency_seconds{{{label},quantile="{quantile}"}} {seconds:.9f}')
+        lines.append(f"{PREFIX}_latency_seconds_sum{{{label}}} {s.total_ns / 1e9:.9f}")
+        lines.append(f"{PREFIX}_latency_seconds_count{{{label}}} {s.calls}")
+        lines.append(f"{PREFIX}_calls_total{{{label}}} {s.calls}")
+        lines.append(f"{PREFIX}_errors_total{{{label}}} {s.errors}")
+        lines.append(f"{PREFIX}_rate_limited_total{{{label}}} {s.rate_limited}")
+    for func in list(_gauge_funcs):
+        for name, value in sorted(func().items()):
+            if value is not None:
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                lines.append(f"{PREFIX}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def format_summary():
+    """
+    Format a one line summary per stage for the log
+
+    :return: summary
+    :rtype: str
+    """
+    lines = []
+    for name, s in sorted(_stages.items()):
+        if s.calls == 0:
+            continue
+        lines.append(f"{name}: calls={s.calls}, errors={s.errors}, rate_limited={s.rate_limited}, "
+                     f"p50={s.percentile(0.5) / 1e6:.3f}ms, p99={s.percentile(0.99) / 1e6:.3f}ms, "
+                     f"max={s.max_ns / 1e6:.3f}ms")
+    return "\n".join(lines)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = format_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """
+    Serve the metrics on http://host:port/metrics in a daemon thread
+
+    :param port: port
+    :type port: int
+    :param host: host
+    :type host: str
+    :return: http server
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def log_summary_periodically(interval):
+    """
+    Log the summary every interval seconds in a daemon thread
+
+    :param interval: seconds
+    :type interval: float
+    """
+    def run():
+        while not stop.wait(interval):
+            summary = format_summary()
+            if summary:
+                logger.info("Latency summary\n" + summary)
+
+    stop = threading.Event()
+    threading.Thread(target=run, name="metrics-summary", daemon=True).start()
+    return stop
@@ -0,0 +1,295 @@
+import logging
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from trade.backtest import backtest
+from trade.strategy import GridTradingStrategy, CAPITAL_USE_LIMIT
+from trade.table import format_table
+
+logger = logging.getLogger("futu-grid-trading")
+
+METRIC_NAMES = ["total_return", "max_capital_use", "time_outside", "turnover", "max_drawdown", "order_count"]
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+# max number of prices of a batch, about 16MB per float64 array of the backtest
+BATCH_PRICES = 2_000_000
+
+# simulation settings of the worker processes, set by _init_worker
+_settings = None
+
+
+def gbm_paths(rng, n_paths, n_steps, price, ie_price, sigma, ie_sigma=None, rho=-1.0, mu=0.0, ie_mu=0.0):
+    """
+    Correlated geometric Brownian motions of the stock and the inverse equity
+
+    :param rng: random generator
+    :type rng: numpy.random.Generator
+    :param n_paths: number of paths
+    :type n_paths: int
+    :param n_steps: number of prices of each path, including the initial price
+    :type n_steps: int
+    :param price: initial stock price
+    :type price: float
+    :param ie_price: initial inverse equity price
+    :type ie_price: float
+    :param sigma: volatility of the stock log return per step
+    :type sigma: float
+    :param ie_sigma: volatility of the inverse equity log return per step, default to sigma
+    :type ie_sigma: float
+    :param rho: correlation of the log returns, -1 for a perfect inverse
+    :type rho: float
+    :param mu: drift of the stock log return per step
+    :type mu: float
+    :param ie_mu: drift of the inverse equity log return per step
+    :type ie_mu: float
+    :return: stock prices, inverse equity prices, both of shape (n_paths, n_steps)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    assert -1 <= rho <= 1, "Expect rho in [-1, 1] but got {}".format(rho)
+    ie_sigma = sigma if ie_sigma is None else ie_sigma
+    z = rng.standard_normal((n_paths, n_steps - 1))
+    ie_z = rho * z
+    if abs(rho) < 1:
+        ie_z += np.sqrt(1 - rho ** 2) * rng.standard_normal((n_paths, n_steps - 1))
+    prices = price * _cum_exp(mu - sigma ** 2 / 2 + sigma * z)
+    ie_prices = ie_price * _cum_exp(ie_mu - ie_sigma ** 2 / 2 + ie_sigma * ie_z)
+    return prices, ie_prices
+
+
+def bootstrap_paths(rng, n_paths, n_steps, history, ie_history, block=20, price=None, ie_price=None):
+    """
+    Resample blocks of historical log returns, the returns of the stock and the inverse equity are drawn together to
+    keep their correlation, the blocks keep the short term autocorrelation of the volatility
+
+    :param rng: random generator
+    :type rng: numpy.random.Generator
+    :param n_paths: number of paths
+    :type n_paths: int
+    :param n_steps: number of prices of each path, including the initial price
+    :type n_steps: int
+    :param history: historical stock prices
+    :type history: numpy.ndarray
+    :param ie_history: historical inverse equity prices at the same time
+    :type ie_history: numpy.ndarray
+    :param block: number of consecutive returns drawn together
+    :type block: int
+    :param price: initial stock price, default to the last historical price
+    :type price: float
+    :param ie_price: initial inverse equity price, default to the last historical price
+    :type ie_price: float
+    :return: stock prices, inverse equity prices, both of shape (n_paths, n_steps)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    returns = np.diff(np.log(np.asarray(history, dtype=np.float64)))
+    ie_returns = np.diff(np.log(np.asarray(ie_history, dtype=np.float64)))
+    assert returns.shape == ie_returns.shape, "Expect history and ie_history to have the same shape"
+    assert len(returns) >= block, "Expect at least {} historical returns but got {}".format(block, len(returns))
+    price = history[-1] if price is None else price
+    ie_price = ie_history[-1] if ie_price is None else ie_price
+
+    n_blocks = -(-(n_steps - 1) // block)
+    starts = rng.integers(0, len(returns) - block + 1, (n_paths, n_blocks))
+    indexes = (starts[..., None] + np.arange(block)).reshape(n_paths, -1)[:, :n_steps - 1]
+    return price * _cum_exp(returns[indexes]), ie_price * _cum_exp(ie_returns[indexes])
+
+
+def leveraged_paths(rng, n_paths, n_steps, price, ie_price, sigma, mu=0.0, leverage=2.0, ie_leverage=-2.0,
+                    steps_per_day=66):
+    """
+    Leveraged and inverse ETFs of the same index, reset daily
+
+    The index follows a geometric Brownian motion. Every ETF returns its leverage times the index return since the
+    previous close, so the ETFs decay against the index when it moves back and forth over days.
+
+    :param rng: random generator
+    :type rng: numpy.random.Generator
+    :param n_paths: number of paths
+    :type n_paths: int
+    :param n_steps: number of prices of each path, including the initial price
+    :type n_steps: int
+    :param price: initial price of the leveraged ETF
+    :type price: float
+    :param ie_price: initial price of the inverse ETF
+    :type ie_price: float
+    :param sigma: volatility of the index log return per step
+    :type sigma: float
+    :param mu: drift of the index log return per step
+    :type mu: float
+    :param leverage: daily leverage of the stock, e.g. 2 for HK.07226
+    :type leverage: float
+    :param ie_leverage: daily leverage of the inverse equity, e.g. -2 for HK.07552
+    :type ie_leverage: float
+    :param steps_per_day: number of steps of a trading day, e.g. 66 for 5 minute bars
+    :type steps_per_day: int
+    :return: stock prices, inverse equity prices, both of shape (n_paths, n_steps)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    index = _cum_exp(mu - sigma ** 2 / 2 + sigma * rng.standard_normal((n_paths, n_steps - 1)))
+
+    day = np.arange(n_steps) // steps_per_day
+    # the previous close of every step, the initial price for the first day
+    reference = np.maximum(day * steps_per_day - 1, 0)
+    intraday_return = index / index[:, reference] - 1
+    # index return of every completed day
+    closes = np.minimum((np.arange(day[-1]) + 1) * steps_per_day - 1, n_steps - 1)
+    daily_return = intraday_return[:, closes]
+
+    def etf(initial, lev):
+        # an ETF can not go below zero however far the index moves in a day
+        growth = np.maximum(1 + lev * daily_return, 0)
+        day_start = np.concatenate([np.ones((n_paths, 1)), np.cumprod(growth, axis=-1)], axis=-1)
+        return initial * day_start[:, day] * np.maximum(1 + lev * intraday_return, 0)
+
+    return etf(price, leverage), etf(ie_price, ie_leverage)
+
+
+MODELS = {"gbm": gbm_paths, "bootstrap": bootstrap_paths, "leveraged": leveraged_paths}
+
+
+def _cum_exp(log_returns):
+    """
+    Price relatives of paths starting from 1
+    """
+    relatives = np.empty((log_returns.shape[0], log_returns.shape[1] + 1))
+    relatives[:, 0] = 0
+    np.cumsum(log_returns, axis=-1, out=relatives[:, 1:])
+    return np.exp(relatives, out=relatives)
+
+
+def cal_path_metrics(strategy, prices, ie_prices, cash, **fee_kwargs):
+    """
+    Backtest a batch of paths and summarize every path
+
+    :param strategy: grid trading strategy
+    :type strategy: trade.strategy.GridTradingStrategy
+    :param prices: stock prices of shape (n_paths, n_steps)
+    :type prices: numpy.ndarray
+    :param ie_prices: inverse equity prices of the same shape
+    :type ie_prices: numpy.ndarray
+    :param cash: initial cash, the positions start from zero
+    :type cash: float
+    :param fee_kwargs: fee model, see trade.backtest.cal_fee
+    :return: metric name -> value of every path
+    :rtype: dict[str, numpy.ndarray]
+    """
+    result = backtest(strategy, prices, ie_prices, cash, **fee_kwargs)
+    traded_value = np.abs(result.order_quantity * prices).sum(axis=-1) + \
+        np.abs(result.ie_order_quantity * ie_prices).sum(axis=-1)
+    # below the lower limit or above the upper limit, the same as the strategy's grid index 0 and grid_count + 1
+    grids = strategy.grids
+    outside = (prices < grids[0]) | (prices >= grids[-1])
+    peak = np.maximum.accumulate(result.equity, axis=-1)
+    return {
+        'total_return': result.equity[:, -1] / cash - 1,
+        'max_capital_use': np.max(cash - result.cash, axis=-1) / cash,
+        'time_outside': outside.mean(axis=-1),
+        'turnover': traded_value / cash,
+        'max_drawdown': np.max(1 - result.equity / peak, axis=-1),
+        'order_count': np.count_nonzero(result.order_quantity, axis=-1) +
+                       np.count_nonzero(result.ie_order_quantity, axis=-1),
+    }
+
+
+def _init_worker(settings):
+    global _settings
+    _settings = settings
+
+
+def _run_batch(args):
+    seed, n_paths = args
+    s = _settings
+    rng = np.random.default_rng(seed)
+    prices, ie_prices = MODELS[s['model']](rng, n_paths, s['n_steps'], **s['model_params'])
+    strategy = GridTradingStrategy(**s['strategy_params'], lot_size=s['lot_size'], ie_lot_size=s['ie_lot_size'])
+    return cal_path_metrics(strategy, prices, ie_prices, s['cash'], **s['fee_kwargs'])
+
+
+def run_simulation(model, model_params, strategy_params, lot_size, ie_lot_size, cash, n_paths, n_steps,
+                   fee_kwargs=None, seed=None, batch_size=None, processes=None):
+    """
+    Backtest a strategy over synthetic price paths in batches, the batches run in a process pool
+
+    Every batch generates its own paths from a child of the seed, so the result only depends on the seed and the batch
+    size, not on the number of processes.
+
+    :param model: path model, one of MODELS
+    :type model: str
+    :param model_params: parameters of the path model, see the *_paths functions
+    :type model_params: dict
+    :param strategy_params: GridTradingStrategy parameters without the lot sizes
+    :type strategy_params: dict
+    :param lot_size: lot size
+    :type lot_size: int
+    :param ie_lot_size: inverse equity lot size
+    :type ie_lot_size: int
+    :param cash: initial cash, the positions start from zero
+    :type cash: float
+    :param n_paths: number of paths
+    :type n_paths: int
+    :param n_steps: number of prices of each path
+    :type n_steps: int
+    :param fee_kwargs: fee model, see trade.backtest.cal_fee
+    :type fee_kwargs: dict
+    :param seed: random seed, None for a random one
+    :type seed: int
+    :param batch_size: number of paths of a batch, default to BATCH_PRICES prices per batch
+    :type batch_size: int
+    :param processes: number of worker processes, default to the number of cores, 1 to run in this process
+    :type processes: int
+    :return: metric name -> value of every path
+    :rtype: dict[str, numpy.ndarray]
+    """
+    assert model in MODELS, "Expect model to be {} but got '{}'".format(list(MODELS), model)
+    assert n_steps >= 2, "Expect at least 2 steps but got {}".format(n_steps)
+    # fail early on invalid parameters instead of in every worker
+    GridTradingStrategy(**strategy_params, lot_size=lot_size, ie_lot_size=ie_lot_size)
+
+    batch_size = batch_size or max(1, BATCH_PRICES // n_steps)
+    sizes = [min(batch_size, n_paths - start) for start in range(0, n_paths, batch_size)]
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    settings = {'model': model, 'model_params': model_params, 'strategy_params': strategy_params,
+                'lot_size': lot_size, 'ie_lot_size': ie_lot_size, 'cash': cash, 'n_steps': n_steps,
+                'fee_kwargs': fee_kwargs or {}}
+
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        _init_worker(settings)
+        results = [_run_batch(task) for task in tasks]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(settings,)) as pool:
+            results = list(pool.imap(_run_batch, tasks))
+    return {name: np.concatenate([r[name] for r in results]) for name in METRIC_NAMES}
+
+
+def summarize(metrics, capital_use_limit=CAPITAL_USE_LIMIT):
+    """
+    Summarize the distribution of every metric over the paths
+
+    :param metrics: metric name -> value of every path
+    :type metrics: dict[str, numpy.ndarray]
+    :param capital_use_limit: capital use considered running out of cash
+    :type capital_use_limit: float
+    :return: one row per metric with the mean and the PERCENTILES, the share of paths over the capital use limit
+    :rtype: (list[dict], float)
+    """
+    rows = []
+    for name in METRIC_NAMES:
+        values = metrics[name]
+        row = {'metric': name, 'mean': float(values.mean())}
+        row.update({'p{}'.format(p): float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+        rows.append(row)
+    over_limit = float(np.mean(metrics['max_capital_use'] > capital_use_limit))
+    return rows, over_limit
+
+
+def format_summary(rows):
+    """
+    Format the summary rows as a text table
+
+    :param rows: rows of summarize
+    :type rows: list[dict]
+    :return: table
+    :rtype: str
+    """
+    return format_table(rows, ['metric', 'mean'] + ['p{}'.format(p) for p in PERCENTILES])
@@ -0,0 +1,371 @@
+import logging
+import threading
+from collections import namedtuple
+from time import monotonic
+
+from trade.broker_state import FILLED_ALL
+from trade.execution import FAILED_STATUSES
+
+logger = logging.getLogger("futu-grid-trading")
+
+# lower bound of the price range -> tick size, the spread table of the HKEX stocks
+HK_SPREAD_TABLE = [(0.01, 0.001), (0.25, 0.005), (0.5, 0.01), (10, 0.02), (20, 0.05), (100, 0.1), (200, 0.2),
+                   (500, 0.5), (1000, 1), (2000, 2), (5000, 5)]
+# seconds to work the order inside the spread before crossing it
+LIMIT_PATIENCE = 5
+# seconds to wait for a child order to be confirmed cancelled
+CANCEL_TIMEOUT = 5
+# max seconds between two checks of a child order without any book or order update
+WAKE_INTERVAL = 0.5
+
+# bids and asks are lists of (price, quantity) from the best level
+OrderBook = namedtuple('OrderBook', ['bids', 'asks'])
+
+
+def tick_size(price):
+    """
+    :param price: price
+    :type price: float
+    :return: tick size at the price in the HKEX spread table
+    :rtype: float
+    """
+    size = HK_SPREAD_TABLE[0][1]
+    for lower, tick in HK_SPREAD_TABLE:
+        if price < lower:
+            break
+        size = tick
+    return size
+
+
+def book_tick_size(book):
+    """
+    :param book: order book
+    :type book: OrderBook
+    :return: smallest price step between the levels of the book, the tick size of the spread table if the book has
+        one level per side only
+    :rtype: float
+    """
+    steps = [round(abs(b[0] - a[0]), 6) for levels in (book.bids, book.asks) for a, b in zip(levels, levels[1:])]
+    steps = [step for step in steps if step > 0]
+    if steps:
+        return min(steps)
+    return tick_size(book.bids[0][0] if book.bids else book.asks[0][0])
+
+
+def child_order(book, trade_side, quantity, lot_size, aggressive, depth_fraction=1.0):
+    """
+    Price and size the next child order of a limit execution
+
+    A passive child improves the touch by one tick when the spread is wider than one tick and joins it otherwise, the
+    tick size is taken from the book since the ETFs are quoted finer than the spread table of the stocks. An
+    aggressive child takes the opposite touch. Either way the child is at most depth_fraction of the quantity displayed
+    at the opposite touch, at least one lot, so it never walks the book.
+
+    :param book: order book of the symbol
+    :type book: OrderBook
+    :param trade_side: ['BUY', 'SELL']
+    :type trade_side: str
+    :param quantity: quantity left to fill
+    :type quantity: int
+    :param lot_size: lot size
+    :type lot_size: int
+    :param aggressive: cross the spread
+    :type aggressive: bool
+    :param depth_fraction: max fraction of the displayed depth per child
+    :type depth_fraction: float
+    :return: price and quantity of the child order, None if the book is one-sided
+    :rtype: (float, int) or None
+    """
+    if not book.bids or not book.asks:
+        return None
+    (bid, bid_qty), (ask, ask_qty) = book.bids[0], book.asks[0]
+    tick = book_tick_size(book)
+    if trade_side == "BUY":
+        displayed = ask_qty
+        if aggressive:
+            price = ask
+        else:
+            price = bid + tick if ask - bid > tick * 1.5 else bid
+    else:
+        displayed = bid_qty
+        if aggressive:
+            price = bid
+        else:
+            price = ask - tick if ask - bid > tick * 1.5 else ask
+    size = max(int(displayed * depth_fraction) // lot_size, 1) * lot_size
+    return round(price, 3), min(quantity, size)
+
+
+def is_outpriced(book, trade_side, price, aggressive):
+    """
+    Check if a resting child order is to be repriced, i.e. the touch moved past it, or it is to cross the spread but
+    does not
+
+    The child order itself may be the touch, so it is never repriced to improve on its own price.
+
+    :param book: order book of the symbol
+    :type book: OrderBook
+    :param trade_side: ['BUY', 'SELL']
+    :type trade_side: str
+    :param price: price of the child order
+    :type price: float
+    :param aggressive: the child order is to cross the spread
+    :type aggressive: bool
+    :return: if the child order is to be cancelled and placed again
+    :rtype: bool
+    """
+    if not book.bids or not book.asks:
+        return False
+    bid, ask = book.bids[0][0], book.asks[0][0]
+    if trade_side == "BUY":
+        return (ask if aggressive else bid) > price + 1e-9
+    return (bid if aggressive else ask) < price - 1e-9
+
+
+class OrderBookCache:
+    """
+    Latest order book of every subscribed symbol, kept current by the order book push
+
+    All methods are thread safe since the push is received in the futu push thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # code -> OrderBook
+        self._books = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Call the callback with (code, book) whenever a book is updated
+
+        :param callback: function called outside the lock
+        :type callback: callable
+        """
+        self._listeners.append(callback)
+
+    def update(self, code, bids, asks):
+        """
+        :param code: stock stick
+        :type code: str
+        :param bids: (price, quantity) from the best bid
+        :type bids: list[(float, int)]
+        :param asks: (price, quantity) from the best ask
+        :type asks: list[(float, int)]
+        """
+        book = OrderBook(list(bids), list(asks))
+        with self._lock:
+            self._books[code] = book
+        for callback in self._listeners:
+            callback(code, book)
+
+    def get(self, code):
+        """
+        :param code: stock stick
+        :type code: str
+        :return: latest book, None if no book is received yet
+        :rtype: OrderBook or None
+        """
+        with self._lock:
+            return self._books.get(code)
+
+
+class LimitExecution:
+    """
+    Fill an order with limit orders priced off the cached order book instead of one market order
+
+    The order is worked as child orders sized against the displayed depth. A child rests inside or at the touch for the
+    patience seconds, then crosses the spread, and is cancelled and placed again whenever the touch moves past it.
+    The book comes from the push, so no quote is requested per order. It is called like the place_order function of
+    OrderExecutor and returns once the order is filled all or the timeout is over, with None so that the executor has
+    nothing to wait for. An order not filled all in time is not an error, the shortfall is logged and left to the next
+    rebalance, which sees the positions of the fills.
+    """
+
+    def __init__(self, books, broker_state, place_order, cancel_order, lot_size, patience=LIMIT_PATIENCE, timeout=30,
+                 depth_fraction=1.0, throttle=None, clock=monotonic):
+        """
+
+        :param books: order books kept current by the push
+        :type books: OrderBookCache
+        :param broker_state: broker state receiving the trade order push
+        :type broker_state: trade.broker_state.BrokerState
+        :param place_order: function called with (symbol, quantity, price, trade_side) returning the order id, or None
+            if no order is placed (e.g. dry run)
+        :type place_order: callable
+        :param cancel_order: function called with the order id to cancel an order
+        :type cancel_order: callable
+        :param lot_size: function called with the symbol returning the lot size
+        :type lot_size: callable
+        :param patience: seconds before crossing the spread
+        :type patience: float
+        :param timeout: seconds to fill the order before cancelling the child order left
+        :type timeout: float
+        :param depth_fraction: max fraction of the displayed depth per child order
+        :type depth_fraction: float
+        :param throttle: rate limiter acquired before placing every child order until the timeout, None for no limit
+        :type throttle: trade.ratelimit.RateLimiter
+        :param clock: clock of the patience and the timeout
+        :type clock: callable
+        """
+        self.books = books
+        self.broker_state = broker_state
+        self.place_order = place_order
+        self.cancel_order = cancel_order
+        self.lot_size = lot_size
+        self.patience = patience
+        self.timeout = timeout
+        self.depth_fraction = depth_fraction
+        self.throttle = throttle
+        self.clock = clock
+
+        self._changed = threading.Condition()
+        # bumped on every book or order update, so that no update is missed between a check and a wait
+        self._version = 0
+        books.add_listener(self._notify)
+        broker_state.add_listener(self._notify)
+
+    def __call__(self, symbol, quantity, trade_side):
+        """
+        Fill an order with child limit orders
+
+        :param symbol: a single stock stick, e.g. 'HK.07266'
+        :type symbol: str
+        :param quantity: order quantity
+        :type quantity: int
+        :param trade_side: ['BUY', 'SELL']
+        :type trade_side: str
+        :return: None once the order is filled all or the timeout is over
+        :rtype: None
+        """
+        self.execute(symbol, quantity, trade_side)
+        return None
+
+    def execute(self, symbol, quantity, trade_side):
+        """
+        Fill an order with child limit orders until it is filled all or the timeout is over
+
+        :param symbol: a single stock stick, e.g. 'HK.07266'
+        :type symbol: str
+        :param quantity: order quantity
+        :type quantity: int
+        :param trade_side: ['BUY', 'SELL']
+        :type trade_side: str
+        :return: filled quantity
+        :rtype: int
+        """
+        assert quantity > 0
+        lot_size = self.lot_size(symbol)
+        start = self.clock()
+        deadline = start + self.timeout
+        remaining = quantity
+        while remaining > 0:
+            version = self._version
+            book = self.books.get(symbol)
+            child = None if book is None else child_order(book, trade_side, remaining, lot_size,
+                                                          self.clock() - start >= self.patience, self.depth_fraction)
+            if child is None:
+                if self.clock() >= deadline:
+                    logger.warning(f"No order book of {symbol} to place the order, {remaining} of {quantity} not "
+                                   f"filled, left to the next rebalance")
+                    break
+                self._wait(version)
+                continue
+
+            price, size = child
+            if self.throttle is not None and not self._acquire(deadline):
+                logger.warning(f"Order rate limit reached until the deadline, {remaining} of {quantity} of {symbol} "
+                               f"not filled, left to the next rebalance")
+                break
+            order_id = self.place_order(symbol, size, price, trade_side)
+            if order_id is None:
+                remaining -= size
+                continue
+            filled, finished = self._work(str(order_id), symbol, trade_side, price, size, start, deadline)
+            remaining -= filled
+            if not finished:
+                # another child could fill together with the live one
+                logger.warning(f"Order '{order_id}' of {symbol} may still be live, {remaining} of {quantity} not "
+                               f"filled, left to the next rebalance")
+                break
+            if self.clock() >= deadline and remaining > 0:
+                logger.warning(f"Order of {symbol} is not filled all after {self.timeout} seconds, {remaining} of "
+                               f"{quantity} not filled, left to the next rebalance")
+                break
+        return quantity - remaining
+
+    def _work(self, order_id, symbol, trade_side, price, size, start, deadline):
+        """
+        Wait for a child order to be filled all, cancel it when it is outpriced or on the deadline
+
+        :return: quantity filled by the child order, if the child order is finished, i.e. not confirmed cancelled
+            otherwise
+        :rtype: (int, bool)
+        """
+        cancelled_at = None
+        while 1:
+            version = self._version
+            order = self.broker_state.get_order(order_id)
+            status = order['order_status'] if order else None
+            # the positions are current once the deals of the order are received too
+            settled = order is not None and self.broker_state.get_deal_qty(order_id) >= order['dealt_qty']
+            if status == FILLED_ALL and settled:
+                return size, True
+            if status in FAILED_STATUSES and settled:
+                if cancelled_at is None:
+                    raise ValueError("Order '{}' is not filled all, status={}".format(order_id, status))
+                # the remainder is placed again at the new price
+                return order['dealt_qty'], True
+
+            now = self.clock()
+            if status == FILLED_ALL or status in FAILED_STATUSES:
+                if now >= deadline + CANCEL_TIMEOUT:
+                    logger.warning("Deals of order '%s' not received, positions may lag", order_id)
+                    return order['dealt_qty'], True
+            elif cancelled_at is None:
+                book = self.books.get(symbol)
+                if now >= deadline or (book is not None and is_outpriced(book, trade_side, price,
+                                                                         now - start >= self.patience)):
+                    logger.debug("Cancelling order '%s' at %s to reprice", order_id, price)
+                    cancelled_at = now
+                    try:
+                        self.cancel_order(order_id)
+                    except ValueError:
+                        # e.g. filled meanwhile, the push tells
+                        logger.debug("Unable to cancel order '%s'", order_id, exc_info=True)
+            elif now - cancelled_at >= CANCEL_TIMEOUT:
+                # a late fill shows up in the positions, the next rebalance or reconciliation accounts for it
+                logger.warning(f"Order '{order_id}' is not confirmed cancelled after {CANCEL_TIMEOUT} seconds")
+                return (order['dealt_qty'] if order else 0), False
+            self._wait(version)
+
+    @property
+    def max_duration(self):
+        """
+        :return: max seconds of an execution: the timeout, in which the throttle is waited for, then the cancel of the
+            last child order, each noticed within WAKE_INTERVAL
+        :rtype: float
+        """
+        return self.timeout + CANCEL_TIMEOUT + 2 * WAKE_INTERVAL
+
+    def _acquire(self, deadline):
+        """
+        Wait for the throttle until the deadline
+
+        :return: if the throttle is acquired
+        :rtype: bool
+        """
+        while not self.throttle.try_acquire():
+            if self.clock() >= deadline:
+                return False
+            self._wait(self._version)
+        return True
+
+    def _notify(self, *args):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def _wait(self, version):
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, WAKE_INTERVAL)
@@ -0,0 +1,324 @@
+import fnmatch
+import logging
+import os
+import signal
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from time import monotonic, sleep
+
+logger = logging.getLogger("futu-grid-trading")
+
+# seconds of a CPU profile if the trigger does not tell
+CPU_PROFILE_SECONDS = 30
+SAMPLE_INTERVAL = 0.005
+# the files whose allocation sites are reported, besides the top allocation sites of the whole process
+MEMORY_SITE_PATTERNS = ["*/trade/api.py", "*/trade/strategy.py"]
+MEMORY_TOP = 10
+# frames kept per allocation, enough to reach trade/api.py from inside pandas
+MEMORY_FRAMES = 32
+# touch these files in the trigger directory instead of sending the signals
+CPU_TRIGGER = "cpu"
+MEMORY_TRIGGER = "memory"
+MEMORY_STOP_TRIGGER = "memory-stop"
+TRIGGER_INTERVAL = 1
+
+
+def _timestamp():
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of all threads from a background thread and write them as collapsed stacks, one
+    "thread;file:function;... count" line per stack, the input of flamegraph.pl and speedscope
+
+    Nothing runs between the profiles. While profiling, the traded threads are only interrupted for as long as it takes
+    to copy their frames.
+    """
+
+    def __init__(self, directory, interval=SAMPLE_INTERVAL):
+        """
+
+        :param directory: directory of the profiles
+        :type directory: str or Path
+        :param interval: seconds between the samples
+        :type interval: float
+        """
+        self.directory = Path(directory)
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._labels = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def toggle(self, seconds=CPU_PROFILE_SECONDS):
+        """
+        Start a profile of the given seconds, or stop the running profile early
+
+        :param seconds: duration of the profile
+        :type seconds: float
+        """
+        if self.running:
+            self._stop.set()
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="cpu-profiler", daemon=True)
+        self._thread.start()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+        return label
+
+    def _run(self, seconds):
+        logger.info("CPU profiling for %s seconds", seconds)
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = monotonic() + seconds
+        while not self._stop.wait(self.interval) and monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / "cpu-{}.collapsed".format(_timestamp())
+        with open(path, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write("{} {}\n".format(stack, count))
+        logger.info("CPU profile of %s samples written to %s", samples, path)
+
+
+def _sizes_by_site(snapshot, patterns):
+    """
+    Sum the traced sizes by the most recent frame matching each pattern
+
+    :return: pattern -> (filename, lineno) -> (size, count)
+    :rtype: dict
+    """
+    sites = {pattern: {} for pattern in patterns}
+    matches = {}
+    # grouped by traceback in C first, far fewer than the traces
+    for stat in snapshot.statistics('traceback'):
+        found = set()
+        # the frames are sorted from the oldest to the most recent
+        for frame in reversed(stat.traceback):
+            pattern = matches.get(frame.filename, False)
+            if pattern is False:
+                pattern = matches[frame.filename] = next(
+                    (p for p in patterns if fnmatch.fnmatch(frame.filename, p)), None)
+            if pattern is None or pattern in found:
+                continue
+            found.add(pattern)
+            site = (frame.filename, frame.lineno)
+            size, count = sites[pattern].get(site, (0, 0))
+            sites[pattern][site] = (size + stat.size, count + stat.count)
+    return sites
+
+
+class MemoryProfiler:
+    """
+    Diff tracemalloc snapshots to find what keeps growing
+
+    tracemalloc is only started by the first snapshot, which becomes the baseline. Every following snapshot is compared
+    with the previous one and the largest growths are reported, for the whole process and by the lines of
+    MEMORY_SITE_PATTERNS which led to the allocations, e.g. the OpenD calls of trade/api.py returning data frames.
+    """
+
+    def __init__(self, directory, patterns=None, top=MEMORY_TOP, frames=MEMORY_FRAMES):
+        """
+
+        :param directory: directory of the reports
+        :type directory: str or Path
+        :param patterns: file name patterns of the reported allocation sites
+        :type patterns: list[str]
+        :param top: number of sites reported per section
+        :type top: int
+        :param frames: frames kept per allocation
+        :type frames: int
+        """
+        self.directory = Path(directory)
+        self.patterns = MEMORY_SITE_PATTERNS if patterns is None else patterns
+        self.top = top
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Take a snapshot and write the diff against the previous one
+
+        :return: report file, None for the baseline
+        :rtype: Path or None
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = self._take()
+                logger.info("Memory tracing started, the next snapshot is compared with this one")
+                return None
+
+            current = self._take()
+            lines = self._report(current, self._previous)
+            self._previous = current
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / "memory-{}.txt".format(_timestamp())
+        path.write_text("\n".join(lines) + "\n")
+        logger.info("Memory diff written to %s\n%s", path, "\n".join(lines[:self.top + 2]))
+        return path
+
+    def stop(self):
+        """
+        Stop tracing and forget the snapshots
+        """
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                logger.info("Memory tracing stopped")
+            self._previous = None
+
+    @staticmethod
+    def _take():
+        # filter_traces runs in Python over every trace, the allocations of tracemalloc itself are left in instead
+        return tracemalloc.take_snapshot()
+
+    def _report(self, current, previous):
+        traced, peak = tracemalloc.get_traced_memory()
+        lines = ["traced {:.1f} MiB, peak {:.1f} MiB".format(traced / 2 ** 20, peak / 2 ** 20),
+                 "top growth of the process:"]
+        for stat in current.compare_to(previous, 'lineno')[:self.top]:
+            lines.append("  {}".format(stat))
+
+        current_sites = _sizes_by_site(current, self.patterns)
+        previous_sites = _sizes_by_site(previous, self.patterns)
+        for pattern in self.patterns:
+            now, before = current_sites[pattern], previous_sites[pattern]
+            diffs = []
+            for site in set(now) | set(before):
+                size, count = now.get(site, (0, 0))
+                old_size, old_count = before.get(site, (0, 0))
+                diffs.append((size - old_size, size, count - old_count, site))
+            diffs.sort(key=lambda d: (abs(d[0]), d[1]), reverse=True)
+            lines.append("top growth by the lines of {}:".format(pattern))
+            for size_diff, size, count_diff, (filename, lineno) in diffs[:self.top]:
+                lines.append("  {}:{}: size={:.1f} KiB ({:+.1f} KiB), count={:+d}".format(
+                    filename, lineno, size / 1024, size_diff / 1024, count_diff))
+        return lines
+
+
+class Profiler:
+    """
+    Profile the live process on demand, by signals or by trigger files
+
+    SIGUSR1 starts a CPU profile of CPU_PROFILE_SECONDS, or stops the running one. SIGUSR2 takes a memory snapshot.
+    Touching the files CPU_TRIGGER, MEMORY_TRIGGER or MEMORY_STOP_TRIGGER in the trigger directory does the same, e.g.
+    `echo 60 > cpu` for a CPU profile of 60 seconds. The signal handlers only flag the request, which is handled with
+    the trigger files by the profile-triggers thread, so the profiles are written in the background while trading goes
+    on.
+    """
+
+    def __init__(self, directory, cpu_seconds=CPU_PROFILE_SECONDS):
+        """
+
+        :param directory: directory of the trigger files and the profiles
+        :type directory: str or Path
+        :param cpu_seconds: default duration of a CPU profile
+        :type cpu_seconds: float
+        """
+        self.directory = Path(directory)
+        self.cpu_seconds = cpu_seconds
+        self.cpu = SamplingProfiler(self.directory)
+        self.memory = MemoryProfiler(self.directory)
+        self._watcher = None
+        self._triggers = False
+        # set by the signal handlers, reset by the profile-triggers thread
+        self._cpu_signaled = False
+        self._memory_signaled = False
+
+    def install(self, signals=True, triggers=True):
+        """
+        Install the signal handlers, only possible in the main thread, and watch the trigger files
+
+        :param signals: handle SIGUSR1 and SIGUSR2
+        :type signals: bool
+        :param triggers: watch the trigger directory
+        :type triggers: bool
+        """
+        signals = signals and threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGUSR1")
+        if signals:
+            signal.signal(signal.SIGUSR1, self._on_signal)
+            signal.signal(signal.SIGUSR2, self._on_signal)
+        if triggers:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._triggers = True
+        if signals or triggers:
+            self._watcher = threading.Thread(target=self._watch, name="profile-triggers", daemon=True)
+            self._watcher.start()
+
+    def _on_signal(self, signum, frame):
+        # a signal handler runs in the main thread between two bytecodes, it must neither block nor start threads
+        if signum == signal.SIGUSR1:
+            self._cpu_signaled = True
+        else:
+            self._memory_signaled = True
+
+    def check_signals(self):
+        """
+        Handle the signals received since the last check
+        """
+        if self._cpu_signaled:
+            self._cpu_signaled = False
+            self.cpu.toggle(self.cpu_seconds)
+        if self._memory_signaled:
+            self._memory_signaled = False
+            self.memory.snapshot()
+
+    def check_triggers(self):
+        """
+        Handle the trigger files present and remove them
+        """
+        for name in (CPU_TRIGGER, MEMORY_TRIGGER, MEMORY_STOP_TRIGGER):
+            path = self.directory / name
+            try:
+                content = path.read_text().strip()
+                path.unlink()
+            except OSError:
+                continue
+            if name == CPU_TRIGGER:
+                try:
+                    seconds = float(content) if content else self.cpu_seconds
+                except ValueError:
+                    logger.error("Expect the seconds of the CPU profile in %s but got '%s'", path, content)
+                    continue
+                self.cpu.toggle(seconds)
+            elif name == MEMORY_TRIGGER:
+                self.memory.snapshot()
+            else:
+                self.memory.stop()
+
+    def _watch(self):
+        while 1:
+            try:
+                self.check_signals()
+                if self._triggers:
+                    self.check_triggers()
+            except Exception:
+                logger.exception("Unable to handle the profile triggers")
+            sleep(TRIGGER_INTERVAL)
@@ -0,0 +1,127 @@
+import logging
+
+from futu import RET_OK, StockQuoteHandlerBase, OrderBookHandlerBase, TradeOrderHandlerBase, TradeDealHandlerBase
+
+logger = logging.getLogger("futu-grid-trading")
+
+
+class QuotePushHandler(StockQuoteHandlerBase):
+    """
+    Forward the pushed real-time quotes to a callback
+
+    The callback is called from the futu push thread with (symbol, price), keep it short, e.g. put the quote into a
+    queue and process it in the main thread.
+    """
+
+    def __init__(self, callback):
+        """
+
+        :param callback: function called with (symbol, price) for every pushed quote
+        :type callback: callable
+        """
+        super().__init__()
+        self.callback = callback
+
+    def on_recv_rsp(self, rsp_pb):
+        ret, data = super().on_recv_rsp(rsp_pb)
+        if ret != RET_OK:
+            logger.error("Unable to receive quote push, error={}".format(data))
+            return ret, data
+
+        self.handle_quote(data)
+        return ret, data
+
+    def handle_quote(self, data):
+        """
+        Dispatch the quotes to the callback
+
+        :param data: quote data frame with columns 'code' and 'last_price'
+        :type data: pandas.DataFrame
+        """
+        for symbol, price in zip(data['code'], data['last_price']):
+            self.callback(str(symbol), float(price))
+
+
+class OrderBookPushHandler(OrderBookHandlerBase):
+    """
+    Forward the pushed order books to a callback
+
+    The callback is called from the futu push thread with (symbol, bids, asks), where bids and asks are lists of
+    (price, quantity) from the best level.
+    """
+
+    def __init__(self, callback):
+        """
+
+        :param callback: function called with (symbol, bids, asks) for every pushed order book
+        :type callback: callable
+        """
+        super().__init__()
+        self.callback = callback
+
+    def on_recv_rsp(self, rsp_pb):
+        ret, data = super().on_recv_rsp(rsp_pb)
+        if ret != RET_OK:
+            logger.error("Unable to receive order book push, error={}".format(data))
+            return ret, data
+
+        self.handle_order_book(data)
+        return ret, data
+
+    def handle_order_book(self, data):
+        """
+        Dispatch the order book to the callback
+
+        :param data: order book dict with 'code', 'Bid' and 'Ask', every level a tuple starting with price and volume
+        :type data: dict
+        """
+        self.callback(str(data['code']), [(float(level[0]), int(level[1])) for level in data['Bid']],
+                      [(float(level[0]), int(level[1])) for level in data['Ask']])
+
+
+class TradeOrderPushHandler(TradeOrderHandlerBase):
+    """
+    Forward the pushed order updates to a callback
+    """
+
+    def __init__(self, callback):
+        """
+
+        :param callback: function called with the order data frame
+        :type callback: callable
+        """
+        super().__init__()
+        self.callback = callback
+
+    def on_recv_rsp(self, rsp_pb):
+        ret, data = super().on_recv_rsp(rsp_pb)
+        if ret != RET_OK:
+            logger.error("Unable to receive order push, error={}".format(data))
+            return ret, data
+
+        self.callback(data)
+        return ret, data
+
+
+class TradeDealPushHandler(TradeDealHandlerBase):
+    """
+    Forward the pushed deals to a callback
+    """
+
+    def __init__(self, callback):
+        """
+
+        :param callback: function called with the deal data frame
+        :type callback: callable
+        """
+        super().__init__()
+        self.callback = callback
+
+    def on_recv_rsp(self, rsp_pb):
+        ret, data = super().on_recv_rsp(rsp_pb)
+        if ret != RET_OK:
+            logger.error("Unable to receive deal push, error={}".format(data))
+            return ret, data
+
+        self.callback(data)
+        return ret, data
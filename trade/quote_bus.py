@@ -0,0 +1,179 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# a slot of the ring, seq is negative while the slot is being written
+TICK_DTYPE = np.dtype([
+    ('seq', '<i8'),
+    ('code_id', '<i8'),
+    ('price', '<f8'),
+    ('time', '<i8'),  # epoch nanoseconds
+])
+HEADER_DTYPE = np.dtype([
+    ('write_seq', '<i8'),  # seq of the last complete tick, 0 if none
+    ('capacity', '<i8'),
+])
+# the slots start on a cache line of their own
+HEADER_SIZE = 64
+DEFAULT_CAPACITY = 65536
+# seconds between the checks of a waiting reader
+POLL_INTERVAL = 0.0005
+
+
+class QuoteBus:
+    """
+    Ring buffer of ticks in shared memory, written by one process and read by any number of processes
+
+    The writer never waits for the readers. Every slot carries the sequence number of its tick, which is set to the
+    negative number while the slot is written, so a reader detects the slots overwritten while it was reading them and
+    the ticks it missed by falling more than the capacity behind. The readers take no lock and read the slots straight
+    from the shared memory. This relies on the stores of aligned 8 byte fields not being reordered, which holds on
+    x86-64.
+    """
+
+    def __init__(self, codes, capacity=DEFAULT_CAPACITY, name=None):
+        """
+        Create a bus, or attach to the bus of the given name
+
+        :param codes: stock codes published on the bus, the code id of a tick is the index of its code, the same list
+            for the writer and the readers
+        :type codes: list[str]
+        :param capacity: number of slots of a new bus
+        :type capacity: int
+        :param name: name of an existing bus to attach to, None to create a new one
+        :type name: str
+        """
+        self.codes = list(codes)
+        self.code_ids = {code: i for i, code in enumerate(self.codes)}
+        self.owner = name is None
+        if self.owner:
+            assert capacity > 0
+            self._shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * TICK_DTYPE.itemsize)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        if self.owner:
+            self._header['write_seq'] = 0
+            self._header['capacity'] = capacity
+        self.capacity = int(self._header['capacity'][0])
+        self._slots = np.ndarray((self.capacity,), dtype=TICK_DTYPE, buffer=self._shm.buf, offset=HEADER_SIZE)
+        self._write_seq = self._header['write_seq']
+        self._slot_seq = self._slots['seq']
+        self._slot_code_id = self._slots['code_id']
+        self._slot_price = self._slots['price']
+        self._slot_time = self._slots['time']
+
+    @property
+    def name(self):
+        """
+        :return: name of the shared memory, to attach to the bus from another process
+        :rtype: str
+        """
+        return self._shm.name
+
+    @property
+    def write_seq(self):
+        """
+        :return: sequence number of the last tick published, 0 if none
+        :rtype: int
+        """
+        return int(self._write_seq[0])
+
+    def publish(self, code, price, time_ns=None):
+        """
+        Publish a tick, only the creator of the bus may publish
+
+        :param code: stock code, one of the codes of the bus
+        :type code: str
+        :param price: price
+        :type price: float
+        :param time_ns: epoch nanoseconds of the tick, default to now
+        :type time_ns: int
+        """
+        seq = int(self._write_seq[0]) + 1
+        i = seq % self.capacity
+        self._slot_seq[i] = -seq
+        self._slot_code_id[i] = self.code_ids[code]
+        self._slot_price[i] = price
+        self._slot_time[i] = time.time_ns() if time_ns is None else time_ns
+        self._slot_seq[i] = seq
+        self._write_seq[0] = seq
+
+    def close(self):
+        """
+        Detach from the shared memory, the creator also frees it, closing again does nothing
+        """
+        if self._header is None:
+            return
+        self._header = self._slots = self._write_seq = None
+        self._slot_seq = self._slot_code_id = self._slot_price = self._slot_time = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+class QuoteReader:
+    """
+    Cursor of one reader over a quote bus
+    """
+
+    def __init__(self, bus, from_start=False):
+        """
+
+        :param bus: bus to read
+        :type bus: QuoteBus
+        :param from_start: read the ticks still in the ring, otherwise only the ticks published from now on
+        :type from_start: bool
+        """
+        self.bus = bus
+        self.cursor = max(bus.write_seq - bus.capacity, 0) if from_start else bus.write_seq
+        # number of ticks missed since the reader fell behind more than the capacity
+        self.dropped = 0
+
+    def read(self, timeout=0):
+        """
+        Read the ticks published since the last read
+
+        :param timeout: seconds to wait for a tick if none is published yet
+        :type timeout: float
+        :return: ticks of TICK_DTYPE in publishing order, empty if none
+        :rtype: numpy.ndarray
+        """
+        bus = self.bus
+        write_seq = bus.write_seq
+        if write_seq == self.cursor and timeout > 0:
+            deadline = time.monotonic() + timeout
+            while write_seq == self.cursor and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                write_seq = bus.write_seq
+        if write_seq == self.cursor:
+            return np.empty(0, dtype=TICK_DTYPE)
+
+        start = self.cursor + 1
+        if write_seq - start >= bus.capacity:
+            self.dropped += write_seq - bus.capacity + 1 - start
+            start = write_seq - bus.capacity + 1
+        expected = np.arange(start, write_seq + 1)
+        indexes = expected % bus.capacity
+
+        seq_before = bus._slot_seq[indexes]
+        ticks = bus._slots[indexes]
+        seq_after = bus._slot_seq[indexes]
+        # the writer overwrites the oldest slots first, so the invalid ticks are at the front
+        invalid = np.flatnonzero((seq_before != expected) | (seq_after != expected))
+        if len(invalid):
+            self.dropped += int(invalid[-1]) + 1
+            ticks = ticks[invalid[-1] + 1:]
+        self.cursor = write_seq
+        return ticks
+
+    def latest_prices(self, ticks):
+        """
+        :param ticks: ticks read from the bus
+        :type ticks: numpy.ndarray
+        :return: code -> the last price of the ticks
+        :rtype: dict[str, float]
+        """
+        codes = self.bus.codes
+        return {codes[code_id]: price for code_id, price in zip(ticks['code_id'].tolist(), ticks['price'].tolist())}
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Sliding window limiting the calls to at most `count` in any `period` seconds
+
+    The times of the last `count` calls are kept, a call is allowed once the oldest of them is `period` seconds old, so
+    no window of `period` seconds ever holds more than `count` calls, e.g. the 15 place_order per 30 seconds of Futu.
+    The waiting callers are served one at a time so that the calls of different strategies are spread over the period.
+    """
+
+    def __init__(self, count, period, clock=time.monotonic, sleep=time.sleep):
+        """
+
+        :param count: max number of calls per period, e.g. 15 orders per 30 seconds for Futu place_order
+        :type count: int
+        :param period: seconds
+        :type period: float
+        :param clock: function returning the current time in seconds, e.g. the market time of a replay
+        :type clock: callable
+        :param sleep: function sleeping for the given seconds of the clock
+        :type sleep: callable
+        """
+        assert count > 0, "Expect count to be positive but got {}".format(count)
+        assert period > 0, "Expect period to be positive but got {}".format(period)
+        self.count = count
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+
+        # times of the last count calls, the oldest first
+        self._calls = deque(maxlen=count)
+        self._lock = threading.Lock()
+
+    def _delay(self, now):
+        """
+        :return: seconds until a call is allowed, 0 if allowed now
+        :rtype: float
+        """
+        if len(self._calls) < self.count:
+            return 0.0
+        return max(self._calls[0] + self.period - now, 0.0)
+
+    def try_acquire(self):
+        """
+        Record a call if allowed now
+
+        :return: if the call is allowed
+        :rtype: bool
+        """
+        with self._lock:
+            now = self.clock()
+            if self._delay(now) > 0:
+                return False
+            self._calls.append(now)
+            return True
+
+    def acquire(self):
+        """
+        Record a call, wait until it is allowed if the window is full
+
+        :return: seconds waited in clock time
+        :rtype: float
+        """
+        waited = 0.0
+        # the lock is held while waiting so that the waiting callers are allowed one by one
+        with self._lock:
+            now = self.clock()
+            delay = self._delay(now)
+            while delay > 0:
+                self.sleep(delay)
+                waited += delay
+                now = self.clock()
+                delay = self._delay(now)
+            self._calls.append(now)
+        return waited
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+import pandas as pd
+from futu import RET_OK
+
+from trade.push import QuotePushHandler, TradeOrderPushHandler, TradeDealPushHandler
+
+# context methods whose results are recorded
+RECORDED_METHODS = {"get_market_snapshot", "get_global_state", "get_stock_basicinfo", "position_list_query",
+                    "order_list_query", "place_order", "modify_order"}
+# only these columns of the wide data frames are recorded
+RECORDED_COLUMNS = {"get_market_snapshot": ["code", "update_time", "last_price"]}
+
+
+class Recorder:
+    """
+    Append-only log of the OpenD responses and quote push, one compact JSON object per line
+
+    Every line is {"t": epoch seconds, "m": method or event, "d": data}, data frames are stored as a list of records.
+    """
+
+    def __init__(self, path):
+        """
+
+        :param path: log file, appended if exists
+        :type path: str
+        """
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def record(self, method, data):
+        """
+        Append a record
+
+        :param method: context method or event name, e.g. 'get_market_snapshot', 'quote'
+        :type method: str
+        :param data: data frame, dict or any JSON serializable value
+        """
+        if isinstance(data, pd.DataFrame):
+            data = data.to_dict('records')
+        line = json.dumps({"t": time.time(), "m": method, "d": data}, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_records(path):
+    """
+    Read the records of a recording
+
+    :param path: log file
+    :type path: str
+    :return: records in recording order
+    :rtype: list[dict]
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class RecordingContext:
+    """
+    Wrap a quote or trade context and record the successful responses of RECORDED_METHODS and the quote push
+    """
+
+    def __init__(self, ctx, recorder):
+        """
+
+        :param ctx: futu context, e.g. OpenQuoteContext
+        :param recorder: recorder
+        :type recorder: Recorder
+        """
+        self._ctx = ctx
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._ctx, name)
+        if name not in RECORDED_METHODS:
+            return attr
+
+        def recorded(*args, **kwargs):
+            ret = attr(*args, **kwargs)
+            if ret[0] == RET_OK:
+                data = ret[1]
+                if name in RECORDED_COLUMNS:
+                    data = data[RECORDED_COLUMNS[name]]
+                self._recorder.record(name, data)
+            return ret
+
+        return recorded
+
+    def set_handler(self, handler):
+        # the handlers are set again on the contexts reopened after a reconnection, record them only once
+        if getattr(handler, 'recorded', False):
+            return self._ctx.set_handler(handler)
+        handler.recorded = True
+        if isinstance(handler, QuotePushHandler):
+            callback = handler.callback
+
+            def recorded(symbol, price):
+                self._recorder.record("quote", {"code": symbol, "last_price": price})
+                callback(symbol, price)
+
+            handler.callback = recorded
+        elif isinstance(handler, (TradeOrderPushHandler, TradeDealPushHandler)):
+            event = "order_push" if isinstance(handler, TradeOrderPushHandler) else "deal_push"
+            callback = handler.callback
+
+            def recorded(data):
+                self._recorder.record(event, data)
+                callback(data)
+
+            handler.callback = recorded
+        return self._ctx.set_handler(handler)
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import Future
+from time import perf_counter_ns
+
+from trade import metrics
+from trade.ratelimit import RateLimiter
+
+# Futu OpenAPI request limits per account, endpoint -> (max number of requests, period in seconds)
+FUTU_LIMITS = {
+    "place_order": (15, 30),
+    "modify_order": (20, 30),
+    "order_list_query": (10, 30),
+    "position_list_query": (10, 30),
+    "get_market_snapshot": (60, 30),
+    "get_stock_basicinfo": (10, 30),
+    "request_history_kline": (60, 30),
+}
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class RequestScheduler:
+    """
+    Pace the OpenD requests with a rate limiter per endpoint and coalesce the identical requests in flight
+
+    A request waits until its endpoint allows it before it is sent, so bursts are spread over the period instead of
+    being rejected by OpenD. When the same request, i.e. same endpoint and arguments, is already in flight, the caller
+    waits for the response of the request in flight instead of sending it again.
+    """
+
+    def __init__(self, limits=None, clock=time.monotonic, sleep=time.sleep):
+        """
+
+        :param limits: endpoint -> (max number of requests, period in seconds), default to FUTU_LIMITS
+        :type limits: dict[str, (int, float)]
+        :param clock: function returning the current time in seconds, e.g. the market time of a replay
+        :type clock: callable
+        :param sleep: function sleeping for the given seconds of the clock
+        :type sleep: callable
+        """
+        limits = FUTU_LIMITS if limits is None else limits
+        self.limiters = {endpoint: RateLimiter(count, period, clock=clock, sleep=sleep)
+                        for endpoint, (count, period) in limits.items()}
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        # (endpoint, args) -> future of the request in flight
+        self._in_flight = {}
+
+    def limiter(self, endpoint):
+        """
+        :return: the rate limiter of an endpoint, None if the endpoint is not limited
+        :rtype: RateLimiter or None
+        """
+        return self.limiters.get(endpoint)
+
+    def pace(self, endpoint):
+        """
+        Wait until the endpoint allows a request, if the endpoint is limited
+        """
+        limiter = self.limiters.get(endpoint)
+        if limiter is not None:
+            start = perf_counter_ns()
+            if limiter.acquire():
+                metrics.stage(f"{endpoint}_throttle").record(perf_counter_ns() - start)
+
+    def call(self, endpoint, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) paced by the endpoint, sharing the result with the identical calls in flight
+
+        Only use it for requests without side effects, e.g. queries.
+
+        :param endpoint: endpoint name, e.g. 'get_market_snapshot'
+        :type endpoint: str
+        :param func: function sending the request
+        :type func: callable
+        :return: the result of func
+        """
+        key = (endpoint, _freeze(args), _freeze(kwargs))
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            self.pace(endpoint)
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class TTLCache:
+    """
+    Cache of values expiring ttl seconds after they are put
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        """
+
+        :param ttl: seconds to keep a value
+        :type ttl: float
+        :param clock: function returning the current time in seconds
+        :type clock: callable
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._values = {}
+
+    def get(self, key):
+        """
+        :return: the value of key, None if missing or expired
+        """
+        item = self._values.get(key)
+        if item is None:
+            return None
+        expiry, value = item
+        if self.clock() >= expiry:
+            return None
+        return value
+
+    def put(self, key, value):
+        self._values[key] = (self.clock() + self.ttl, value)
+
+    def clear(self):
+        self._values.clear()
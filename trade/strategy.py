@@ -1,19 +1,38 @@
 import logging
+from array import array
 from bisect import bisect_right
 
 logger = logging.getLogger("futu-grid-trading")
 
+GRID_TYPES = ["arithmetic", "geometric"]
+# the README advice, the cash left for the market orders to fill at a worse price
+CAPITAL_USE_LIMIT = 0.9
+
+
+def _round_half_even_div(a, b):
+    """
+    round(a / b) for integers without float error, halves are rounded to even like round()
+    """
+    q, r = divmod(a, b)
+    if 2 * r > b or (2 * r == b and q % 2 == 1):
+        q += 1
+    return q
+
 
 class GridTradingStrategy:
-    def __init__(self, grid_upper_limit_price, grid_lower_limit_price, grid_count, grid_lower_limit_position,
-                 ie_max_position, lot_size, ie_lot_size):
+    __slots__ = ["grid_count", "lot_size", "ie_lot_size", "position_per_grid", "ie_position_per_grid", "_grids",
+                 "_min_positions", "_ie_positions"]
+
+    def __init__(self, grid_upper_limit_price=None, grid_lower_limit_price=None, grid_count=None,
+                 grid_lower_limit_position=None, ie_max_position=None, lot_size=None, ie_lot_size=None,
+                 grid_type="arithmetic", grids=None):
         """
 
-        :param grid_upper_limit_price:
+        :param grid_upper_limit_price: not used if grids is given
         :type grid_upper_limit_price: float
-        :param grid_lower_limit_price:
+        :param grid_lower_limit_price: not used if grids is given
         :type grid_lower_limit_price: float
-        :param grid_count: total number of grids
+        :param grid_count: total number of grids, not used if grids is given
         :type grid_count: int
         :param grid_lower_limit_position: the position when grid is below the lower limit
         :type grid_lower_limit_position: int
@@ -23,9 +42,35 @@ class GridTradingStrategy:
         :type lot_size: int
         :param ie_lot_size: inverse equity lot size
         :type ie_lot_size: int
+        :param grid_type: 'arithmetic' for grids of the same price difference, 'geometric' for grids of the same price
+            ratio
+        :type grid_type: str
+        :param grids: custom grid prices in ascending order, from the lower limit to the upper limit
+        :type grids: list[float]
         """
-        assert grid_count >= 1 and type(grid_count) is int
-        assert grid_upper_limit_price > grid_lower_limit_price
+        assert grid_lower_limit_position is not None and ie_max_position is not None
+        assert lot_size is not None and ie_lot_size is not None
+
+        if grids is not None:
+            grids = [float(price) for price in grids]
+            assert len(grids) >= 2, "Expect at least 2 grid prices but got {}".format(grids)
+            assert all(a < b for a, b in zip(grids, grids[1:])), \
+                "Expect grid prices in ascending order but got {}".format(grids)
+            grid_count = len(grids) - 1
+        else:
+            assert grid_count >= 1 and type(grid_count) is int
+            assert grid_upper_limit_price > grid_lower_limit_price
+            assert grid_type in GRID_TYPES, "Expect grid_type to be {} but got '{}'".format(GRID_TYPES, grid_type)
+
+            if grid_type == "arithmetic":
+                price_diff = (grid_upper_limit_price - grid_lower_limit_price) / grid_count
+                grids = [round(grid_lower_limit_price + price_diff * i, 3) for i in range(grid_count + 1)]
+            else:
+                assert grid_lower_limit_price > 0
+                ratio = grid_upper_limit_price / grid_lower_limit_price
+                grids = [round(grid_lower_limit_price * ratio ** (i / grid_count), 3) for i in range(grid_count + 1)]
+            assert all(a < b for a, b in zip(grids, grids[1:])), \
+                "Expect grid prices to be different after rounding but got {}".format(grids)
 
         factor = grid_count * lot_size
         assert grid_lower_limit_position % factor == 0, "Expect grid_lower_limit_position to be divisible by {}" \
@@ -34,25 +79,34 @@ class GridTradingStrategy:
         assert ie_max_position % ie_factor == 0, "Expect ie_max_position to be divisible by {}" \
                                                  " but got {}".format(ie_factor, ie_max_position)
 
-        price_diff = (grid_upper_limit_price - grid_lower_limit_price) / grid_count
-        self.grids = []
-        for i in range(grid_count + 1):
-            price = round(grid_lower_limit_price + price_diff * i, 3)
-            self.grids.append(price)
-
-        self.position_per_grid = grid_lower_limit_position / grid_count
-        self.ie_position_per_grid = ie_max_position / grid_count
+        self._grids = array('d', grids)
+        self.position_per_grid = int(grid_lower_limit_position) // grid_count
+        self.ie_position_per_grid = int(ie_max_position) // grid_count
 
         self.lot_size = lot_size
         self.ie_lot_size = ie_lot_size
         self.grid_count = grid_count
 
+        # min position of every grid index, from below the lower limit (0) to above the upper limit (grid_count + 1),
+        # the max position is one more grid
+        self._min_positions = array('q', [(grid_count - i) * self.position_per_grid for i in range(grid_count + 2)])
+        # inverse equity position of every inverse equity grid index, from -1 to grid_count + 1
+        self._ie_positions = array('q', [i * self.ie_position_per_grid for i in range(-1, grid_count + 2)])
+
         logger.debug(f"lot_size={lot_size}, ie_lot_size={ie_lot_size}, "
                      f"grid_lower_limit_position={grid_lower_limit_position}, ie_max_position={ie_max_position}, "
                      f"position_per_grid={self.position_per_grid}, ie_position_per_grid={self.ie_position_per_grid}")
 
         logger.info(f"grids={self.grids}")
 
+    @property
+    def grids(self):
+        """
+        :return: grid prices from the lower limit to the upper limit
+        :rtype: list[float]
+        """
+        return self._grids.tolist()
+
     def cal_grid_index_by_price(self, price):
         """
         calculate which grid the price falls in
@@ -62,7 +116,7 @@ class GridTradingStrategy:
         :return: grid index
         :rtype: int
         """
-        grid_index = bisect_right(self.grids, price)
+        grid_index = bisect_right(self._grids, price)
         return grid_index
 
     def cal_order_quantity(self, price, position, ie_position):
@@ -79,8 +133,8 @@ class GridTradingStrategy:
             do nothing
         :rtype: int, int
         """
-        grid_index = self.cal_grid_index_by_price(price)
-        min_grid_position = (self.grid_count - grid_index) * self.position_per_grid
+        grid_index = bisect_right(self._grids, price)
+        min_grid_position = self._min_positions[grid_index]
         max_grid_position = min_grid_position + self.position_per_grid
 
         if position < min_grid_position:
@@ -88,19 +142,19 @@ class GridTradingStrategy:
         elif position > max_grid_position:
             new_position = max_grid_position
         else:
-            new_position = position
+            new_position = int(position)
 
         order_quantity = int(new_position - position)
 
-        logger.debug(f"grid_index={grid_index}, min_grid_position={min_grid_position}, "
-                     f"max_grid_position={max_grid_position}, new_position={new_position}, "
-                     f"order_quantity={order_quantity}")
+        logger.debug("grid_index=%s, min_grid_position=%s, max_grid_position=%s, new_position=%s, order_quantity=%s",
+                     grid_index, min_grid_position, max_grid_position, new_position, order_quantity)
 
-        ie_grid_index = round(self.grid_count - new_position / self.position_per_grid)
-        ie_new_position = ie_grid_index * self.ie_position_per_grid
+        # the inverse equity holds the grids not held by the stock, _min_positions[0] is the position of all grids
+        ie_grid_index = _round_half_even_div(self._min_positions[0] - new_position, self.position_per_grid)
+        ie_new_position = self._ie_positions[ie_grid_index + 1]
         ie_order_quantity = int(ie_new_position - ie_position)
 
-        logger.debug(
-            f"ie_grid_index={ie_grid_index}, ie_new_position={ie_new_position}, ie_order_quantity={ie_order_quantity}")
+        logger.debug("ie_grid_index=%s, ie_new_position=%s, ie_order_quantity=%s", ie_grid_index, ie_new_position,
+                     ie_order_quantity)
 
         return order_quantity, ie_order_quantity
@@ -0,0 +1,202 @@
+import itertools
+import logging
+import os
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from trade.backtest import backtest
+from trade.strategy import GridTradingStrategy
+from trade.table import format_table as _format_table
+
+logger = logging.getLogger("futu-grid-trading")
+
+PARAM_NAMES = ["grid_upper_limit_price", "grid_lower_limit_price", "grid_count", "grid_lower_limit_position",
+               "ie_max_position", "grid_type"]
+# parameters which may be left out of the parameter grid
+DEFAULT_PARAMS = {"grid_type": "arithmetic"}
+METRIC_NAMES = ["total_return", "turnover", "max_drawdown", "max_capital_use", "order_count"]
+
+# names of the shared memory of the prices and their shape, set by _init_worker
+_names = None
+_shape = None
+
+
+def expand_values(spec):
+    """
+    Expand the values of a parameter
+
+    :param spec: a single value, a list of values or a range dict with 'start', 'stop' (inclusive) and 'step'
+    :type spec: int or float or list or dict
+    :return: values
+    :rtype: list
+    """
+    if isinstance(spec, dict):
+        start, stop, step = spec['start'], spec['stop'], spec['step']
+        assert step > 0, "Expect step to be positive but got {}".format(step)
+        count = int(round((stop - start) / step)) + 1
+        values = [start + step * i for i in range(count)]
+        if all(isinstance(v, int) for v in (start, stop, step)):
+            return values
+        return [round(v, 3) for v in values]
+    elif isinstance(spec, list):
+        return spec
+    else:
+        return [spec]
+
+
+def expand_param_grid(param_grid):
+    """
+    Expand a parameter grid into all the combinations
+
+    :param param_grid: parameter name -> value spec, see expand_values
+    :type param_grid: dict
+    :return: list of parameter dicts
+    :rtype: list[dict]
+    """
+    param_grid = {**DEFAULT_PARAMS, **param_grid}
+    missing = set(PARAM_NAMES) - set(param_grid)
+    assert not missing, "Expect parameters {} in the parameter grid".format(sorted(missing))
+    values = [expand_values(param_grid[name]) for name in PARAM_NAMES]
+    return [dict(zip(PARAM_NAMES, combination)) for combination in itertools.product(*values)]
+
+
+def validate_params(params_list, lot_size, ie_lot_size):
+    """
+    Drop the parameters rejected by the GridTradingStrategy constructor, e.g. positions not divisible by the grid count
+    and lot size
+
+    :param params_list: list of parameter dicts
+    :type params_list: list[dict]
+    :param lot_size: lot size
+    :type lot_size: int
+    :param ie_lot_size: inverse equity lot size
+    :type ie_lot_size: int
+    :return: valid parameter dicts
+    :rtype: list[dict]
+    """
+    valid = []
+    for params in params_list:
+        try:
+            GridTradingStrategy(**params, lot_size=lot_size, ie_lot_size=ie_lot_size)
+        except AssertionError as e:
+            logger.debug(f"Invalid parameters {params}, {e}")
+            continue
+        valid.append(params)
+    return valid
+
+
+def cal_metrics(result, prices, ie_prices, cash):
+    """
+    Summarize a backtest result
+
+    :param result: backtest result of a single path
+    :type result: trade.backtest.BacktestResult
+    :param prices: stock prices
+    :type prices: numpy.ndarray
+    :param ie_prices: inverse equity prices
+    :type ie_prices: numpy.ndarray
+    :param cash: initial cash
+    :type cash: float
+    :return: metric name -> value
+    :rtype: dict
+    """
+    traded_value = np.abs(result.order_quantity * prices) + np.abs(result.ie_order_quantity * ie_prices)
+    peak = np.maximum.accumulate(result.equity, axis=-1)
+    return {
+        'total_return': float(result.equity[-1] / cash - 1),
+        'turnover': float(traded_value.sum() / cash),
+        'max_drawdown': float(np.max(1 - result.equity / peak)),
+        'max_capital_use': float(np.max(cash - result.cash) / cash),
+        'order_count': int(np.count_nonzero(result.order_quantity) + np.count_nonzero(result.ie_order_quantity)),
+    }
+
+
+def _share(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def _init_worker(name, ie_name, shape):
+    global _names, _shape
+    _names = (name, ie_name)
+    _shape = shape
+
+
+def _run(args):
+    shms = [shared_memory.SharedMemory(name=name) for name in _names]
+    try:
+        # the views of the shared memory only live in the frame of _backtest, they are gone once it returns
+        return _backtest(args, *(np.ndarray(_shape, dtype=np.float64, buffer=shm.buf) for shm in shms))
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def _backtest(args, prices, ie_prices):
+    params, lot_size, ie_lot_size, cash, fee_kwargs = args
+    strategy = GridTradingStrategy(**params, lot_size=lot_size, ie_lot_size=ie_lot_size)
+    result = backtest(strategy, prices, ie_prices, cash, **fee_kwargs)
+    return dict(params, **cal_metrics(result, prices, ie_prices, cash))
+
+
+def run_sweep(prices, ie_prices, params_list, lot_size, ie_lot_size, cash, fee_kwargs=None, processes=None):
+    """
+    Backtest every parameter set over the same prices in a process pool
+
+    The prices are copied once into shared memory, the workers read them without copying.
+
+    :param prices: stock prices
+    :type prices: numpy.ndarray
+    :param ie_prices: inverse equity prices
+    :type ie_prices: numpy.ndarray
+    :param params_list: list of valid parameter dicts
+    :type params_list: list[dict]
+    :param lot_size: lot size
+    :type lot_size: int
+    :param ie_lot_size: inverse equity lot size
+    :type ie_lot_size: int
+    :param cash: initial cash
+    :type cash: float
+    :param fee_kwargs: fee model, see trade.backtest.cal_fee
+    :type fee_kwargs: dict
+    :param processes: number of worker processes, default to the number of cores
+    :type processes: int
+    :return: parameters and metrics, sorted by total return descending
+    :rtype: list[dict]
+    """
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    ie_prices = np.ascontiguousarray(ie_prices, dtype=np.float64)
+    assert prices.shape == ie_prices.shape, "Expect prices and ie_prices to have the same shape"
+
+    processes = processes or os.cpu_count()
+    tasks = [(params, lot_size, ie_lot_size, cash, fee_kwargs or {}) for params in params_list]
+    chunksize = max(1, len(tasks) // (processes * 4))
+
+    shm = _share(prices)
+    ie_shm = _share(ie_prices)
+    try:
+        with Pool(processes, initializer=_init_worker, initargs=(shm.name, ie_shm.name, prices.shape)) as pool:
+            results = list(pool.imap_unordered(_run, tasks, chunksize=chunksize))
+    finally:
+        for s in (shm, ie_shm):
+            s.close()
+            s.unlink()
+
+    results.sort(key=lambda r: r['total_return'], reverse=True)
+    return results
+
+
+def format_table(results, top=None):
+    """
+    Format the sweep results as a text table
+
+    :param results: parameters and metrics
+    :type results: list[dict]
+    :param top: number of rows, default to all
+    :type top: int
+    :return: table
+    :rtype: str
+    """
+    return _format_table(results[:top], PARAM_NAMES + METRIC_NAMES)
@@ -0,0 +1,34 @@
+def format_value(value, digits=4):
+    """
+    Format a cell of a text table
+
+    :param value: value of the cell, the floats are rounded
+    :type value: object
+    :param digits: decimal digits of the floats
+    :type digits: int
+    :return: text of the cell
+    :rtype: str
+    """
+    if isinstance(value, float):
+        return "{:.{}f}".format(value, digits)
+    return str(value)
+
+
+def format_table(rows, columns, digits=4):
+    """
+    Format rows as a text table of right aligned columns under their names, e.g. the reports of the scripts
+
+    :param rows: rows holding the columns
+    :type rows: list[dict]
+    :param columns: names of the columns to show, in order
+    :type columns: list[str]
+    :param digits: decimal digits of the floats
+    :type digits: int
+    :return: table
+    :rtype: str
+    """
+    cells = [[format_value(row[c], digits) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.rjust(w) for v, w in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
@@ -0,0 +1,201 @@
+import logging
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+
+import yaml
+
+logger = logging.getLogger("futu-grid-trading")
+
+# Hong Kong has no daylight saving time
+HKT = timezone(timedelta(hours=8))
+DEFAULT_CALENDAR_FILE = Path(__file__).with_name("hk_calendar.yml")
+MORNING = (time(9, 30), time(12, 0))
+AFTERNOON = (time(13, 0), time(16, 0))
+# the longest stretch of days without a session, e.g. Lunar New Year around a weekend
+MAX_CLOSED_DAYS = 14
+
+
+def _parse_time(value):
+    if isinstance(value, int):
+        # yaml reads unquoted 09:30 as sexagesimal minutes
+        return time(value // 60, value % 60)
+    return datetime.strptime(str(value), "%H:%M").time()
+
+
+def _subtract(sessions, start, end):
+    result = []
+    for session_start, session_end in sessions:
+        if end <= session_start or start >= session_end:
+            result.append((session_start, session_end))
+            continue
+        if session_start < start:
+            result.append((session_start, start))
+        if end < session_end:
+            result.append((end, session_end))
+    return result
+
+
+class TradingCalendar:
+    """
+    Trading sessions of the Hong Kong stock exchange in Hong Kong time
+
+    The special days are loaded once into a dict, so every query is a dict lookup and a check of at most two sessions.
+    The days of the years not listed in the calendar are assumed to be full trading days from Monday to Friday.
+    """
+
+    def __init__(self, years=(), holidays=(), half_days=(), closures=()):
+        """
+
+        :param years: the years whose holidays are listed
+        :type years: list[int]
+        :param holidays: days without trading
+        :type holidays: list[datetime.date]
+        :param half_days: days with the morning session only
+        :type half_days: list[datetime.date]
+        :param closures: list of (day, start, end) closed in Hong Kong time, e.g. typhoon or black rainstorm
+        :type closures: list[(datetime.date, datetime.time, datetime.time)]
+        """
+        self.years = set(years)
+        # date -> list of (open, close) epoch seconds, only the days different from a full trading day
+        self._special = {}
+        for day in holidays:
+            self._special[day] = []
+        for day in half_days:
+            self._special.setdefault(day, [MORNING])
+        for day, start, end in closures:
+            sessions = self._special.get(day, [MORNING, AFTERNOON])
+            self._special[day] = _subtract(sessions, start, end)
+        self._warned_years = set()
+
+    @classmethod
+    def load(cls, path=DEFAULT_CALENDAR_FILE):
+        """
+        Load a calendar file, see trade/hk_calendar.yml
+
+        :param path: yaml file
+        :type path: str or Path
+        :return: calendar
+        :rtype: TradingCalendar
+        """
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+        closures = [(c['date'], _parse_time(c.get('start', '00:00')), _parse_time(c.get('end', '23:59')))
+                    for c in config.get('closures') or []]
+        return cls(config.get('years') or [], config.get('holidays') or [], config.get('half_days') or [], closures)
+
+    def sessions(self, day):
+        """
+        :param day: day in Hong Kong
+        :type day: datetime.date
+        :return: list of (open, close) epoch seconds of the sessions of the day
+        :rtype: list[(float, float)]
+        """
+        times = self._special.get(day)
+        if times is None:
+            if day.weekday() >= 5:
+                return []
+            if day.year not in self.years and day.year not in self._warned_years:
+                self._warned_years.add(day.year)
+                logger.warning(f"Holidays of {day.year} are not in the trading calendar, assume every weekday is "
+                               f"a trading day")
+            times = [MORNING, AFTERNOON]
+        return [(datetime.combine(day, start, HKT).timestamp(), datetime.combine(day, end, HKT).timestamp())
+                for start, end in times]
+
+    def session_at(self, t):
+        """
+        :param t: epoch seconds
+        :type t: float
+        :return: (open, close) epoch seconds of the session at t, None if the market is closed
+        :rtype: (float, float) or None
+        """
+        day = datetime.fromtimestamp(t, HKT).date()
+        for session in self.sessions(day):
+            if session[0] <= t < session[1]:
+                return session
+        return None
+
+    def is_open(self, t):
+        """
+        :param t: epoch seconds
+        :type t: float
+        :return: if the market is open at t
+        :rtype: bool
+        """
+        return self.session_at(t) is not None
+
+    def next_open(self, t):
+        """
+        :param t: epoch seconds
+        :type t: float
+        :return: epoch seconds of the next session open, t if the market is open
+        :rtype: float
+        """
+        day = datetime.fromtimestamp(t, HKT).date()
+        for i in range(MAX_CLOSED_DAYS + 1):
+            for session_open, session_close in self.sessions(day + timedelta(days=i)):
+                if t < session_close:
+                    return max(t, session_open)
+        raise ValueError("No session in {} days after {}".format(MAX_CLOSED_DAYS, datetime.fromtimestamp(t, HKT)))
+
+
+class SessionGate:
+    """
+    Tell if the market is open from the calendar and confirm it with OpenD once per session
+
+    OpenD is only asked at the first check of a session. If OpenD says the market is closed although the calendar says
+    open, e.g. an unexpected closure, OpenD is asked again every recheck_interval seconds until the session closes.
+    """
+
+    def __init__(self, calendar, confirm, now, recheck_interval=60):
+        """
+
+        :param calendar: trading calendar
+        :type calendar: TradingCalendar
+        :param confirm: function asking OpenD if the market is open, e.g. trade.api.is_market_open
+        :type confirm: callable
+        :param now: function returning the current epoch seconds, e.g. trade.api.market_now
+        :type now: callable
+        :param recheck_interval: seconds between asking OpenD again when it disagrees with the calendar
+        :type recheck_interval: float
+        """
+        self.calendar = calendar
+        self.confirm = confirm
+        self.now = now
+        self.recheck_interval = recheck_interval
+        self._confirmed = None
+        self._checked = None
+
+    def is_open(self):
+        """
+        :return: if the market is open
+        :rtype: bool
+        """
+        t = self.now()
+        session = self.calendar.session_at(t)
+        if session is None:
+            return False
+        if session == self._confirmed:
+            return True
+        if self._checked is not None and self._checked[0] == session and t - self._checked[1] < self.recheck_interval:
+            return False
+
+        self._checked = (session, t)
+        if self.confirm():
+            self._confirmed = session
+            return True
+        logger.warning("Market is closed according to OpenD but open according to the trading calendar")
+        return False
+
+    def seconds_until_open(self):
+        """
+        :return: seconds until the market may be open, 0 if it is open, at most recheck_interval if OpenD disagrees
+            with the calendar
+        :rtype: float
+        """
+        t = self.now()
+        if self.is_open():
+            return 0
+        if self.calendar.is_open(t):
+            return max(self._checked[1] + self.recheck_interval - t, 0)
+        return self.calendar.next_open(t) - t